@@ -45,19 +45,66 @@ help_strict_match = 'Whether the user wants a strict match of genres or not (def
 help_lower_bound = 'A lower bound on the number of episodes/chapters/volumes.'
 help_upper_bound = 'An upper bound on the number of episodes/chapters/volumes.'
 help_adult = 'Whether the user is okay with series marked as \'Adult\' (default = False).'
-
-
-def add_args() -> argparse.Namespace:
+help_fetch_mode = 'How the user\'s list is downloaded: a single `MediaListCollection` request, or paginating ' \
+                  'through `Page.mediaList` (default = collection).'
+help_refresh = 'Download the user\'s list again, even if a fresh copy is cached.'
+help_offline = 'Never use the network, only cached lists (however old), cached descriptions and the cached ' \
+               'genre list.'
+help_cache_ttl = 'The number of seconds for which a cached list is used before it is downloaded again ' \
+                 '(default = 86400).'
+help_full_sync_ttl = 'The number of seconds after which a cached list is downloaded in full again, instead of only ' \
+                     'its changed entries. The scores, statuses and genres of media whose entries haven\'t changed ' \
+                     'can be this old (default = 259200).'
+help_rank = 'How recommendations are ranked: by AniList score, or by similarity to the entries the user has ' \
+            'completed (and how they scored them) blended with AniList score. Similarity ranking needs NumPy ' \
+            '(default = score).'
+help_usernames = 'A file with one AniList username per line, or `-` to read them from stdin (default = -).'
+help_workers = 'The number of users whose recommendations are generated at the same time (default = 8).'
+help_processes = 'Rank the users\' lists on this many worker processes, writing the results in the order of the ' \
+                 'usernames. Only ranking by score is supported (default = 0, rank in the fetching threads).'
+help_collaborative = 'Recommend media that aren\'t on the user\'s list, which users with a similar taste liked, ' \
+                     'instead of entries from the list. Needs NumPy and an index built by `index.py build`.'
+help_index_command = '`collect` fetches and stores the ratings of the users in a file, `build` (re)builds the ' \
+                     'index from every stored rating.'
+help_collect_workers = 'The number of users whose ratings are fetched at the same time (default = 8).'
+help_index_path = 'The directory of the index (default = `<type>-index` in the cache directory).'
+help_neighbours = 'The number of similar media kept for each piece of media (default = 50).'
+help_full = 'Recompute every piece of media, instead of only those whose ratings changed since the last build.'
+help_profile = 'Time each stage of the run (requests, decoding, building media, filtering, ranking, ...) and print a ' \
+               'breakdown, along with counters such as the number of requests and entries, to stderr.'
+help_profile_capture = 'Also run under cProfile (`cpu`) or tracemalloc (`memory`), and print the slowest functions ' \
+                       'or the biggest allocations to stderr. Can be given twice.'
+help_metrics_file = 'Write the stage timings and counters to this file when the batch is done: as Prometheus text if ' \
+                    'it ends in `.prom`, as JSON otherwise. The timings are recorded even without `--profile`.'
+help_server_profile = 'Time each stage of every request, and serve the timings and counters on `GET /metrics`.'
+help_host = 'The address the server listens on (default = 127.0.0.1).'
+help_port = 'The port the server listens on (default = 8080).'
+help_max_users = 'The number of user lists the server keeps in memory (default = 1024).'
+help_list_ttl = 'The number of seconds for which the server reuses a user list held in memory (default = 300).'
+help_max_media = 'The number of distinct anime/manga the server keeps in memory, shared by every list ' \
+                 '(default = 200000).'
+help_max_materialized = 'The number of precomputed recommendations (one per user and combination of options) the ' \
+                        'server keeps, 0 to compute every request (default = 10000).'
+help_refresh_interval = 'The number of seconds between the rounds in which the server recomputes the precomputed ' \
+                        'recommendations which have gone out of date (default = 60).'
+
+
+def add_args(batch: bool = False) -> argparse.Namespace:
     """Adds command line arguments that the user can use and returns them.
 
     Also fixes any input problems, such as `args.genre` bieng a 2D list instead of a 1D list.
 
+    Args:
+        batch (bool): Whether the arguments are for batch mode, which takes a file of usernames (and the number of
+            workers) instead of a single username.
+
     Returns:
         args (argparse.Namespace): The arguments that the user entered and their values.
     """
     parser = argparse.ArgumentParser(description=program_description, formatter_class=argparse.RawTextHelpFormatter)
 
-    parser.add_argument('username', help=help_username)
+    if not batch:
+        parser.add_argument('username', help=help_username)
     parser.add_argument('type', help=help_type, choices=['anime', 'manga'])
     parser.add_argument('-c', '--count', help=help_count, default=5, type=int)
     parser.add_argument('-g', '--genre', help=help_genre, action='append', nargs='+')
@@ -65,6 +112,23 @@ def add_args() -> argparse.Namespace:
     parser.add_argument('-lb', '--lower-bound', help=help_lower_bound, type=int)
     parser.add_argument('-ub', '--upper-bound', help=help_upper_bound, type=int)
     parser.add_argument('-a', '--adult', help=help_adult, action="store_true", default=False)
+    parser.add_argument('-r', '--rank', help=help_rank, choices=['score', 'similarity'], default='score')
+    parser.add_argument('--collaborative', help=help_collaborative, action='store_true', default=False)
+    parser.add_argument('--fetch-mode', help=help_fetch_mode, choices=['collection', 'page'], default='collection')
+    parser.add_argument('--cache-ttl', help=help_cache_ttl, default=24 * 60 * 60, type=float)
+    parser.add_argument('--full-sync-ttl', help=help_full_sync_ttl, default=3 * 24 * 60 * 60, type=float)
+
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument('--refresh', help=help_refresh, action='store_true', default=False)
+    cache_group.add_argument('--offline', help=help_offline, action='store_true', default=False)
+    parser.add_argument('--profile', help=help_profile, action='store_true', default=False)
+    parser.add_argument('--profile-capture', help=help_profile_capture, action='append', choices=['cpu', 'memory'])
+
+    if batch:
+        parser.add_argument('usernames', help=help_usernames, nargs='?', default='-')
+        parser.add_argument('-w', '--workers', help=help_workers, default=8, type=int)
+        parser.add_argument('-p', '--processes', help=help_processes, default=0, type=int)
+        parser.add_argument('--metrics-file', help=help_metrics_file)
 
     args = parser.parse_args()
 
@@ -77,6 +141,52 @@ def add_args() -> argparse.Namespace:
     return args
 
 
+def add_server_args() -> argparse.Namespace:
+    """Adds the command line arguments for the recommendation server and returns them.
+
+    The recommendation options themselves (type, count, genre, etc.) are passed with each request instead, see
+    `server.parse_query`.
+
+    Returns:
+        args (argparse.Namespace): The arguments that the user entered and their values.
+    """
+    parser = argparse.ArgumentParser(description='Serves AniList recommendations over HTTP, as JSON.')
+
+    parser.add_argument('--host', help=help_host, default='127.0.0.1')
+    parser.add_argument('--port', help=help_port, default=8080, type=int)
+    parser.add_argument('--max-users', help=help_max_users, default=1024, type=int)
+    parser.add_argument('--list-ttl', help=help_list_ttl, default=300, type=float)
+    parser.add_argument('--max-media', help=help_max_media, default=200_000, type=int)
+    parser.add_argument('--max-materialized', help=help_max_materialized, default=10_000, type=int)
+    parser.add_argument('--refresh-interval', help=help_refresh_interval, default=60, type=float)
+    parser.add_argument('--fetch-mode', help=help_fetch_mode, choices=['collection', 'page'], default='collection')
+    parser.add_argument('--cache-ttl', help=help_cache_ttl, default=24 * 60 * 60, type=float)
+    parser.add_argument('--full-sync-ttl', help=help_full_sync_ttl, default=3 * 24 * 60 * 60, type=float)
+    parser.add_argument('--profile', help=help_server_profile, action='store_true', default=False)
+
+    return parser.parse_args()
+
+
+def add_index_args() -> argparse.Namespace:
+    """Adds the command line arguments for collecting ratings and building the collaborative index, and returns them.
+
+    Returns:
+        args (argparse.Namespace): The arguments that the user entered and their values.
+    """
+    parser = argparse.ArgumentParser(description='Builds the index behind collaborative ("users like you") '
+                                                 'recommendations.')
+
+    parser.add_argument('command', help=help_index_command, choices=['collect', 'build'])
+    parser.add_argument('type', help=help_type, choices=['anime', 'manga'])
+    parser.add_argument('usernames', help=help_usernames, nargs='?', default='-')
+    parser.add_argument('-w', '--workers', help=help_collect_workers, default=8, type=int)
+    parser.add_argument('--path', help=help_index_path)
+    parser.add_argument('--neighbours', help=help_neighbours, default=50, type=int)
+    parser.add_argument('--full', help=help_full, action='store_true', default=False)
+
+    return parser.parse_args()
+
+
 def check_args(args: argparse.Namespace) -> None:
     """Makes sure that there's no errors in the values entered for the command line arguments.
 
@@ -85,16 +195,30 @@ def check_args(args: argparse.Namespace) -> None:
 
     Raises:
         ValueError: if `count` <= 0
+        ValueError: if `workers` <= 0 (batch mode only)
+        ValueError: if `processes` < 0, or is given with another ranking than by score (batch mode only)
         ValueError: if `upper-bound` <= 0
         ValueError: if `lower-bound` <= 0
         ValueError: if `upper-bound` < `lower-bound`
         ValueError: if `genre` is not a valid AniList genre
         ValueError: if `strict_match` is `True` but there are no genres
+        ValueError: if both `collaborative` and `offline` are given
     """
     # `count`
     if args.count <= 0:
         raise ValueError('`count` must be greater than 0')
 
+    # `workers`
+    if getattr(args, 'workers', 1) <= 0:
+        raise ValueError('`workers` must be greater than 0')
+
+    # `processes`
+    processes = getattr(args, 'processes', 0)
+    if processes < 0:
+        raise ValueError('`processes` must be 0 or greater')
+    if processes and (args.rank != 'score' or args.collaborative):
+        raise ValueError('`processes` only supports ranking by score')
+
     # `upper-bound` and `lower-bound`
     lower_bound = args.lower_bound
     upper_bound = args.upper_bound
@@ -113,7 +237,8 @@ def check_args(args: argparse.Namespace) -> None:
 
     # `genre`
     if args.genre is not None:
-        anilist_genres_lowercase = list(map(str.lower, prep.anilist_genres))
+        # Served from the on-disk cache (or the bundled snapshot) on most runs, so this rarely touches the network.
+        anilist_genres_lowercase = prep.get_genres_lowercase(offline=getattr(args, 'offline', False))
 
         for genre in args.genre:
             if genre not in anilist_genres_lowercase:
@@ -124,6 +249,10 @@ def check_args(args: argparse.Namespace) -> None:
         if args.strict_match:
             raise ValueError('`strict-match` requires at least one genre')
 
+    # `collaborative`
+    if getattr(args, 'collaborative', False) and getattr(args, 'offline', False):
+        raise ValueError('`collaborative` looks up media which aren\'t on the user\'s list, so it can\'t be `offline`')
+
 
 def main():
     pass
@@ -0,0 +1,193 @@
+"""Generates recommendations for many AniList users in one process, writing them out as JSON Lines.
+
+Every user shares the same HTTP connection pool, request scheduler, list cache and genre catalogue, so the per-user
+cost is just fetching (or loading) their list and ranking it. When ranking by score, a list served from the cache is
+ranked straight from its snapshot (see `snapshot.py`), and lists that have to be downloaded share a media catalogue
+(see `catalogue.py`), so a title on many users' lists is only built, and has its description fetched, once.
+"""
+
+
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import IO, Iterable, Iterator
+import args
+import client
+import profiling
+from cache import CacheMissError
+from catalogue import MediaCatalogue
+from fetch import Fetcher
+from main import get_cached_fetcher, get_media_max_age, get_recommendations
+
+
+def read_usernames(lines: Iterable[str]) -> Iterator[str]:
+    """Yields the usernames in a file, skipping blank lines, comments (starting with `#`) and repeated usernames.
+
+    Args:
+        lines (Iterable[str]): The lines of the file.
+
+    Yields:
+        str: The usernames.
+    """
+    seen = set()
+
+    for line in lines:
+        username = line.strip()
+        if username and not username.startswith('#') and username.lower() not in seen:
+            seen.add(username.lower())
+            yield username
+
+
+def recommend_user(arguments, username: str, fetcher: Fetcher, catalogue: MediaCatalogue | None = None) -> dict:
+    """Generates the recommendations for a single user, catching any errors so that one user can't stop the batch.
+
+    Args:
+        arguments (argparse.Namespace): The arguments that the user entered and their values.
+        username (str): The user's AniList username.
+        fetcher (Fetcher): The fetcher shared by every user in the batch.
+        catalogue (MediaCatalogue | None): The media catalogue shared by every user in the batch, if the lists are
+            ranked by score.
+
+    Returns:
+        dict: The result for the user: their username, the time it took (`latency`, in seconds) and either their
+        `recommendations` or an `error`.
+    """
+    start = time.perf_counter()
+    result: dict
+
+    try:
+        recommendations = get_recommendations(arguments, username, fetcher, catalogue)
+        result = {'username': username, 'recommendations': [media.to_dict() for media in recommendations]}
+    except (client.AniListError, CacheMissError) as error:
+        result = {'username': username, 'error': str(error)}
+    except Exception as error:
+        # Anything else is a bug, but it's still only this user's result that's lost.
+        result = {'username': username, 'error': f'unexpected error: {error!r}'}
+
+    result['latency'] = time.perf_counter() - start
+
+    return result
+
+
+def get_percentile(values: list[float], percentile: float) -> float:
+    """Returns a percentile of a list of values, using the nearest-rank method.
+
+    Args:
+        values (list[float]): The values, which don't have to be sorted.
+        percentile (float): The percentile, from 0 to 100.
+
+    Returns:
+        float: The value at that percentile, or 0 if there are no values.
+    """
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percentile // 100))
+
+    return ordered[int(rank) - 1]
+
+
+def run_batch(arguments, usernames: Iterable[str], output: IO[str]) -> dict:
+    """Generates recommendations for every user, writing each result to `output` as a JSON line as soon as it's done
+    (so the results are in completion order, not input order).
+
+    At most `arguments.workers` users are worked on at the same time, and only a few more than that are read ahead,
+    so that a huge list of usernames doesn't have to be held in memory.
+
+    Args:
+        arguments (argparse.Namespace): The arguments that the user entered and their values.
+        usernames (Iterable[str]): The AniList usernames.
+        output (IO[str]): Where the JSON lines are written to.
+
+    Returns:
+        dict: A summary of the batch: the number of users and errors, the time taken, the throughput and the latency
+        percentiles.
+    """
+    fetcher = get_cached_fetcher(arguments)
+    catalogue = None
+    # Only lists that are ranked by score are read through the catalogue (see `main.get_recommendations`).
+    if getattr(arguments, 'rank', 'score') == 'score' and not getattr(arguments, 'collaborative', False):
+        catalogue = MediaCatalogue(max_age=get_media_max_age(arguments))
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+
+    def write(future: Future) -> None:
+        nonlocal errors
+        result = future.result()
+        latencies.append(result['latency'])
+        errors += 'error' in result
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+
+    with ThreadPoolExecutor(max_workers=arguments.workers) as executor:
+        pending: set[Future] = set()
+
+        for username in usernames:
+            if len(pending) >= arguments.workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future)
+            pending.add(executor.submit(recommend_user, arguments, username, fetcher, catalogue))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                write(future)
+
+    elapsed = time.perf_counter() - start
+
+    return {'users': len(latencies),
+            'errors': errors,
+            'seconds': elapsed,
+            'users_per_second': len(latencies) / elapsed if elapsed else 0.0,
+            'latency_p50': get_percentile(latencies, 50),
+            'latency_p90': get_percentile(latencies, 90),
+            'latency_p99': get_percentile(latencies, 99),
+            **client.get_scheduler().stats()}
+
+
+def format_summary(summary: dict) -> str:
+    """Returns a human readable version of a batch summary (see `run_batch`).
+
+    Args:
+        summary (dict): The batch summary.
+
+    Returns:
+        str: The summary, on a few lines.
+    """
+    return f'{summary["users"]} users ({summary["errors"]} errors) in {summary["seconds"]:.2f}s, ' \
+           f'{summary["users_per_second"]:.1f} users/s\n' \
+           f'latency p50 {summary["latency_p50"] * 1e3:.1f}ms, p90 {summary["latency_p90"] * 1e3:.1f}ms, ' \
+           f'p99 {summary["latency_p99"] * 1e3:.1f}ms\n' \
+           f'{summary["requests"]} requests, {summary["throttles"]} throttles, {summary["retries"]} retries'
+
+
+def main():
+    arguments = args.add_args(batch=True)
+    args.check_args(arguments)
+    profiling.enable(arguments.profile or arguments.metrics_file is not None)
+
+    run = run_batch
+    if arguments.processes:
+        # Imported here, since `parallel` builds on this module.
+        from parallel import run_parallel as run
+
+    with profiling.capture(arguments.profile_capture):
+        if arguments.usernames == '-':
+            summary = run(arguments, read_usernames(sys.stdin), sys.stdout)
+        else:
+            with open(arguments.usernames) as usernames:
+                summary = run(arguments, read_usernames(usernames), sys.stdout)
+
+    print(format_summary(summary), file=sys.stderr)
+    if arguments.profile:
+        print(profiling.format_breakdown(profiling.get_metrics()), file=sys.stderr)
+    if arguments.metrics_file is not None:
+        profiling.write_metrics(arguments.metrics_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,766 @@
+"""A persistent, size-bounded cache of users' media lists, so that repeated runs for the same user don't have to
+download their whole list again. Every stored list also gets a snapshot (see `snapshot.py`), so that a list served
+from the cache can be filtered and ranked without being decoded, and the details (descriptions and tags) fetched for
+recommended media are kept too, so that a warm run doesn't have to fetch them again."""
+
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Iterable, Iterator
+from urllib.parse import quote
+from fetch import Fetcher, fetch_changes, get_high_water_mark, merge_changes, optional_fields
+import prep
+import profiling
+from snapshot import Snapshot, SnapshotWriter
+from user import build_media
+
+
+# Bumped whenever the layout of the `lists` table changes, so that caches written by older versions are discarded.
+schema_version = 3
+
+# The media types whose lists get a snapshot, as opposed to e.g. a user's completed entries ('ANIME:COMPLETED').
+snapshot_types = ('ANIME', 'MANGA')
+
+
+class CacheMissError(LookupError):
+    """Raised when a list has to be served from the cache (i.e. when offline) but isn't in it."""
+
+
+def make_snapshot(entries: Iterable[dict], media_type: str) -> SnapshotWriter:
+    """Returns the snapshot of a list's entries, ready to be written (see `ListCache.put_blob`).
+
+    Args:
+        entries (Iterable[dict]): The entries, each one containing the entry's `status` and its `media`.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+    Returns:
+        SnapshotWriter: The snapshot.
+    """
+    snapshot = SnapshotWriter()
+    for entry in entries:
+        snapshot.add(build_media(entry['media'], media_type, entry['status']))
+
+    return snapshot
+
+
+class ListEncoder:
+    """Compresses the entries of a list one at a time, as they're downloaded, into the form that `ListCache` stores
+    lists in, so that a list can be stored without all of its entries being held at once. Entries are encoded as they
+    are added, and compressed a batch at a time.
+
+    Attributes:
+        entries (int): The number of entries added so far.
+        high_water_mark (int): The newest `updatedAt` among the entries added so far.
+    """
+    # The number of bytes of encoded entries that are compressed at a time.
+    batch_size = 64 * 1024
+
+    _encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def __init__(self) -> None:
+        """Initialises the `ListEncoder` class."""
+        self.entries = 0
+        self.high_water_mark = 0
+
+        self._compressor = zlib.compressobj()
+        self._parts: list[bytes] = []
+        self._batch = ['[']
+        self._batch_length = 0
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `ListEncoder` class.
+
+        Returns:
+            str: A string representation of the `ListEncoder` class and it's initialisation arguments.
+        """
+        return 'ListEncoder()'
+
+    def add(self, entry: dict) -> None:
+        """Adds an entry to the list.
+
+        Args:
+            entry (dict): An entry of the user's list.
+        """
+        encoded = self._encode(entry)
+        if self.entries:
+            self._batch.append(',')
+        self._batch.append(encoded)
+        self._batch_length += len(encoded)
+        self.entries += 1
+
+        if (updated_at := entry.get('updatedAt') or 0) > self.high_water_mark:
+            self.high_water_mark = updated_at
+
+        if self._batch_length >= self.batch_size:
+            self._compress()
+
+    def _compress(self) -> None:
+        """Compresses the entries added since the last batch."""
+        self._parts.append(self._compressor.compress(''.join(self._batch).encode()))
+        self._batch.clear()
+        self._batch_length = 0
+
+    def finish(self) -> bytes:
+        """Returns the compressed list. No more entries can be added afterwards.
+
+        Returns:
+            bytes: The list, as compressed JSON.
+        """
+        self._batch.append(']')
+        self._compress()
+        self._parts.append(self._compressor.flush())
+
+        return b''.join(self._parts)
+
+
+class ListCache:
+    """A SQLite-backed store of users' media lists, keyed by (username, media type).
+
+    Lists are stored as compressed JSON. Entries older than `ttl` seconds are considered stale, and once the stored
+    lists take up more than `max_bytes` the least recently used ones are evicted. Alongside each list its sync state is
+    kept: the newest `updatedAt` it has seen (its high-water mark) and when it was last downloaded in full. So are the
+    optional media fields (see `fetch.optional_fields`) it was fetched with, since a list without e.g. tags can't be
+    used by a run which needs them.
+
+    Each list of media is also written to a snapshot file, stamped with when the list was stored, so that a snapshot is
+    only ever used along with the copy of the list that it was written from (see `open_snapshot`).
+
+    The details of media (see `fetch.fetch_details`) are kept in a table of their own, keyed by media ID, for
+    `details_ttl` seconds.
+
+    Attributes:
+        path (str): The path to the SQLite database.
+        snapshot_dir (str): The directory of the snapshots, next to the database.
+        ttl (float): The number of seconds for which a stored list is considered fresh.
+        max_bytes (int): The maximum total (compressed) size of the stored lists.
+        details_ttl (float): The number of seconds for which the stored details of a piece of media are used.
+    """
+    def __init__(self, path: str | None = None, ttl: float = 24 * 60 * 60, max_bytes: int = 64 * 1024 * 1024,
+                 details_ttl: float = 7 * 24 * 60 * 60) -> None:
+        """Initialises the `ListCache` class.
+
+        Args:
+            path (str | None): The path to the SQLite database. Defaults to `lists.sqlite3` in the cache directory.
+            ttl (float): The number of seconds for which a stored list is considered fresh.
+            max_bytes (int): The maximum total (compressed) size of the stored lists.
+            details_ttl (float): The number of seconds for which the stored details of a piece of media are used.
+        """
+        self.path = path if path is not None else os.path.join(prep.get_cache_dir(), 'lists.sqlite3')
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.details_ttl = details_ttl
+        self.snapshot_dir = f'{self.path}.snapshots'
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+
+        if self._connection.execute('PRAGMA user_version').fetchone()[0] != schema_version:
+            self._connection.execute('DROP TABLE IF EXISTS lists')
+            self._connection.execute(f'PRAGMA user_version = {schema_version}')
+
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS lists (
+                username TEXT NOT NULL,
+                media_type TEXT NOT NULL,
+                entries BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                used_at REAL NOT NULL,
+                high_water_mark INTEGER NOT NULL,
+                full_synced_at REAL NOT NULL,
+                fields TEXT NOT NULL,
+                PRIMARY KEY (username, media_type)
+            )
+        ''')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS details (
+                media_id INTEGER PRIMARY KEY,
+                details TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        ''')
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `ListCache` class.
+
+        Returns:
+            str: A string representation of the `ListCache` class and it's initialisation arguments.
+        """
+        return f'ListCache({self.path}, {self.ttl}, {self.max_bytes}, {self.details_ttl})'
+
+    def get(self, username: str, media_type: str, allow_stale: bool = False,
+            fields: Iterable[str] = ()) -> list[dict] | None:
+        """Returns a stored list, marking it as recently used.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            allow_stale (bool): Whether to return the list even if it is older than `ttl`.
+            fields (Iterable[str]): The optional media fields that the list needs to have.
+
+        Returns:
+            list[dict] | None: The stored entries, or `None` if there is no (fresh) list for the user with `fields`.
+        """
+        key = (username.lower(), media_type)
+
+        with profiling.span('cache'), self._lock:
+            row = self._connection.execute('SELECT entries, fetched_at, fields FROM lists '
+                                           'WHERE username = ? AND media_type = ?', key).fetchone()
+            if row is None or (not allow_stale and time.time() - row[1] >= self.ttl) \
+                    or not set(fields) <= set(row[2].split()):
+                return None
+
+            self._connection.execute('UPDATE lists SET used_at = ? WHERE username = ? AND media_type = ?',
+                                     (time.time(), *key))
+
+        with profiling.span('decode'):
+            return json.loads(zlib.decompress(row[0]))
+
+    def has(self, username: str, media_type: str, allow_stale: bool = False, fields: Iterable[str] = ()) -> bool:
+        """Returns whether a list is stored, like `get` would, but without reading (or decoding) its entries.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            allow_stale (bool): Whether a list older than `ttl` counts.
+            fields (Iterable[str]): The optional media fields that the list needs to have.
+
+        Returns:
+            bool: Whether `get` would return the list.
+        """
+        with profiling.span('cache'), self._lock:
+            row = self._connection.execute('SELECT fetched_at, fields FROM lists WHERE username = ? AND media_type = ?',
+                                           (username.lower(), media_type)).fetchone()
+
+        return row is not None and (allow_stale or time.time() - row[0] < self.ttl) \
+            and set(fields) <= set(row[1].split())
+
+    def get_snapshot_path(self, username: str, media_type: str) -> str:
+        """Returns the path of the snapshot of a list.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            str: The path, in `snapshot_dir`.
+        """
+        return os.path.join(self.snapshot_dir, f'{quote(username.lower(), safe="")}.{media_type.lower()}')
+
+    def open_snapshot(self, username: str, media_type: str, allow_stale: bool = False,
+                      fields: Iterable[str] = ()) -> Snapshot | None:
+        """Opens the snapshot of a stored list, marking the list as recently used, like `get` but without reading (or
+        decoding) the list itself.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            allow_stale (bool): Whether to open the snapshot even if the list is older than `ttl`.
+            fields (Iterable[str]): The optional media fields that the list needs to have.
+
+        Returns:
+            Snapshot | None: The snapshot, which the caller has to close, or `None` if there is no (fresh) list for the
+            user with `fields`, or it has no snapshot (e.g. writing it failed).
+        """
+        key = (username.lower(), media_type)
+
+        with profiling.span('cache'):
+            with self._lock:
+                row = self._connection.execute('SELECT fetched_at, fields FROM lists '
+                                               'WHERE username = ? AND media_type = ?', key).fetchone()
+            if row is None or (not allow_stale and time.time() - row[0] >= self.ttl) \
+                    or not set(fields) <= set(row[1].split()):
+                return None
+
+            try:
+                snapshot = Snapshot(self.get_snapshot_path(username, media_type))
+            except (OSError, ValueError):
+                return None
+            if snapshot.stamp != row[0]:
+                # The snapshot was written from another copy of the list.
+                snapshot.close()
+                return None
+
+            with self._lock:
+                self._connection.execute('UPDATE lists SET used_at = ? WHERE username = ? AND media_type = ?',
+                                         (time.time(), *key))
+
+        return snapshot
+
+    def get_full_synced_at(self, username: str, media_type: str, fields: Iterable[str] = ()) -> float | None:
+        """Returns when a stored list was last downloaded in full, without reading its entries.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            fields (Iterable[str]): The optional media fields that the list needs to have.
+
+        Returns:
+            float | None: The time, from `time.time`, or `None` if there is no stored list for the user with `fields`.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT full_synced_at, fields FROM lists '
+                                           'WHERE username = ? AND media_type = ?',
+                                           (username.lower(), media_type)).fetchone()
+
+        return row[0] if row is not None and set(fields) <= set(row[1].split()) else None
+
+    def get_sync_state(self, username: str, media_type: str,
+                       fields: Iterable[str] = ()) -> tuple[list[dict], int, float, frozenset[str]] | None:
+        """Returns a stored list (however old) along with its sync state.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            fields (Iterable[str]): The optional media fields that the list needs to have.
+
+        Returns:
+            tuple[list[dict], int, float, frozenset[str]] | None: The stored entries, their high-water mark, the time
+            at which the list was last downloaded in full and the optional fields it has, or `None` if there is no
+            stored list for the user with `fields`.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT entries, high_water_mark, full_synced_at, fields FROM lists '
+                                           'WHERE username = ? AND media_type = ?',
+                                           (username.lower(), media_type)).fetchone()
+        if row is None or not set(fields) <= set(row[3].split()):
+            return None
+
+        with profiling.span('decode'):
+            return json.loads(zlib.decompress(row[0])), row[1], row[2], frozenset(row[3].split())
+
+    def put(self, username: str, media_type: str, entries: list[dict], high_water_mark: int | None = None,
+            full_synced_at: float | None = None, fields: Iterable[str] = optional_fields) -> None:
+        """Stores a list, evicting the least recently used lists if the cache has grown too large. A list of media
+        gets a snapshot too (see `open_snapshot`).
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            entries (list[dict]): The entries of the user's list.
+            high_water_mark (int | None): The newest `updatedAt` seen for the list. Defaults to the newest one among
+                `entries`.
+            full_synced_at (float | None): When the list was last downloaded in full. Defaults to now, i.e. `entries`
+                is a full download.
+            fields (Iterable[str]): The optional media fields that the entries were fetched with.
+        """
+        with profiling.span('cache'):
+            blob = zlib.compress(json.dumps(entries, separators=(',', ':')).encode())
+        with profiling.span('snapshot'):
+            snapshot = make_snapshot(entries, media_type) if media_type in snapshot_types else None
+        with profiling.span('cache'):
+            self._store(username, media_type, blob,
+                        high_water_mark if high_water_mark is not None else get_high_water_mark(entries),
+                        full_synced_at, fields, snapshot)
+
+    def put_blob(self, username: str, media_type: str, blob: bytes, high_water_mark: int,
+                 full_synced_at: float | None = None, fields: Iterable[str] = optional_fields,
+                 snapshot: SnapshotWriter | None = None) -> None:
+        """Stores a list which has already been compressed (see `ListEncoder`), like `put`, along with its snapshot
+        if it's given.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            blob (bytes): The entries of the user's list, as compressed JSON.
+            high_water_mark (int): The newest `updatedAt` seen for the list.
+            full_synced_at (float | None): When the list was last downloaded in full. Defaults to now.
+            fields (Iterable[str]): The optional media fields that the entries were fetched with.
+            snapshot (SnapshotWriter | None): The snapshot of the entries (see `make_snapshot`).
+        """
+        with profiling.span('cache'):
+            self._store(username, media_type, blob, high_water_mark, full_synced_at, fields, snapshot)
+
+    def _store(self, username: str, media_type: str, blob: bytes, high_water_mark: int, full_synced_at: float | None,
+               fields: Iterable[str], snapshot: SnapshotWriter | None = None) -> None:
+        """Writes a compressed list (and its snapshot) to the database, then evicts lists if needed (see
+        `put_blob`)."""
+        now = time.time()
+        if full_synced_at is None:
+            full_synced_at = now
+
+        if snapshot is not None:
+            try:
+                with profiling.span('snapshot'):
+                    snapshot.write(self.get_snapshot_path(username, media_type), now)
+            except (OSError, ValueError):
+                # The list is served by decoding it instead. A snapshot left from before has an older stamp.
+                pass
+
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO lists VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (username.lower(), media_type, blob, len(blob), now, now, high_water_mark,
+                                      full_synced_at, ' '.join(sorted(fields))))
+            self._evict()
+
+    def _evict(self) -> None:
+        """Deletes the least recently used lists until the cache fits into `max_bytes`. Must be called with the lock
+        held."""
+        total = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM lists').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._connection.execute('SELECT username, media_type, size FROM lists ORDER BY used_at').fetchall()
+        for username, media_type, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._connection.execute('DELETE FROM lists WHERE username = ? AND media_type = ?', (username, media_type))
+            if media_type in snapshot_types:
+                self._remove_snapshot(self.get_snapshot_path(username, media_type))
+            total -= size
+
+    @staticmethod
+    def _remove_snapshot(path: str) -> None:
+        """Deletes a snapshot file, if it exists."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get_details(self, media_ids: Iterable[int], allow_stale: bool = False) -> dict[int, dict]:
+        """Returns the stored details of media.
+
+        Args:
+            media_ids (Iterable[int]): The IDs of the media.
+            allow_stale (bool): Whether to return details older than `details_ttl` too.
+
+        Returns:
+            dict[int, dict]: The `description` and `tags` of the media whose (fresh) details are stored, keyed by
+            their IDs.
+        """
+        media_ids = list(media_ids)
+        oldest = time.time() - self.details_ttl if not allow_stale else float('-inf')
+        details: dict[int, dict] = {}
+
+        with profiling.span('cache'):
+            # SQLite limits the number of parameters a statement can have.
+            for start in range(0, len(media_ids), 500):
+                batch = media_ids[start:start + 500]
+                with self._lock:
+                    rows = self._connection.execute(f'SELECT media_id, details FROM details WHERE fetched_at > ? '
+                                                    f'AND media_id IN ({", ".join("?" * len(batch))})',
+                                                    (oldest, *batch)).fetchall()
+                details.update((media_id, json.loads(text)) for media_id, text in rows)
+
+        return details
+
+    def put_details(self, details: dict[int, dict]) -> None:
+        """Stores the details of media, and deletes any that have gone stale.
+
+        Args:
+            details (dict[int, dict]): The `description` and `tags` of each piece of media, keyed by its ID (see
+                `fetch.fetch_details`).
+        """
+        now = time.time()
+
+        with profiling.span('cache'), self._lock:
+            self._connection.executemany('INSERT OR REPLACE INTO details VALUES (?, ?, ?)',
+                                         [(media_id, json.dumps(media, separators=(',', ':')), now)
+                                          for media_id, media in details.items()])
+            self._connection.execute('DELETE FROM details WHERE fetched_at <= ?', (now - self.details_ttl,))
+
+    def clear(self) -> None:
+        """Deletes every stored list, their snapshots and the stored details of media."""
+        with self._lock:
+            self._connection.execute('DELETE FROM lists')
+            self._connection.execute('DELETE FROM details')
+            for name in os.listdir(self.snapshot_dir):
+                self._remove_snapshot(os.path.join(self.snapshot_dir, name))
+
+
+class CachedFetcher(Fetcher):
+    """Wraps another fetcher, serving lists from a `ListCache` when possible and storing the lists it downloads.
+
+    Once a stored list goes stale it is brought up to date incrementally: only the entries updated since its
+    high-water mark are downloaded and merged into it. Removing an entry from a list on AniList doesn't leave anything
+    to sync, and neither does a change to a piece of media (its score, popularity, status, genres, ...) rather than to
+    the user's entry for it, so the media of entries that haven't changed keep the fields they were downloaded with.
+    Lists are therefore downloaded in full again every `full_sync_ttl` seconds, which bounds how old those fields can
+    be. (Refreshing them by ID instead would take a request per 50 entries, against one per 500 for downloading the
+    whole list again.)
+
+    Attributes:
+        fetcher (Fetcher): The fetcher used when a list has to be downloaded.
+        cache (ListCache): The cache that lists are served from and stored in.
+        refresh (bool): Whether to always download the list (and update the cache) instead of using a stored copy.
+        offline (bool): Whether to only ever use stored lists (however old), never the network.
+        incremental (bool): Whether stale lists are synced incrementally instead of being downloaded again.
+        full_sync_ttl (float): The number of seconds after which a list is downloaded in full again, i.e. the most
+            that the media fields of a synced list can lag behind AniList by.
+    """
+    def __init__(self, fetcher: Fetcher, cache: ListCache, refresh: bool = False, offline: bool = False,
+                 incremental: bool = True, full_sync_ttl: float = 3 * 24 * 60 * 60) -> None:
+        """Initialises the `CachedFetcher` class.
+
+        Args:
+            fetcher (Fetcher): The fetcher used when a list has to be downloaded.
+            cache (ListCache): The cache that lists are served from and stored in.
+            refresh (bool): Whether to always download the list (and update the cache) instead of using a stored copy.
+            offline (bool): Whether to only ever use stored lists (however old), never the network.
+            incremental (bool): Whether stale lists are synced incrementally instead of being downloaded again.
+            full_sync_ttl (float): The number of seconds after which a list is downloaded in full again, i.e. the
+                most that the media fields of a synced list can lag behind AniList by.
+
+        Raises:
+            ValueError: if both `refresh` and `offline` are `True`
+        """
+        if refresh and offline:
+            raise ValueError('`refresh` and `offline` can\'t be used together')
+
+        super().__init__(fetcher.fields)
+        self.fetcher = fetcher
+        self.cache = cache
+        self.refresh = refresh
+        self.offline = offline
+        self.incremental = incremental
+        self.full_sync_ttl = full_sync_ttl
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `CachedFetcher` class.
+
+        Returns:
+            str: A string representation of the `CachedFetcher` class and it's initialisation arguments.
+        """
+        return f'CachedFetcher({self.fetcher!r}, {self.cache!r}, {self.refresh}, {self.offline}, ' \
+               f'{self.incremental}, {self.full_sync_ttl})'
+
+    def sync(self, username: str, media_type: str) -> list[dict] | None:
+        """Brings a stored list up to date by merging in the entries that changed since its high-water mark.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            list[dict] | None: The updated entries, or `None` if there is no stored list recent enough to be synced.
+        """
+        state = self.cache.get_sync_state(username, media_type, self.fields)
+        if state is None or time.time() - state[2] >= self.full_sync_ttl:
+            return None
+
+        # The changes are fetched with the same fields as the stored list, so that its entries stay alike.
+        entries, high_water_mark, full_synced_at, fields = state
+        changes, requests_made = fetch_changes(username, media_type, high_water_mark, fields=fields)
+        self.requests_made += requests_made
+
+        entries = merge_changes(entries, changes)
+        # Entries that left the list still move the mark forward, so they aren't downloaded again next time.
+        self.cache.put(username, media_type, entries, max(high_water_mark, get_high_water_mark(changes)),
+                       full_synced_at, fields)
+
+        return entries
+
+    def get_stored(self, username: str, media_type: str) -> list[dict] | None:
+        """Returns a user's list from the cache, syncing it first if it's stale (and `incremental` is `True`).
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Raises:
+            CacheMissError: if `offline` is `True` and the list has never been stored
+
+        Returns:
+            list[dict] | None: The stored entries, or `None` if the list has to be downloaded.
+        """
+        if self.refresh:
+            return None
+
+        if (entries := self.cache.get(username, media_type, self.offline, self.fields)) is not None:
+            profiling.count('cache_hits')
+            return entries
+        profiling.count('cache_misses')
+        if self.offline:
+            with_fields = f' with {", ".join(sorted(self.fields))}' if self.fields else ''
+            raise CacheMissError(f'no cached {media_type.lower()} list{with_fields} for \'{username}\'')
+        if self.incremental:
+            return self.sync(username, media_type)
+
+        return None
+
+    def open_snapshot(self, username: str, media_type: str) -> Snapshot | None:
+        """Opens the snapshot of a user's list if the list would be served from the cache as it is (i.e. it's fresh,
+        or `offline` is `True`), so that it can be ranked without being decoded (see `ListCache.open_snapshot`).
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            Snapshot | None: The snapshot, which the caller has to close, or `None` if the list has to be fetched (see
+            `iter_entries`) instead.
+        """
+        if self.refresh:
+            return None
+
+        if (snapshot := self.cache.open_snapshot(username, media_type, self.offline, self.fields)) is not None:
+            profiling.count('cache_hits')
+        return snapshot
+
+    def fetch(self, username: str, media_type: str) -> list[dict]:
+        """Returns the entries of a user's media list which are either 'Planning' or 'Paused'.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Raises:
+            CacheMissError: if `offline` is `True` and the list has never been stored
+
+        Returns:
+            list[dict]: The matching entries, each one containing the entry's `status` and its `media`.
+        """
+        if (entries := self.get_stored(username, media_type)) is not None:
+            return entries
+
+        requests_before = self.fetcher.requests_made
+        entries = self.fetcher.fetch(username, media_type)
+        self.requests_made += self.fetcher.requests_made - requests_before
+        self.cache.put(username, media_type, entries, fields=self.fields)
+
+        return entries
+
+    def iter_entries(self, username: str, media_type: str) -> Iterator[dict]:
+        """Yields the entries of a user's media list which are either 'Planning' or 'Paused', as soon as the wrapped
+        fetcher has downloaded them.
+
+        A downloaded list is compressed, and added to its snapshot, entry by entry on its way through (see
+        `ListEncoder` and `snapshot.SnapshotWriter`), and is only stored once every entry has been yielded, so the
+        entries are never all held at once.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Raises:
+            CacheMissError: if `offline` is `True` and the list has never been stored
+
+        Yields:
+            dict: The matching entries, each one containing the entry's `status` and its `media`.
+        """
+        if (entries := self.get_stored(username, media_type)) is not None:
+            yield from entries
+            return
+
+        requests_before = self.fetcher.requests_made
+        encoder = ListEncoder()
+        snapshot = SnapshotWriter()
+        add = profiling.timed('cache', encoder.add)
+        build = profiling.timed('snapshot', build_media)
+
+        for entry in self.fetcher.iter_entries(username, media_type):
+            add(entry)
+            snapshot.add(build(entry['media'], media_type, entry['status']))
+            yield entry
+
+        self.requests_made += self.fetcher.requests_made - requests_before
+        self.cache.put_blob(username, media_type, encoder.finish(), encoder.high_water_mark, fields=self.fields,
+                            snapshot=snapshot)
+
+    def get_fetched_at(self, username: str, media_type: str) -> float:
+        """Returns how recent the media of a user's list will be when it's next fetched (see `iter_entries`).
+
+        A stored list that's served as it is, or synced, keeps the media fields of its last full download (see the
+        class docstring), so those date from then. Only a list that's downloaded again has media from now.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            float: When the media's data was fetched from AniList, from `time.time`.
+        """
+        now = time.time()
+        if self.refresh or (synced_at := self.cache.get_full_synced_at(username, media_type, self.fields)) is None:
+            return now
+
+        if self.offline or self.cache.has(username, media_type, fields=self.fields) \
+                or (self.incremental and now - synced_at < self.full_sync_ttl):
+            return synced_at
+
+        return now
+
+    def prefetch(self, username: str, media_type: str) -> None:
+        """Makes sure that a user's list is stored and up to date, downloading or syncing it if needed, so that it can
+        be read from the cache by another process (see `parallel.py`). A list that's already stored isn't decoded.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Raises:
+            CacheMissError: if `offline` is `True` and the list has never been stored
+        """
+        if not self.refresh and self.cache.has(username, media_type, self.offline, self.fields):
+            profiling.count('cache_hits')
+            return
+
+        for _ in self.iter_entries(username, media_type):
+            pass
+
+    def fetch_completed(self, username: str, media_type: str) -> list[dict]:
+        """Returns the 'Completed' entries of a user's media list, serving them from the cache when possible.
+
+        They're stored next to the user's list, under their own media type (e.g. 'ANIME:COMPLETED'), and downloaded
+        again in full once they go stale: they're only fetched with a small query of their own and carry no
+        `updatedAt` to sync from.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Raises:
+            CacheMissError: if `offline` is `True` and the entries have never been stored
+
+        Returns:
+            list[dict]: The entries, each one containing the user's `score` and the `media`'s genres and tags.
+        """
+        key = f'{media_type}:COMPLETED'
+        if not self.refresh and (entries := self.cache.get(username, key, self.offline)) is not None:
+            profiling.count('cache_hits')
+            return entries
+        profiling.count('cache_misses')
+        if self.offline:
+            raise CacheMissError(f'no cached completed {media_type.lower()} entries for \'{username}\'')
+
+        entries = self.fetcher.fetch_completed(username, media_type)
+        self.cache.put(username, key, entries, 0, fields=())
+
+        return entries
+
+    def fetch_details(self, media_ids: list[int]) -> dict[int, dict]:
+        """Returns the description and tags of the given media, serving them from the cache when possible and only
+        fetching (and storing) the rest.
+
+        Args:
+            media_ids (list[int]): The IDs of the media on AniList.
+
+        Returns:
+            dict[int, dict]: The `description` and `tags` of each piece of media, keyed by its ID. When `offline` is
+            `True`, media whose details have never been stored are left out.
+        """
+        details = self.cache.get_details(media_ids, self.offline) if not self.refresh else {}
+        missing = [media_id for media_id in media_ids if media_id not in details]
+        profiling.count('details_hits', len(details))
+        if not missing or self.offline:
+            return details
+
+        profiling.count('details_misses', len(missing))
+        fetched = self.fetcher.fetch_details(missing)
+        self.cache.put_details(fetched)
+
+        return {**details, **fetched}
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
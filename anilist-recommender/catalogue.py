@@ -0,0 +1,589 @@
+"""A process-wide catalogue of media keyed by their AniList IDs, so that a title which is on many users' lists is only
+built (and held, and has its description fetched) once, however many of those lists are in memory.
+
+A user's list is then held as a `UserList`: two compact arrays of media IDs and statuses, which take a few bytes per
+entry instead of an `Anime`/`Manga` object each. Iterating over a `UserList` looks its media up in the catalogue, and
+any that aren't held (or were fetched longer than `MediaCatalogue.max_age` ago) are fetched in bulk with
+`Page.media(id_in: ...)`, 50 to a request (see `fetch.fetch_media`), rather than the user's whole list being downloaded
+again. Memory therefore grows with the number of distinct titles, not with the number of list entries. A list can
+also be loaded from its snapshot (see `load_snapshot_list`), in which case only the media that aren't held are built.
+
+The media in the catalogue are shared by every user, so they don't carry a status on anyone's list (their
+`user_status` is `None`): `UserList.attach` hands out copies with the user's own statuses, which is only needed for
+the final recommendations.
+
+The catalogue also keeps a log of the media whose ranking fields (see `get_ranking_fields`) changed when they were
+refreshed, numbered by a `generation`, so that results computed from a list can be checked against it later (see
+`materialize.py`) without the list being gone through again.
+"""
+
+
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, Sequence
+from cache import CacheMissError
+from fetch import fetch_media
+from media import Anime, Manga
+import profiling
+from snapshot import Snapshot
+from user import build_media
+
+
+# The statuses an entry can have on a user's list, stored in a `UserList` by their position here.
+list_statuses = ['CURRENT', 'PLANNING', 'COMPLETED', 'DROPPED', 'PAUSED', 'REPEATING']
+
+_status_codes = {status: code for code, status in enumerate(list_statuses)}
+_status_lock = threading.Lock()
+
+_catalogue: 'MediaCatalogue | None' = None
+_catalogue_lock = threading.Lock()
+
+
+def get_ranking_fields(media: Anime | Manga) -> tuple:
+    """Returns the fields of a piece of media that filtering and ranking by score depend on (see `filter.recommend`).
+
+    Args:
+        media (Anime | Manga): The media.
+
+    Returns:
+        tuple: Its score, genres, adult rating and length.
+    """
+    return media.score, media.genre_mask, media.adult, media.episodes, media.chapters, media.volumes
+
+
+def is_current(held: Anime | Manga, media: dict, media_type: str) -> bool:
+    """Returns whether a held piece of media already has every field of a newer copy of it from the AniList API, so
+    that it needn't be built again. This is much cheaper than building the copy, and true for most media.
+
+    Args:
+        held (Anime | Manga): The held media.
+        media (dict): The media, from the AniList API.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+    Returns:
+        bool: Whether building `media` would give a copy equal to `held`.
+    """
+    if media_type == 'ANIME':
+        lengths_match = held.episodes == media['episodes']
+    else:
+        lengths_match = held.chapters == media['chapters'] and held.volumes == media['volumes']
+
+    return lengths_match and held.score == media['averageScore'] and held.media_status == media['status'] \
+        and held.adult == media['isAdult'] and held.genres == tuple(media['genres']) \
+        and held.title_english == media['title'].get('english') and held.title_romaji == media['title'].get('romaji') \
+        and ('description' not in media or held.description == media['description']) \
+        and ('tags' not in media or held.tags == tuple((tag['name'], tag['rank']) for tag in media['tags'] or ()))
+
+
+def get_status_code(status: str) -> int:
+    """Returns the number that a status on a user's list is stored as, adding it to `list_statuses` if it's new.
+
+    Args:
+        status (str): The status, e.g. 'PLANNING'.
+
+    Returns:
+        int: The status' position in `list_statuses`.
+    """
+    if (code := _status_codes.get(status)) is not None:
+        return code
+
+    with _status_lock:
+        if status not in _status_codes:
+            _status_codes[status] = len(list_statuses)
+            list_statuses.append(status)
+
+    return _status_codes[status]
+
+
+class MediaCatalogue:
+    """A thread-safe store of `Anime`/`Manga` objects, keyed by their AniList IDs and shared by every user.
+
+    Every piece of media is held along with when its data was fetched from AniList. A copy that arrives with newer data
+    (e.g. on a list that was just downloaded) replaces the held one, and held media are refreshed by ID once their
+    data is `max_age` seconds old. That should be no sooner than the media of a cached list can get that old (see
+    `main.get_media_max_age`), since refreshing a list's media by ID costs far more than downloading it again. Once
+    more than `max_media` are held the ones that were added (or refreshed) the longest ago are evicted, and fetched
+    again when a list that has them is next used.
+
+    Media which are refreshed with different ranking fields, and media which are evicted, are logged as changed (see
+    `changed_since`). Only the last `max_changes` changes are kept.
+
+    Attributes:
+        max_age (float): How old (in seconds) the data of a piece of media can get before it's refreshed.
+        max_media (int): The maximum number of media held.
+        hits (int): The number of times that a piece of media was found in the catalogue.
+        misses (int): The number of times that a piece of media had to be built or fetched.
+        fetched (int): The number of media fetched by ID.
+    """
+    # The number of changes kept in the log. Results computed before the oldest one are treated as out of date.
+    max_changes = 100_000
+
+    def __init__(self, max_age: float = 4 * 24 * 60 * 60, max_media: int = 200_000) -> None:
+        """Initialises the `MediaCatalogue` class.
+
+        Args:
+            max_age (float): How old (in seconds) the data of a piece of media can get before it's refreshed. Defaults
+                to how old the media of a cached list can get with the default TTLs (see `main.get_media_max_age`).
+            max_media (int): The maximum number of media held.
+        """
+        self.max_age = max_age
+        self.max_media = max_media
+
+        self.hits = 0
+        self.misses = 0
+        self.fetched = 0
+
+        # When the data of each piece of media was fetched (from `time.time`) and the media, ordered by when each was
+        # added, oldest first.
+        self._media: dict[int, tuple[float, Anime | Manga]] = {}
+        self._lock = threading.Lock()
+
+        # The IDs of the media that changed, in order. The generation of the first one is `_changes_start`.
+        self._changes: list[int] = []
+        self._changes_start = 0
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `MediaCatalogue` class.
+
+        Returns:
+            str: A string representation of the `MediaCatalogue` class and it's initialisation arguments.
+        """
+        return f'MediaCatalogue({self.max_age}, {self.max_media})'
+
+    def __len__(self) -> int:
+        """Returns the number of media held.
+
+        Returns:
+            int: The number of media held.
+        """
+        return len(self._media)
+
+    @property
+    def generation(self) -> int:
+        """The number of changes logged so far, which results computed now can be checked against later.
+
+        Returns:
+            int: The current generation.
+        """
+        return self._changes_start + len(self._changes)
+
+    def changed_since(self, generation: int) -> set[int] | None:
+        """Returns the media that changed since a generation.
+
+        Args:
+            generation (int): A previous value of `generation`.
+
+        Returns:
+            set[int] | None: The IDs of the media that changed, or `None` if the log doesn't go back that far.
+        """
+        with self._lock:
+            if generation < self._changes_start:
+                return None
+            return set(self._changes[generation - self._changes_start:])
+
+    def _log_change(self, media_id: int) -> None:
+        """Logs a piece of media as changed, dropping the older half of the log once it's full. Must be called with
+        the lock held.
+
+        Args:
+            media_id (int): The ID of the media.
+        """
+        self._changes.append(media_id)
+
+        if len(self._changes) > self.max_changes:
+            dropped = len(self._changes) // 2
+            del self._changes[:dropped]
+            self._changes_start += dropped
+
+    def _store(self, media_id: int, media: Anime | Manga, fetched_at: float) -> None:
+        """Adds (or replaces) a piece of media, evicting the oldest ones if there are too many. Must be called with
+        the lock held.
+
+        Args:
+            media_id (int): The ID of the media.
+            media (Anime | Manga): The media.
+            fetched_at (float): When the media's data was fetched, from `time.time`.
+        """
+        self._media.pop(media_id, None)
+        self._media[media_id] = (fetched_at, media)
+
+        while len(self._media) > self.max_media:
+            # Whoever used the evicted media can't tell whether the copy fetched next time is any different.
+            evicted = next(iter(self._media))
+            del self._media[evicted]
+            self._log_change(evicted)
+
+    def add(self, media: dict, media_type: str, fetched_at: float | None = None) -> Anime | Manga:
+        """Returns the catalogue's copy of a piece of media from the AniList API, building it (and adding it) only if
+        it isn't held, or its data is newer than the held copy's and differs from it.
+
+        Args:
+            media (dict): The media, e.g. the `media` of a list entry.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            fetched_at (float | None): When `media` was fetched from AniList, from `time.time` (see
+                `fetch.Fetcher.get_fetched_at`). Defaults to now.
+
+        Returns:
+            Anime | Manga: The shared media entry.
+        """
+        fetched_at = fetched_at if fetched_at is not None else time.time()
+
+        with self._lock:
+            held = self._media.get(media['id'])
+            if held is not None and (held[0] >= fetched_at or is_current(held[1], media, media_type)):
+                if held[0] < fetched_at:
+                    # The held copy is still current as of `fetched_at`, so it doesn't need refreshing until later.
+                    self._media[media['id']] = (fetched_at, held[1])
+                self.hits += 1
+                return held[1]
+            self.misses += 1
+
+        return self._replace(media, media_type, held, fetched_at)
+
+    def add_media(self, media: Anime | Manga, fetched_at: float | None = None) -> Anime | Manga:
+        """Returns the catalogue's copy of a piece of media which has already been built (e.g. from a snapshot, see
+        `load_snapshot_list`), adding it only if it isn't held, or its data is newer than the held copy's and differs
+        from it, like `add`.
+
+        Args:
+            media (Anime | Manga): The media, with a `user_status` of `None`.
+            fetched_at (float | None): When the media's data was fetched from AniList, from `time.time`. Defaults to
+                now.
+
+        Returns:
+            Anime | Manga: The shared media entry.
+        """
+        fetched_at = fetched_at if fetched_at is not None else time.time()
+        media_id = media.media_id
+        assert media_id is not None
+
+        with self._lock:
+            held = self._media.get(media_id)
+            if held is not None and held[0] >= fetched_at:
+                self.hits += 1
+                return held[1]
+
+        if held is not None:
+            # As in `_replace`, fields that this copy wasn't fetched with are carried over.
+            if media.description is None:
+                media.description = held[1].description
+            if not media.tags:
+                media.tags = held[1].tags
+            if media.to_dict() == held[1].to_dict():
+                with self._lock:
+                    self._media[media_id] = (fetched_at, held[1])
+                    self.hits += 1
+                return held[1]
+
+        with self._lock:
+            self.misses += 1
+            if held is not None and get_ranking_fields(media) != get_ranking_fields(held[1]):
+                self._log_change(media_id)
+            self._store(media_id, media, fetched_at)
+
+        return media
+
+    def find_outdated(self, media_ids: Sequence[int], fetched_at: float) -> list[int]:
+        """Returns the positions of the media which either aren't held or are held with data older than `fetched_at`,
+        i.e. the ones that `add_media` would need to be given, counting the others as hits.
+
+        Args:
+            media_ids (Sequence[int]): The IDs of the media.
+            fetched_at (float): When the data that the media would be added with was fetched, from `time.time`.
+
+        Returns:
+            list[int]: The positions in `media_ids`.
+        """
+        with self._lock:
+            held = list(map(self._media.get, media_ids))
+            outdated = [position for position, entry in enumerate(held) if entry is None or entry[0] < fetched_at]
+            self.hits += len(held) - len(outdated)
+
+        return outdated
+
+    def _replace(self, media: dict, media_type: str, held: tuple[float, Anime | Manga] | None,
+                 fetched_at: float) -> Anime | Manga:
+        """Builds a piece of media and adds it, in place of the copy held until now (if any).
+
+        Args:
+            media (dict): The media, from the AniList API.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            held (tuple[float, Anime | Manga] | None): When the held copy's data was fetched, and the copy itself.
+            fetched_at (float): When `media` was fetched, from `time.time`.
+
+        Returns:
+            Anime | Manga: The new copy.
+        """
+        built = build_media(media, media_type)
+        if held is not None:
+            # Fields that this copy of the media wasn't fetched with (see `fetch.get_media_fields`) are carried over,
+            # rather than having to be fetched again.
+            if 'description' not in media:
+                built.description = held[1].description
+            if 'tags' not in media:
+                built.tags = held[1].tags
+
+        with self._lock:
+            if held is not None and get_ranking_fields(built) != get_ranking_fields(held[1]):
+                self._log_change(media['id'])
+            self._store(media['id'], built, fetched_at)
+
+        return built
+
+    def get_many(self, media_type: str, media_ids: Iterable[int], offline: bool = False) -> dict[int, Anime | Manga]:
+        """Returns the given media, fetching the ones which aren't held (or have gone stale) in bulk.
+
+        Args:
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            media_ids (Iterable[int]): The IDs of the media on AniList.
+            offline (bool): Whether to never fetch anything, using the held media however old they are.
+
+        Raises:
+            AniListError: if some media had to be fetched and fetching them failed
+            CacheMissError: if `offline` is `True` and some media aren't held (e.g. they've been evicted)
+
+        Returns:
+            dict[int, Anime | Manga]: The media that were found, keyed by their IDs. IDs that AniList doesn't know
+            (any more) are left out.
+        """
+        media_ids = list(media_ids)
+        now = time.time()
+        oldest = now - self.max_age if not offline else float('-inf')
+
+        with self._lock:
+            held = list(map(self._media.get, media_ids))
+
+        found = {media_id: entry[1] for media_id, entry in zip(media_ids, held)
+                 if entry is not None and entry[0] > oldest}
+        missing = [media_id for media_id in media_ids if media_id not in found]
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing and offline:
+            raise CacheMissError(f'{len(missing)} {media_type.lower()} media on the list aren\'t held, and can\'t be '
+                                 f'fetched offline')
+        if missing:
+            with profiling.span('catalogue'):
+                fetched = fetch_media(missing)
+            profiling.count('media_fetched', len(fetched))
+
+            with self._lock:
+                self.fetched += len(fetched)
+                previous = {media['id']: self._media.get(media['id']) for media in fetched}
+            for media in fetched:
+                found[media['id']] = self._replace(media, media_type, previous[media['id']], now)
+
+        return found
+
+    def stats(self) -> dict[str, int]:
+        """Returns the catalogue's counters.
+
+        Returns:
+            dict[str, int]: The number of media held, hits, misses and media fetched by ID so far.
+        """
+        return {'media': len(self._media),
+                'hits': self.hits,
+                'misses': self.misses,
+                'fetched': self.fetched}
+
+    def clear(self) -> None:
+        """Drops every piece of media. Everything computed from them until now is treated as out of date."""
+        with self._lock:
+            self._changes_start = self.generation + 1
+            self._changes.clear()
+            self._media.clear()
+
+
+class UserList:
+    """A user's media list, held as the IDs of its media and their statuses on the list, with the media themselves in
+    a `MediaCatalogue`.
+
+    Attributes:
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        media_ids (array): The IDs of the media on the list, in the order they were fetched.
+        statuses (array): The status of each entry, as a position in `list_statuses`.
+        catalogue (MediaCatalogue): The catalogue that the media are looked up in.
+    """
+    __slots__ = ('media_type', 'media_ids', 'statuses', 'catalogue', '_order')
+
+    # The number of IDs looked up in the catalogue at a time, so that missing media are fetched in bulk.
+    batch_size = 500
+
+    def __init__(self, media_type: str, media_ids: array, statuses: array, catalogue: MediaCatalogue) -> None:
+        """Initialises the `UserList` class.
+
+        Args:
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            media_ids (array): The IDs of the media on the list (type code 'q').
+            statuses (array): The status of each entry, as a position in `list_statuses` (type code 'B').
+            catalogue (MediaCatalogue): The catalogue that the media are looked up in.
+        """
+        self.media_type = media_type
+        self.media_ids = media_ids
+        self.statuses = statuses
+        self.catalogue = catalogue
+
+        # The positions of the entries sorted by media ID (see `get_status`), built on first use.
+        self._order: array | None = None
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `UserList` class.
+
+        Returns:
+            str: A string representation of the `UserList` class and it's initialisation arguments.
+        """
+        return f'UserList({self.media_type}, <{len(self.media_ids)} entries>, {self.catalogue!r})'
+
+    def __len__(self) -> int:
+        """Returns the number of entries on the list.
+
+        Returns:
+            int: The number of entries.
+        """
+        return len(self.media_ids)
+
+    def iter_media(self, statuses: Iterable[str] | None = None, offline: bool = False) -> Iterator[Anime | Manga]:
+        """Yields the media on the list, from the catalogue. They're shared with every other user, so their
+        `user_status` is `None` (see `attach`).
+
+        Args:
+            statuses (Iterable[str] | None): Only yield the media with one of these statuses on the list.
+            offline (bool): Whether to only use the media held in the catalogue, however old (see
+                `MediaCatalogue.get_many`).
+
+        Raises:
+            AniListError: if some media weren't in the catalogue and fetching them failed
+            CacheMissError: if `offline` is `True` and some media weren't in the catalogue
+
+        Yields:
+            Anime | Manga: The media, in the order of the list. Media that AniList no longer has are skipped.
+        """
+        media_ids = self.media_ids
+        if statuses is not None:
+            codes = {get_status_code(status) for status in statuses}
+            media_ids = array('q', (media_id for media_id, code in zip(self.media_ids, self.statuses) if code in codes))
+
+        for start in range(0, len(media_ids), self.batch_size):
+            batch = media_ids[start:start + self.batch_size]
+            found = self.catalogue.get_many(self.media_type, batch, offline)
+            yield from filter(None, map(found.get, batch))
+
+    def get_status(self, media_id: int | None) -> str | None:
+        """Returns the status of a piece of media on the list.
+
+        The entries are looked up by binary search, through the positions of the entries sorted by media ID (4 bytes
+        an entry, against a hundred or so for a dict), which are only built the first time.
+
+        Args:
+            media_id (int | None): The ID of the media.
+
+        Returns:
+            str | None: The status, or `None` if the media isn't on the list.
+        """
+        if media_id is None:
+            return None
+        if self._order is None:
+            self._order = array('I', sorted(range(len(self.media_ids)), key=self.media_ids.__getitem__))
+
+        index = bisect_left(self._order, media_id, key=self.media_ids.__getitem__)
+        if index == len(self._order) or self.media_ids[self._order[index]] != media_id:
+            return None
+
+        return list_statuses[self.statuses[self._order[index]]]
+
+    def attach(self, media_list: Iterable[Anime | Manga]) -> list[Anime | Manga]:
+        """Returns copies of the given media (e.g. the user's recommendations, from `iter_media`) with their statuses
+        on this list.
+
+        Args:
+            media_list (Iterable[Anime | Manga]): The media, which should be on the list.
+
+        Returns:
+            list[Anime | Manga]: The copies, in the same order.
+        """
+        return [media.with_user_status(self.get_status(media.media_id)) for media in media_list]
+
+
+def load_user_list(entries: Iterable[dict], media_type: str, catalogue: MediaCatalogue,
+                   fetched_at: float | None = None) -> UserList:
+    """Turns the entries of a user's list (as fetched, see `fetch.Fetcher.iter_entries`) into a `UserList`, adding
+    their media to the catalogue. Each entry is dropped as soon as it's been added, and media that the catalogue
+    already holds (with data at least as new) aren't built again.
+
+    Args:
+        entries (Iterable[dict]): The entries, each one containing the entry's `status` and its `media`.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        catalogue (MediaCatalogue): The catalogue that the media are added to.
+        fetched_at (float | None): When the media of the entries were fetched, from `time.time` (see
+            `fetch.Fetcher.get_fetched_at`). Defaults to now.
+
+    Returns:
+        UserList: The user's list.
+    """
+    media_ids = array('q')
+    statuses = array('B')
+    add = profiling.timed('build', catalogue.add, 'entries_parsed')
+
+    for entry in entries:
+        add(entry['media'], media_type, fetched_at)
+        media_ids.append(entry['media']['id'])
+        statuses.append(get_status_code(entry['status']))
+
+    return UserList(media_type, media_ids, statuses, catalogue)
+
+
+def load_snapshot_list(snapshot: Snapshot, catalogue: MediaCatalogue, fetched_at: float | None = None) -> UserList:
+    """Turns the snapshot of a user's list (see `cache.ListCache.open_snapshot`) into a `UserList`, like
+    `load_user_list`. The IDs and statuses are read straight from the snapshot's columns, and only the media that the
+    catalogue doesn't already hold (with data at least as new) are built.
+
+    Args:
+        snapshot (Snapshot): The snapshot of the list.
+        catalogue (MediaCatalogue): The catalogue that the media are added to.
+        fetched_at (float | None): When the media of the list were fetched, from `time.time` (see
+            `fetch.Fetcher.get_fetched_at`). Defaults to now.
+
+    Returns:
+        UserList: The user's list.
+    """
+    fetched_at = fetched_at if fetched_at is not None else time.time()
+    media_ids = array('q')
+    media_ids.frombytes(bytes(snapshot.columns['media_id']))
+    codes = [get_status_code(status) if status is not None else 0 for status in snapshot.user_statuses]
+    statuses = array('B', [codes[code] for code in snapshot.columns['user_status']])
+    build = profiling.timed('build', snapshot.get, 'entries_parsed')
+
+    for position in catalogue.find_outdated(media_ids, fetched_at):
+        media = build(position)
+        # The catalogue's media are shared, so they don't carry anyone's status (see `UserList.attach`).
+        media.user_status = None
+        catalogue.add_media(media, fetched_at)
+
+    return UserList(snapshot.media_type, media_ids, statuses, catalogue)
+
+
+def get_catalogue() -> MediaCatalogue:
+    """Returns the process-wide media catalogue, creating it on first use.
+
+    Returns:
+        MediaCatalogue: The shared media catalogue.
+    """
+    global _catalogue
+
+    with _catalogue_lock:
+        if _catalogue is None:
+            _catalogue = MediaCatalogue()
+
+    return _catalogue
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""Handles all communication with the AniList API, through a single pooled HTTP session shared by the whole process."""
+
+
+from email.utils import parsedate_to_datetime
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import profiling
+
+
+# Can be pointed elsewhere, e.g. at the local stand-in server in `benchmarks/fake_anilist.py`.
+query_url = os.environ.get('ANILIST_API_URL', 'https://graphql.anilist.co')
+
+# The maximum number of keep-alive connections kept open to AniList. Concurrent fetchers are bounded by this as well.
+pool_size = 16
+
+# AniList's documented budget, used until the `X-RateLimit-Limit` header of a response says otherwise.
+default_requests_per_minute = 90
+
+_session: requests.Session | None = None
+_scheduler: 'Scheduler | None' = None
+_session_lock = threading.Lock()
+
+
+class AniListError(Exception):
+    """Raised when a query to the AniList API fails and retrying it will not (or did not) help.
+
+    Attributes:
+        status (int | None): The HTTP status of the response that was rejected, if there was one (AniList answers 404
+            when the requested user doesn't exist).
+    """
+
+    def __init__(self, message: str, status: int | None = None):
+        """Initialises the error.
+
+        Args:
+            message (str): The description of the failure.
+            status (int | None): The HTTP status of the rejected response, if there was one.
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class Scheduler:
+    """Paces every request sent to AniList so that the per-minute budget is used up without being exceeded.
+
+    Requests take a token from a token bucket which refills at `requests_per_minute / 60` tokens a second. The bucket
+    is kept in line with the `X-RateLimit-Limit` and `X-RateLimit-Remaining` headers of each response, and a 429
+    response pauses every thread for the `Retry-After` period. Throttled, failed (5xx) and dropped requests are
+    retried with jittered exponential backoff.
+
+    Attributes:
+        requests_per_minute (int): The request budget per minute.
+        max_retries (int): The number of times a request is retried before giving up.
+        base_delay (float): The backoff delay, in seconds, before the first retry.
+        max_delay (float): The upper limit, in seconds, on any single backoff delay.
+        requests (int): The number of requests sent.
+        throttles (int): The number of 429 responses received.
+        retries (int): The number of requests that were retried.
+        failures (int): The number of queries that failed for good.
+    """
+    def __init__(self, requests_per_minute: int = default_requests_per_minute, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 60.0) -> None:
+        """Initialises the `Scheduler` class.
+
+        Args:
+            requests_per_minute (int): The request budget per minute.
+            max_retries (int): The number of times a request is retried before giving up.
+            base_delay (float): The backoff delay, in seconds, before the first retry.
+            max_delay (float): The upper limit, in seconds, on any single backoff delay.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.requests = 0
+        self.throttles = 0
+        self.retries = 0
+        self.failures = 0
+
+        self._tokens = float(requests_per_minute)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `Scheduler` class.
+
+        Returns:
+            str: A string representation of the `Scheduler` class and it's initialisation arguments.
+        """
+        return f'Scheduler({self.requests_per_minute}, {self.max_retries}, {self.base_delay}, {self.max_delay})'
+
+    def _refill(self, now: float) -> None:
+        """Adds the tokens earned since the last refill to the bucket. Must be called with the lock held.
+
+        Args:
+            now (float): The current time, from `time.monotonic`.
+        """
+        rate = self.requests_per_minute / 60
+        self._tokens = min(float(self.requests_per_minute), self._tokens + (now - self._updated_at) * rate)
+        self._updated_at = now
+
+    def acquire(self) -> None:
+        """Blocks until a request may be sent, then takes a token for it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.requests += 1
+                    return
+
+                wait = max(self._blocked_until - now, (1 - self._tokens) * 60 / self.requests_per_minute)
+
+            time.sleep(wait)
+
+    def update(self, headers) -> None:
+        """Brings the token bucket in line with the rate-limit headers of a response.
+
+        Args:
+            headers (Mapping[str, str]): The headers of a response from AniList.
+        """
+        with self._lock:
+            if (limit := headers.get('X-RateLimit-Limit')) is not None and limit.isdigit() and int(limit) > 0:
+                self.requests_per_minute = int(limit)
+            if (remaining := headers.get('X-RateLimit-Remaining')) is not None and remaining.isdigit():
+                self._refill(time.monotonic())
+                self._tokens = min(self._tokens, float(remaining))
+
+    def throttle(self, retry_after: float) -> None:
+        """Stops every thread from sending requests for `retry_after` seconds, after AniList responded with a 429.
+
+        Args:
+            retry_after (float): The number of seconds to wait, as given by the `Retry-After` header.
+        """
+        with self._lock:
+            self.throttles += 1
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def backoff(self, attempt: int) -> float:
+        """Returns a randomised ("full jitter") exponential backoff delay for a retry.
+
+        Args:
+            attempt (int): The number of attempts that have been made so far.
+
+        Returns:
+            float: The number of seconds to wait before retrying.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def get_retry_after(self, retry_after: str, attempt: int) -> float:
+        """Returns how long a `Retry-After` header says to wait, which is either a number of seconds or an HTTP date.
+
+        Args:
+            retry_after (str): The value of the header, or an empty string if there wasn't one.
+            attempt (int): The number of attempts that have been made so far.
+
+        Returns:
+            float: The number of seconds to wait, or a backoff delay (see `backoff`) if the header is missing or can't
+            be parsed.
+        """
+        if retry_after.isdigit():
+            return float(retry_after)
+
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return self.backoff(attempt)
+        if retry_at.tzinfo is None:
+            # Not a valid HTTP date, which is always in GMT.
+            return self.backoff(attempt)
+
+        return max(0.0, retry_at.timestamp() - time.time())
+
+    def stats(self) -> dict[str, int]:
+        """Returns the scheduler's counters.
+
+        Returns:
+            dict[str, int]: The number of requests, throttles, retries and failures so far.
+        """
+        return {'requests': self.requests,
+                'throttles': self.throttles,
+                'retries': self.retries,
+                'failures': self.failures}
+
+    def get_data(self, response: requests.Response, results: dict) -> dict:
+        """Returns the `data` part of a decoded response, counting the query as failed if there isn't any.
+
+        Args:
+            response (requests.Response): The response.
+            results (dict): The decoded body of the response.
+
+        Raises:
+            AniListError: if the response isn't successful or only has GraphQL errors
+
+        Returns:
+            dict: The `data` part of the response.
+        """
+        if results.get('data') is not None and response.ok:
+            return results['data']
+
+        with self._lock:
+            self.failures += 1
+        errors = '; '.join(error.get('message', '') for error in results.get('errors') or [])
+        raise AniListError(f'query failed with status {response.status_code}: {errors or response.reason}',
+                           response.status_code)
+
+    def post(self, session: requests.Session, payload: dict, stream: bool = False) -> dict | requests.Response:
+        """Sends a query to the AniList API, retrying it when it is throttled or fails on AniList's side, and returns
+        the `data` part of the response.
+
+        Args:
+            session (requests.Session): The HTTP session used to send the request.
+            payload (dict): The JSON body of the request (the query and its variables).
+            stream (bool): Whether to return a successful response as soon as its headers have arrived, without
+                reading its body, so that the body can be parsed as it's downloaded (see `stream.EntryStream`).
+
+        Raises:
+            AniListError: if the query is rejected (any 4xx other than 429), returns GraphQL errors without any data, or
+                is still failing after `max_retries` retries
+
+        Returns:
+            dict | requests.Response: The `data` part of the API's response, or with `stream` the response itself.
+        """
+        for attempt in range(self.max_retries + 1):
+            with profiling.span('wait'):
+                self.acquire()
+            profiling.count('requests')
+
+            try:
+                with profiling.span('request'):
+                    response = session.post(query_url, json=payload, timeout=30, stream=stream)
+            except requests.RequestException as error:
+                reason = str(error)
+                delay = self.backoff(attempt)
+            else:
+                self.update(response.headers)
+                if stream and response.ok:
+                    return response
+                profiling.count('bytes_received', len(response.content))
+
+                if response.status_code == 429:
+                    self.throttle(self.get_retry_after(response.headers.get('Retry-After', ''), attempt))
+                    profiling.count('throttles')
+                    reason = 'rate limited'
+                    # The pause applies to every thread, a little jitter stops them all retrying at the same moment.
+                    delay = random.uniform(0, self.base_delay)
+                elif response.status_code >= 500:
+                    reason = f'server error {response.status_code}'
+                    delay = self.backoff(attempt)
+                else:
+                    try:
+                        with profiling.span('decode'):
+                            results = response.json()
+                    except ValueError:
+                        results = {}
+
+                    return self.get_data(response, results)
+
+            if attempt == self.max_retries:
+                break
+            with self._lock:
+                self.retries += 1
+            profiling.count('retries')
+            with profiling.span('wait'):
+                time.sleep(delay)
+
+        with self._lock:
+            self.failures += 1
+        raise AniListError(f'query failed after {self.max_retries} retries: {reason}')
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide HTTP session, creating it on first use.
+
+    Reusing the session means that its keep-alive connections (and their TLS handshakes) are shared between every
+    request, instead of a new connection being opened for each one.
+
+    Returns:
+        requests.Session: The shared HTTP session.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+
+    return _session
+
+
+def get_scheduler() -> Scheduler:
+    """Returns the process-wide request scheduler, creating it on first use.
+
+    Returns:
+        Scheduler: The shared request scheduler.
+    """
+    global _scheduler
+
+    with _session_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+
+    return _scheduler
+
+
+def post_query(query: str, query_variables: dict | None = None) -> dict:
+    """Sends a query to the AniList API, through the shared session and scheduler, and returns the `data` part of
+    the response.
+
+    Args:
+        query (str): The query string that will be sent to the AL API.
+        query_variables (dict | None): The variables required for the query to the AL API.
+
+    Raises:
+        AniListError: if the query fails (see `Scheduler.post`)
+
+    Returns:
+        dict: The `data` part of the API's response.
+    """
+    payload: dict = {'query': query}
+    if query_variables is not None:
+        payload['variables'] = query_variables
+
+    data = get_scheduler().post(get_session(), payload)
+    assert isinstance(data, dict)
+    return data
+
+
+def open_query(query: str, query_variables: dict | None = None) -> requests.Response:
+    """Sends a query to the AniList API like `post_query`, but returns the response as soon as its headers have arrived,
+    so that its body can be parsed while it's still being downloaded. The response has to be closed (or read to the
+    end) for its connection to go back to the pool.
+
+    Args:
+        query (str): The query string that will be sent to the AL API.
+        query_variables (dict | None): The variables required for the query to the AL API.
+
+    Raises:
+        AniListError: if the query fails before its body is read (see `Scheduler.post`)
+
+    Returns:
+        requests.Response: The successful response, with its body still unread.
+    """
+    payload: dict = {'query': query}
+    if query_variables is not None:
+        payload['variables'] = query_variables
+
+    response = get_scheduler().post(get_session(), payload, stream=True)
+    assert isinstance(response, requests.Response)
+    return response
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
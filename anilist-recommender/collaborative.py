@@ -0,0 +1,1011 @@
+"""Collaborative ("users like you") recommendations: media that aren't on the user's list at all, found through the
+ratings of every user whose list has been collected.
+
+Ratings are the scores that users gave to the media they completed (see `user.User.get_completed_entries`). They are
+gathered into a `RatingStore`, and `build_index` turns them into an item index: for every piece of media, its most
+similar media by the adjusted cosine similarity of their scores among the users who rated both, shrunk towards 0 when
+few users did. The index is a directory of memory-mapped NumPy arrays, so that opening it is instant and a query
+(`ItemIndex.recommend`) is just a lookup of the neighbours of what the user rated and a merge of them.
+
+Alongside the neighbours the index keeps the statistics they're computed from: for every pair of media rated by the
+same user, the sum of the products of their centred scores and the number of users behind it (16 bytes per pair). A
+full build computes them from every rating, on blocks of media so that memory use is bounded however many users there
+are. Later builds are incremental: the old ratings of every user whose ratings changed are subtracted from the
+statistics and their new ratings added, which only costs as much as those users' ratings, and the neighbours are then
+re-ranked from the statistics. Both give the same statistics up to floating-point rounding, since the sums are added up
+in a different order, which is why they're kept in float64: the rounding errors don't build up over many incremental
+builds, and the neighbours only differ between the two where their similarities are tied to within about 1e-12.
+"""
+
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Iterable, Iterator, Sequence
+from cache import CacheMissError
+from fetch import fetch_list_ids, fetch_media
+from filter import Predicate, filter_media
+import prep
+from media import Anime, Manga
+from rank import np, require_numpy
+from user import User, build_media
+
+
+# The number of ratings (or pairs of ratings) that are worked on at once, which bounds the memory a build needs.
+entries_per_chunk = 1 << 22
+
+# The version of the layout of an index's files. A previous index with another layout isn't built upon.
+index_format = 2
+
+# A user's ratings as stored: the packed media IDs (in ascending order) and the packed scores.
+PackedRatings = tuple[bytes, bytes]
+
+
+class IndexMissingError(CacheMissError):
+    """Raised when collaborative recommendations are asked for, but the index hasn't been built yet."""
+
+
+def pack_ratings(completed_entries: list[dict]) -> PackedRatings:
+    """Packs a user's ratings, in ascending order of media ID. Unscored entries are left out, they say nothing about
+    how much the user liked the media.
+
+    Args:
+        completed_entries (list[dict]): The user's completed entries, with their scores.
+
+    Returns:
+        PackedRatings: The packed media IDs and scores.
+    """
+    ratings = sorted((entry['media']['id'], entry['score']) for entry in completed_entries if entry.get('score'))
+
+    return (np.array([media_id for media_id, _ in ratings], dtype=np.int32).tobytes(),
+            np.array([score for _, score in ratings], dtype=np.uint8).tobytes())
+
+
+def unpack_ratings(ratings: PackedRatings) -> tuple['np.ndarray', 'np.ndarray']:
+    """Unpacks a user's stored ratings.
+
+    Args:
+        ratings (PackedRatings): The packed media IDs and scores.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The IDs of the rated media (in ascending order) and their scores.
+    """
+    return np.frombuffer(ratings[0], dtype=np.int32), np.frombuffer(ratings[1], dtype=np.uint8)
+
+
+def centre(scores: 'np.ndarray') -> 'np.ndarray':
+    """Centres a user's scores on their average, so that a 70 from a harsh user and a 90 from a generous one count the
+    same. Users with fewer than 2 ratings have nothing to centre, and count for nothing.
+
+    Args:
+        scores (np.ndarray): The user's scores.
+
+    Returns:
+        np.ndarray: The centred scores, or an empty array for users with fewer than 2 ratings.
+    """
+    if len(scores) < 2:
+        return np.zeros(0, dtype=np.float32)
+
+    return (scores - scores.mean()).astype(np.float32)
+
+
+class RatingStore:
+    """A SQLite-backed store of the scores users gave to the media they completed, keyed by (username, media type).
+
+    Each user's ratings are stored as two packed arrays (media IDs and scores). When a user's ratings change, what they
+    were as of the last index build is kept as well, which is what incremental builds are based on.
+
+    Attributes:
+        path (str): The path to the SQLite database.
+    """
+    def __init__(self, path: str | None = None) -> None:
+        """Initialises the `RatingStore` class.
+
+        Args:
+            path (str | None): The path to the SQLite database. Defaults to `ratings.sqlite3` in the cache directory.
+        """
+        require_numpy('collaborative recommendation')
+
+        self.path = path if path is not None else os.path.join(prep.get_cache_dir(), 'ratings.sqlite3')
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS ratings (
+                username TEXT NOT NULL,
+                media_type TEXT NOT NULL,
+                media_ids BLOB NOT NULL,
+                scores BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (username, media_type)
+            )
+        ''')
+        # The ratings, as of the last build, of the users whose ratings have changed since.
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS changes (
+                username TEXT NOT NULL,
+                media_type TEXT NOT NULL,
+                media_ids BLOB NOT NULL,
+                scores BLOB NOT NULL,
+                PRIMARY KEY (username, media_type)
+            ) WITHOUT ROWID
+        ''')
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `RatingStore` class.
+
+        Returns:
+            str: A string representation of the `RatingStore` class and it's initialisation arguments.
+        """
+        return f'RatingStore({self.path})'
+
+    def put(self, username: str, media_type: str, completed_entries: list[dict]) -> bool:
+        """Stores a user's ratings (see `pack_ratings`), replacing any previous ones.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            completed_entries (list[dict]): The user's completed entries, with their scores.
+
+        Returns:
+            bool: Whether the user's ratings changed.
+        """
+        media_ids, scores = pack_ratings(completed_entries)
+        key = (username.lower(), media_type)
+
+        with self._lock:
+            row = self._connection.execute('SELECT media_ids, scores FROM ratings '
+                                           'WHERE username = ? AND media_type = ?', key).fetchone()
+            if row is not None and row == (media_ids, scores):
+                return False
+
+            self._connection.execute('BEGIN')
+            # Only the first change since the last build is recorded, that's what the index still reflects.
+            self._connection.execute('INSERT OR IGNORE INTO changes VALUES (?, ?, ?, ?)',
+                                     (*key, *(row if row is not None else (b'', b''))))
+            self._connection.execute('INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?, ?)',
+                                     (*key, media_ids, scores, len(scores), time.time()))
+            self._connection.execute('COMMIT')
+
+        return True
+
+    def get(self, username: str, media_type: str) -> tuple['np.ndarray', 'np.ndarray'] | None:
+        """Returns a user's stored ratings.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray] | None: The IDs of the rated media (in ascending order) and their scores, or
+            `None` if there are no ratings stored for the user.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT media_ids, scores FROM ratings '
+                                           'WHERE username = ? AND media_type = ?',
+                                           (username.lower(), media_type)).fetchone()
+
+        return unpack_ratings(row) if row is not None else None
+
+    def count(self, media_type: str) -> tuple[int, int]:
+        """Returns how many users have ratings stored, and how many ratings there are in total.
+
+        Args:
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            tuple[int, int]: The number of users and the number of ratings.
+        """
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ratings '
+                                            'WHERE media_type = ?', (media_type,)).fetchone()
+
+    def iter_ratings(self, media_type: str,
+                     changes: dict[str, tuple[PackedRatings, PackedRatings]] | None = None) -> Iterator[PackedRatings]:
+        """Yields every user's ratings, without loading all of them at once.
+
+        Everything is read from a single snapshot of the store, so that ratings stored in the meantime don't make the
+        build inconsistent (they are picked up by the next build instead).
+
+        Args:
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            changes (dict[str, tuple[PackedRatings, PackedRatings]] | None): If given, it's filled with the pending
+                changes in the same snapshot (see `get_changes`) when the iteration starts.
+
+        Yields:
+            PackedRatings: The packed ratings of a user.
+        """
+        # A separate connection, so that the store stays usable (and the lock free) while the ratings are read.
+        connection = sqlite3.connect(self.path, isolation_level=None)
+
+        try:
+            connection.execute('BEGIN')
+            if changes is not None:
+                changes.update(self._read_changes(connection, media_type))
+
+            yield from connection.execute('SELECT media_ids, scores FROM ratings WHERE media_type = ?', (media_type,))
+        finally:
+            connection.close()
+
+    def get_changes(self, media_type: str) -> dict[str, tuple[PackedRatings, PackedRatings]]:
+        """Returns the users whose ratings changed since the last build.
+
+        Args:
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            dict[str, tuple[PackedRatings, PackedRatings]]: The ratings of each of those users as of the last build
+            and as they are now, keyed by username.
+        """
+        with self._lock:
+            return self._read_changes(self._connection, media_type)
+
+    @staticmethod
+    def _read_changes(connection: sqlite3.Connection,
+                      media_type: str) -> dict[str, tuple[PackedRatings, PackedRatings]]:
+        """Reads the pending changes (see `get_changes`) through the given connection."""
+        rows = connection.execute('SELECT changes.username, changes.media_ids, changes.scores, ratings.media_ids, '
+                                  'ratings.scores FROM changes JOIN ratings USING (username, media_type) '
+                                  'WHERE changes.media_type = ?', (media_type,))
+
+        return {username: ((old_ids, old_scores), (new_ids, new_scores))
+                for username, old_ids, old_scores, new_ids, new_scores in rows}
+
+    def finish_changes(self, media_type: str, changes: dict[str, tuple[PackedRatings, PackedRatings]]) -> None:
+        """Records that a build has taken the given changes into account.
+
+        Users whose ratings have changed again since (i.e. during the build) stay pending, now relative to the
+        ratings that the build used.
+
+        Args:
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            changes (dict[str, tuple[PackedRatings, PackedRatings]]): The changes the build used (see `get_changes`).
+        """
+        with self._lock:
+            self._connection.execute('BEGIN')
+
+            for username, (_, used) in changes.items():
+                current = self._connection.execute('SELECT media_ids, scores FROM ratings '
+                                                   'WHERE username = ? AND media_type = ?',
+                                                   (username, media_type)).fetchone()
+                if current == used:
+                    self._connection.execute('DELETE FROM changes WHERE username = ? AND media_type = ?',
+                                             (username, media_type))
+                else:
+                    self._connection.execute('UPDATE changes SET media_ids = ?, scores = ? '
+                                             'WHERE username = ? AND media_type = ?',
+                                             (*used, username, media_type))
+
+            self._connection.execute('COMMIT')
+
+
+def get_index_path(media_type: str) -> str:
+    """Returns the default directory of the item index for a type of media.
+
+    Args:
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+    Returns:
+        str: `<media type>-index` in the cache directory.
+    """
+    return os.path.join(prep.get_cache_dir(), f'{media_type.lower()}-index')
+
+
+def write_matrix(store: RatingStore, media_type: str, directory: str,
+                 changes: dict[str, tuple[PackedRatings, PackedRatings]]) -> tuple['np.ndarray', ...]:
+    """Writes every user's ratings into a user x media matrix in compressed sparse row form, as memory-mapped arrays.
+
+    The ratings are read in a single pass, appending the raw media IDs and centred scores to files. Only the distinct
+    media IDs are held in memory, merged in chunks of users, and they're turned into column numbers at the end.
+
+    Args:
+        store (RatingStore): The stored ratings.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        directory (str): The directory the arrays are written to.
+        changes (dict[str, tuple[PackedRatings, PackedRatings]]): Filled with the pending changes of the same
+            snapshot (see `RatingStore.iter_ratings`).
+
+    Returns:
+        tuple[np.ndarray, ...]: The IDs of the media (one per column, in ascending order), the row pointers, the
+        column of every rating and every centred score.
+    """
+    media_ids = np.zeros(0, dtype=np.int32)
+    pending = []
+    lengths = [0]
+
+    with open(os.path.join(directory, 'indices.bin'), 'wb') as indices_file, \
+            open(os.path.join(directory, 'values.bin'), 'wb') as values_file:
+        for ratings in store.iter_ratings(media_type, changes):
+            user_ids, scores = unpack_ratings(ratings)
+            values = centre(scores)
+            if not len(values):
+                continue
+
+            indices_file.write(user_ids.tobytes())
+            values_file.write(values.tobytes())
+            lengths.append(len(values))
+
+            pending.append(user_ids)
+            if len(pending) == 4096:
+                media_ids = np.union1d(media_ids, np.concatenate(pending))
+                pending = []
+
+    if pending:
+        media_ids = np.union1d(media_ids, np.concatenate(pending))
+
+    indptr = np.cumsum(np.array(lengths, dtype=np.int64))
+    if not indptr[-1]:
+        return media_ids, indptr, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+    indices = np.memmap(os.path.join(directory, 'indices.bin'), dtype=np.int32, mode='r+')
+    for first in range(0, len(indices), entries_per_chunk):
+        indices[first:first + entries_per_chunk] = np.searchsorted(media_ids, indices[first:first + entries_per_chunk])
+    values = np.memmap(os.path.join(directory, 'values.bin'), dtype=np.float32, mode='r')
+
+    return media_ids, indptr, indices, values
+
+
+def iter_row_chunks(indptr: 'np.ndarray', entries: int) -> Iterator[tuple[int, int]]:
+    """Splits the rows of a sparse matrix into consecutive chunks of roughly `entries` entries.
+
+    Args:
+        indptr (np.ndarray): The row pointers of the matrix.
+        entries (int): The number of entries wanted per chunk.
+
+    Yields:
+        tuple[int, int]: The first row of a chunk and the row after its last one.
+    """
+    rows = len(indptr) - 1
+    start = 0
+
+    while start < rows:
+        end = int(np.searchsorted(indptr, indptr[start] + entries, side='right')) - 1
+        end = min(max(end, start + 1), rows)
+        yield start, end
+        start = end
+
+
+def count_pairs(matrix: tuple['np.ndarray', ...], media_count: int) -> 'np.ndarray':
+    """Returns how many pairs of ratings every piece of media is the first of: the number of ratings by each user who
+    rated it, summed over those users.
+
+    Args:
+        matrix (tuple[np.ndarray, ...]): The row pointers, columns and centred scores (see `write_matrix`).
+        media_count (int): The number of columns of the matrix.
+
+    Returns:
+        np.ndarray: The number of pairs of each column.
+    """
+    indptr, indices, _ = matrix
+    pairs = np.zeros(media_count)
+
+    for start, end in iter_row_chunks(indptr, entries_per_chunk):
+        lengths = np.diff(indptr[start:end + 1])
+        pairs += np.bincount(indices[indptr[start]:indptr[end]], weights=np.repeat(lengths, lengths),
+                             minlength=media_count)
+
+    return pairs
+
+
+def iter_block_pairs(matrix: tuple['np.ndarray', ...], media_count: int, block: 'np.ndarray',
+                     pairs_per_batch: int) -> Iterator[tuple['np.ndarray', 'np.ndarray']]:
+    """Yields every pair of ratings by the same user whose first rating is of a piece of media in `block`.
+
+    The matrix is streamed through in chunks of users, and every rating of a piece of media in the block is paired with
+    every rating by the same user, in batches of about `pairs_per_batch` pairs to keep the expansion bounded.
+
+    Args:
+        matrix (tuple[np.ndarray, ...]): The row pointers, columns and centred scores (see `write_matrix`).
+        media_count (int): The number of columns of the matrix.
+        block (np.ndarray): The columns of the media whose pairs are wanted.
+        pairs_per_batch (int): Roughly how many pairs are yielded at once.
+
+    Yields:
+        tuple[np.ndarray, np.ndarray]: The keys of a batch of pairs (the position of the first piece of media in
+        `block` times `media_count`, plus the column of the second one) and the products of their centred scores.
+    """
+    indptr, indices, values = matrix
+
+    position = np.full(media_count, -1, dtype=np.int64)
+    position[block] = np.arange(len(block))
+
+    for start, end in iter_row_chunks(indptr, entries_per_chunk):
+        first = indptr[start]
+        local = position[indices[first:indptr[end]]]
+        hits = np.flatnonzero(local >= 0)
+        if not len(hits):
+            continue
+
+        hit_users = np.repeat(np.arange(start, end), np.diff(indptr[start:end + 1]))[hits]
+        lengths = indptr[hit_users + 1] - indptr[hit_users]
+        cumulative = np.cumsum(lengths)
+
+        for batch in np.split(np.arange(len(hits)),
+                              np.searchsorted(cumulative, np.arange(pairs_per_batch, cumulative[-1], pairs_per_batch))):
+            if not len(batch):
+                continue
+
+            batch_lengths = lengths[batch]
+            offsets = np.repeat(indptr[hit_users[batch]] - (np.cumsum(batch_lengths) - batch_lengths), batch_lengths)
+            offsets += np.arange(batch_lengths.sum())
+
+            yield (np.repeat(local[hits[batch]], batch_lengths) * media_count + indices[offsets],
+                   np.repeat(values[first + hits[batch]], batch_lengths) * values[offsets])
+
+
+def get_dense_block_statistics(matrix: tuple['np.ndarray', ...], media_count: int,
+                               block: 'np.ndarray') -> tuple['np.ndarray', ...]:
+    """Returns the co-rating statistics of every piece of media in `block` with every piece of media, summing the
+    pairs (see `iter_block_pairs`) into a dense block x media array with `np.bincount`.
+
+    This is the fastest way when most media in the block are co-rated with most media, its cost (and memory) grows
+    with the size of the array however few pairs there are.
+
+    Args:
+        matrix (tuple[np.ndarray, ...]): The row pointers, columns and centred scores (see `write_matrix`).
+        media_count (int): The number of columns of the matrix.
+        block (np.ndarray): The columns of the media whose statistics are computed.
+
+    Returns:
+        tuple[np.ndarray, ...]: The keys of the co-rated pairs (as in `iter_block_pairs`) in ascending order, their
+        sums of products and their numbers of users.
+    """
+    dots = np.zeros(len(block) * media_count)
+    counts = np.zeros(len(block) * media_count, dtype=np.int64)
+
+    for keys, products in iter_block_pairs(matrix, media_count, block, max(entries_per_chunk, len(dots))):
+        dots += np.bincount(keys, weights=products, minlength=len(dots))
+        counts += np.bincount(keys, minlength=len(counts))
+
+    keys = np.flatnonzero(counts)
+    return keys, dots[keys], counts[keys]
+
+
+def get_sparse_block_statistics(matrix: tuple['np.ndarray', ...], media_count: int,
+                                block: 'np.ndarray') -> tuple['np.ndarray', ...]:
+    """Returns the same as `get_dense_block_statistics`, but sums the pairs by sorting them, so that its cost (and
+    memory) only grows with the number of pairs. This is the fastest way when few users rated each pair.
+
+    Args:
+        matrix (tuple[np.ndarray, ...]): The row pointers, columns and centred scores (see `write_matrix`).
+        media_count (int): The number of columns of the matrix.
+        block (np.ndarray): The columns of the media whose statistics are computed.
+
+    Returns:
+        tuple[np.ndarray, ...]: The keys of the co-rated pairs (as in `iter_block_pairs`) in ascending order, their
+        sums of products and their numbers of users.
+    """
+    batches = list(iter_block_pairs(matrix, media_count, block, entries_per_chunk))
+    if not batches:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+    keys = np.concatenate([keys for keys, _ in batches])
+    products = np.concatenate([products for _, products in batches]).astype(np.float64)
+    del batches
+
+    order = np.argsort(keys)
+    keys, products = keys[order], products[order]
+    starts = np.flatnonzero(np.diff(keys, prepend=-1))
+
+    return keys[starts], np.add.reduceat(products, starts), np.diff(np.append(starts, len(keys)))
+
+
+class Statistics:
+    """Writes the co-rating statistics of an index, one chunk of rows (media) at a time, in compressed sparse row form.
+
+    Attributes:
+        directory (str): The directory the statistics are written to.
+        lengths (list[np.ndarray]): The number of pairs of each row written so far.
+    """
+    def __init__(self, directory: str) -> None:
+        """Initialises the `Statistics` class.
+
+        Args:
+            directory (str): The directory the statistics are written to.
+        """
+        self.directory = directory
+        self.lengths: list['np.ndarray'] = []
+
+        self._files = [open(os.path.join(directory, f'{name}.bin'), 'wb') for name in ('columns', 'dots', 'counts')]
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `Statistics` class.
+
+        Returns:
+            str: A string representation of the `Statistics` class and it's initialisation arguments.
+        """
+        return f'Statistics({self.directory})'
+
+    def write(self, lengths: 'np.ndarray', columns: 'np.ndarray', dots: 'np.ndarray', counts: 'np.ndarray') -> None:
+        """Appends the pairs of the next rows.
+
+        Args:
+            lengths (np.ndarray): The number of pairs in each row.
+            columns (np.ndarray): The column of the other piece of media of every pair, in row order.
+            dots (np.ndarray): The sum of the products of the pair's centred scores.
+            counts (np.ndarray): The number of users who rated both media of the pair.
+        """
+        self.lengths.append(lengths)
+
+        for output, array, dtype in zip(self._files, (columns, dots, counts), (np.int32, np.float64, np.int32)):
+            output.write(array.astype(dtype).tobytes())
+
+    def close(self) -> 'np.ndarray':
+        """Finishes writing the statistics.
+
+        Returns:
+            np.ndarray: The row pointers.
+        """
+        for output in self._files:
+            output.close()
+
+        lengths = np.concatenate(self.lengths) if self.lengths else np.zeros(0, dtype=np.int64)
+        return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+
+def load_statistics(directory: str, indptr: 'np.ndarray') -> tuple['np.ndarray', ...]:
+    """Memory-maps the co-rating statistics written by `Statistics`.
+
+    Args:
+        directory (str): The directory of the statistics.
+        indptr (np.ndarray): Their row pointers.
+
+    Returns:
+        tuple[np.ndarray, ...]: The row pointers, the columns, the sums of products and the counts.
+    """
+    arrays = [indptr]
+
+    for name, dtype in (('columns', np.int32), ('dots', np.float64), ('counts', np.int32)):
+        if indptr[-1]:
+            arrays.append(np.memmap(os.path.join(directory, f'{name}.bin'), dtype=dtype, mode='r'))
+        else:
+            arrays.append(np.zeros(0, dtype=dtype))
+
+    return tuple(arrays)
+
+
+def compute_statistics(store: RatingStore, media_type: str, directory: str, block_bytes: int,
+                       changes: dict[str, tuple[PackedRatings, PackedRatings]]) -> tuple['np.ndarray', 'np.ndarray']:
+    """Computes the co-rating statistics from every stored rating (a full build), a block of media at a time.
+
+    Each block is summed densely if most of its cells are co-rated pairs, and by sorting its pairs otherwise (see
+    `get_dense_block_statistics` and `get_sparse_block_statistics`), so that a build over many media but few users
+    doesn't cost as much as one where every pair of media is co-rated.
+
+    Args:
+        store (RatingStore): The stored ratings.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        directory (str): The directory the statistics are written to.
+        block_bytes (int): Roughly how much memory a block of statistics may take.
+        changes (dict[str, tuple[PackedRatings, PackedRatings]]): Filled with the pending changes that the build
+            covers.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The IDs of the media (one per row and column, in ascending order) and the row
+        pointers of the statistics.
+    """
+    statistics = Statistics(directory)
+
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        arrays = write_matrix(store, media_type, scratch, changes)
+        media_ids, matrix = arrays[0], arrays[1:]
+        del arrays
+        media_count = len(media_ids)
+        block_size = max(1, block_bytes // (24 * max(media_count, 1)))
+        pairs = np.concatenate([[0], np.cumsum(count_pairs(matrix, media_count))])
+        first = 0
+
+        while first < media_count:
+            last = min(first + block_size, media_count)
+            if pairs[last] - pairs[first] >= (last - first) * media_count / 2:
+                keys, dots, counts = get_dense_block_statistics(matrix, media_count, np.arange(first, last))
+            else:
+                # A sparse block holds about 40 bytes per pair while they're sorted.
+                last = int(np.searchsorted(pairs, pairs[first] + block_bytes // 40, side='right')) - 1
+                last = min(max(last, first + 1), media_count)
+                keys, dots, counts = get_sparse_block_statistics(matrix, media_count, np.arange(first, last))
+
+            statistics.write(np.bincount(keys // media_count, minlength=last - first), keys % media_count, dots,
+                             counts)
+            first = last
+
+        del matrix
+
+    return media_ids, statistics.close()
+
+
+def get_delta(changes: dict[str, tuple[PackedRatings, PackedRatings]]) -> tuple['np.ndarray', ...]:
+    """Returns how the co-rating statistics change with the given changes of ratings: every pair of a user's old
+    ratings is taken away, and every pair of their new ratings added.
+
+    Args:
+        changes (dict[str, tuple[PackedRatings, PackedRatings]]): The changes (see `RatingStore.get_changes`).
+
+    Returns:
+        tuple[np.ndarray, ...]: The pairs whose statistics change, as keys (the ID of the first piece of media times
+        2^32 plus the ID of the second one) in ascending order, with the change of their sums of products and of
+        their counts.
+    """
+    def aggregate(parts: Sequence[tuple['np.ndarray', ...]]) -> tuple['np.ndarray', ...]:
+        keys, inverse = np.unique(np.concatenate([keys for keys, _, _ in parts]), return_inverse=True)
+        dots = np.bincount(inverse, weights=np.concatenate([dots for _, dots, _ in parts]), minlength=len(keys))
+        counts = np.bincount(inverse, weights=np.concatenate([counts for _, _, counts in parts]), minlength=len(keys))
+        return keys, dots, counts
+
+    parts: list[tuple['np.ndarray', ...]] = [(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))]
+    pending = 0
+
+    for old, new in changes.values():
+        for ratings, sign in ((old, -1), (new, 1)):
+            media_ids, scores = unpack_ratings(ratings)
+            values = centre(scores)
+            if not len(values):
+                continue
+
+            media_ids = media_ids.astype(np.int64)
+            parts.append((((media_ids[:, None] << 32) | media_ids[None, :]).ravel(),
+                          (sign * np.outer(values, values)).ravel(),
+                          np.full(len(values) ** 2, sign, dtype=np.float64)))
+            pending += len(values) ** 2
+
+        if pending >= entries_per_chunk:
+            parts, pending = [aggregate(parts)], 0
+
+    return aggregate(parts)
+
+
+def merge_statistics(previous: 'ItemIndex', delta: tuple['np.ndarray', ...],
+                     directory: str) -> tuple['np.ndarray', 'np.ndarray']:
+    """Applies a change of co-rating statistics (see `get_delta`) to those of the previous index (an incremental
+    build), a chunk of rows at a time.
+
+    Args:
+        previous (ItemIndex): The previous index.
+        delta (tuple[np.ndarray, ...]): The change of the statistics.
+        directory (str): The directory the new statistics are written to.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The IDs of the media (one per row and column, in ascending order) and the row
+        pointers of the new statistics.
+    """
+    delta_keys, delta_dots, delta_counts = delta
+    old_ids = np.asarray(previous.media_ids)
+    old_indptr, old_columns, old_dots, old_counts = previous.get_statistics()
+
+    media_ids = np.union1d(old_ids, (delta_keys >> 32).astype(np.int32))
+    rows_per_chunk = max(1, entries_per_chunk * len(old_ids) // max(int(old_indptr[-1]), 1))
+    statistics = Statistics(directory)
+
+    for first in range(0, len(media_ids), rows_per_chunk):
+        chunk_ids = media_ids[first:first + rows_per_chunk].astype(np.int64)
+        old_first, old_last = np.searchsorted(old_ids, [chunk_ids[0], chunk_ids[-1] + 1])
+        entries = slice(old_indptr[old_first], old_indptr[old_last])
+
+        row_ids = np.repeat(old_ids[old_first:old_last].astype(np.int64), np.diff(old_indptr[old_first:old_last + 1]))
+        keys = (row_ids << 32) | old_ids[old_columns[entries]]
+        dots = old_dots[entries].astype(np.float64)
+        counts = old_counts[entries].astype(np.int64)
+
+        start, end = np.searchsorted(delta_keys, [chunk_ids[0] << 32, (chunk_ids[-1] + 1) << 32])
+        changed_keys = delta_keys[start:end]
+        positions = np.searchsorted(keys, changed_keys)
+        found = positions < len(keys)
+        found[found] = keys[positions[found]] == changed_keys[found]
+
+        dots[positions[found]] += delta_dots[start:end][found]
+        counts[positions[found]] += np.rint(delta_counts[start:end][found]).astype(np.int64)
+
+        new = ~found
+        keys = np.insert(keys, positions[new], changed_keys[new])
+        dots = np.insert(dots, positions[new], delta_dots[start:end][new])
+        counts = np.insert(counts, positions[new], np.rint(delta_counts[start:end][new]).astype(np.int64))
+
+        # Pairs that nobody rates any more are dropped.
+        kept = counts > 0
+        keys, dots, counts = keys[kept], dots[kept], counts[kept]
+
+        rows = np.searchsorted(chunk_ids, keys >> 32)
+        statistics.write(np.bincount(rows, minlength=len(chunk_ids)), np.searchsorted(media_ids, keys & 0xFFFFFFFF),
+                         dots, counts)
+
+    return media_ids, statistics.close()
+
+
+def rank_neighbours(statistics: tuple['np.ndarray', ...], media_ids: 'np.ndarray', neighbours: int, shrinkage: float,
+                    directory: str) -> None:
+    """Ranks the neighbours of every piece of media from the co-rating statistics, and writes them out.
+
+    A pair's similarity is its sum of products divided by the norms of both media (the square roots of their own sums
+    of squares, i.e. the statistics of each piece of media with itself), times `count / (count + shrinkage)`.
+
+    Args:
+        statistics (tuple[np.ndarray, ...]): The row pointers, columns, sums of products and counts.
+        media_ids (np.ndarray): The ID of the media in each row and column.
+        neighbours (int): The number of neighbours kept per piece of media.
+        shrinkage (float): How strongly similarities supported by few users are shrunk towards 0.
+        directory (str): The directory `neighbours.npy` and `similarities.npy` are written to.
+    """
+    indptr, columns, dots, counts = statistics
+
+    neighbour_ids = np.lib.format.open_memmap(os.path.join(directory, 'neighbours.npy'), 'w+', np.int32,
+                                              (len(media_ids), neighbours))
+    neighbour_similarities = np.lib.format.open_memmap(os.path.join(directory, 'similarities.npy'), 'w+',
+                                                       np.float32, (len(media_ids), neighbours))
+
+    norms = np.zeros(len(media_ids))
+    for first, last in iter_row_chunks(indptr, entries_per_chunk):
+        rows = np.repeat(np.arange(first, last), np.diff(indptr[first:last + 1]))
+        entries = slice(indptr[first], indptr[last])
+        diagonal = columns[entries] == rows
+        norms[rows[diagonal]] = np.sqrt(np.maximum(dots[entries][diagonal], 0))
+
+    for first, last in iter_row_chunks(indptr, entries_per_chunk):
+        rows = np.repeat(np.arange(first, last), np.diff(indptr[first:last + 1]))
+        entries = slice(indptr[first], indptr[last])
+        chunk_columns = np.asarray(columns[entries])
+
+        denominators = norms[rows] * norms[chunk_columns]
+        similarities = np.divide(dots[entries], denominators, out=np.zeros(len(rows)), where=denominators > 0)
+        similarities *= counts[entries] / (counts[entries] + shrinkage)
+        similarities[chunk_columns == rows] = 0
+
+        positive = similarities > 0
+        rows, chunk_columns, similarities = rows[positive], chunk_columns[positive], similarities[positive]
+
+        # Sorted by row and then by descending similarity (ties in ascending order of ID), the first `neighbours` of
+        # each row are kept. Similarities are at most 1, so a single sort on `2 * row - similarity` does both.
+        order = np.argsort(2.0 * (rows - first) - similarities, kind='stable')
+        rows, chunk_columns, similarities = rows[order], chunk_columns[order], similarities[order]
+        row_lengths = np.bincount(rows - first, minlength=last - first)
+        ranks = np.arange(len(rows)) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+        top = ranks < neighbours
+
+        neighbour_ids[rows[top], ranks[top]] = media_ids[chunk_columns[top]]
+        neighbour_similarities[rows[top], ranks[top]] = similarities[top]
+
+    neighbour_ids.flush()
+    neighbour_similarities.flush()
+
+
+def build_index(store: RatingStore, media_type: str, path: str | None = None, neighbours: int = 50,
+                shrinkage: float = 10.0, full: bool = False, block_bytes: int = 256 * 1024 * 1024) -> dict:
+    """Builds (or incrementally rebuilds) the item index of a type of media from the stored ratings.
+
+    The build is incremental if there's a previous index with the same settings, unless `full` is given. Each build
+    is written to a new version directory, and `meta.json` (which points to it) is replaced last, so readers never see
+    a half-written index.
+
+    Args:
+        store (RatingStore): The stored ratings.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        path (str | None): The directory of the index. Defaults to the one from `get_index_path`.
+        neighbours (int): The number of neighbours kept per piece of media.
+        shrinkage (float): How strongly similarities supported by few users are shrunk towards 0.
+        full (bool): Whether to compute the statistics from every rating, rather than from the changes since the
+            last build.
+        block_bytes (int): Roughly how much memory the dense blocks of statistics may take (full builds only).
+
+    Returns:
+        dict: The index's metadata, including whether the build was incremental, how many users' changes it took in
+        and how long it took.
+    """
+    start = time.perf_counter()
+    path = path if path is not None else get_index_path(media_type)
+    os.makedirs(path, exist_ok=True)
+
+    try:
+        previous = ItemIndex(path)
+    except FileNotFoundError:
+        previous = None
+    # The previous index is only built upon if it was built with the same parameters and layout.
+    base = previous if (not full and previous is not None and previous.meta.get('format') == index_format
+                        and previous.meta.get('neighbours') == neighbours
+                        and previous.meta.get('shrinkage') == shrinkage) else None
+    incremental = base is not None
+
+    changes = store.get_changes(media_type) if base is not None else {}
+    if base is not None and not changes:
+        return base.meta | {'incremental': True, 'changed_users': 0, 'seconds': time.perf_counter() - start}
+
+    version = str((previous.meta['version'] + 1) if previous is not None else 1)
+    directory = os.path.join(path, version)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+    if base is not None:
+        media_ids, indptr = merge_statistics(base, get_delta(changes), directory)
+    else:
+        media_ids, indptr = compute_statistics(store, media_type, directory, block_bytes, changes)
+
+    np.save(os.path.join(directory, 'media_ids.npy'), media_ids.astype(np.int32))
+    np.save(os.path.join(directory, 'indptr.npy'), indptr)
+    rank_neighbours(load_statistics(directory, indptr), media_ids, neighbours, shrinkage, directory)
+
+    users, ratings = store.count(media_type)
+    meta = {'version': int(version),
+            'format': index_format,
+            'media_type': media_type,
+            'users': users,
+            'ratings': ratings,
+            'media': len(media_ids),
+            'pairs': int(indptr[-1]),
+            'neighbours': neighbours,
+            'shrinkage': shrinkage,
+            'incremental': incremental,
+            'changed_users': len(changes) if incremental else users,
+            'built_at': time.time(),
+            'seconds': time.perf_counter() - start}
+
+    with open(os.path.join(path, 'meta.json.new'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(os.path.join(path, 'meta.json.new'), os.path.join(path, 'meta.json'))
+
+    store.finish_changes(media_type, changes)
+    if previous is not None:
+        # Readers which still have the old version open keep it, their memory maps outlive the files.
+        shutil.rmtree(previous.directory, ignore_errors=True)
+
+    return meta
+
+
+class ItemIndex:
+    """A built item index (see `build_index`), memory-mapped so that opening it is instant and it is shared between
+    every process using it.
+
+    Attributes:
+        path (str): The directory of the index.
+        meta (dict): The index's metadata.
+        directory (str): The directory of the index's current version.
+        media_ids (np.ndarray): The IDs of the indexed media, in ascending order.
+        neighbours (np.ndarray): The IDs of each piece of media's neighbours, most similar first (0 when unused).
+        similarities (np.ndarray): The similarity of each of those neighbours.
+    """
+    def __init__(self, path: str) -> None:
+        """Initialises the `ItemIndex` class.
+
+        Args:
+            path (str): The directory of the index.
+
+        Raises:
+            FileNotFoundError: if there's no index in `path`
+        """
+        require_numpy('collaborative recommendation')
+
+        self.path = path
+
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+        self.directory = os.path.join(path, str(self.meta['version']))
+        self.media_ids = np.load(os.path.join(self.directory, 'media_ids.npy'), mmap_mode='r')
+        self.neighbours = np.load(os.path.join(self.directory, 'neighbours.npy'), mmap_mode='r')
+        self.similarities = np.load(os.path.join(self.directory, 'similarities.npy'), mmap_mode='r')
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `ItemIndex` class.
+
+        Returns:
+            str: A string representation of the `ItemIndex` class and it's initialisation arguments.
+        """
+        return f'ItemIndex({self.path})'
+
+    def get_statistics(self) -> tuple['np.ndarray', ...]:
+        """Returns the co-rating statistics the index was built from (only needed to build the next one).
+
+        Returns:
+            tuple[np.ndarray, ...]: The row pointers, the columns, the sums of products and the counts.
+        """
+        return load_statistics(self.directory, np.load(os.path.join(self.directory, 'indptr.npy')))
+
+    def get_neighbours(self, media_id: int) -> list[tuple[int, float]]:
+        """Returns the most similar media to a piece of media.
+
+        Args:
+            media_id (int): The ID of the media.
+
+        Returns:
+            list[tuple[int, float]]: The IDs of the neighbours and their similarities, most similar first.
+        """
+        row = int(np.searchsorted(self.media_ids, media_id))
+        if row == len(self.media_ids) or self.media_ids[row] != media_id:
+            return []
+
+        return [(int(neighbour), float(similarity))
+                for neighbour, similarity in zip(self.neighbours[row], self.similarities[row]) if neighbour]
+
+    def recommend(self, media_ids: 'np.ndarray', scores: 'np.ndarray',
+                  exclude: Iterable[int] = ()) -> list[tuple[int, float]]:
+        """Ranks the neighbours of the media a user rated by how much the user should like them.
+
+        Every rated piece of media votes for its neighbours with its similarity to them times how much the user liked
+        it (their score relative to their average), so media close to several favourites come first and media close
+        to what the user disliked are pushed down.
+
+        Args:
+            media_ids (np.ndarray): The IDs of the media the user rated.
+            scores (np.ndarray): The user's scores of those media.
+            exclude (Iterable[int]): The IDs of media that mustn't be recommended (e.g. those already on the list).
+
+        Returns:
+            list[tuple[int, float]]: Every piece of media with a positive total vote and its vote, highest first (ties
+            in ascending order of ID).
+        """
+        media_ids = np.asarray(media_ids)
+        liking = centre(np.asarray(scores))
+        if not len(liking) or not len(self.media_ids):
+            return []
+
+        rows = np.minimum(np.searchsorted(self.media_ids, media_ids), len(self.media_ids) - 1)
+        found = self.media_ids[rows] == media_ids
+        rows, liking = rows[found], liking[found]
+
+        candidates = self.neighbours[rows].ravel()
+        votes = (self.similarities[rows] * liking[:, None]).ravel()
+        wanted = (candidates != 0) & ~np.isin(candidates, np.fromiter(exclude, dtype=np.int64))
+
+        candidate_ids, inverse = np.unique(candidates[wanted], return_inverse=True)
+        totals = np.bincount(inverse, weights=votes[wanted], minlength=len(candidate_ids))
+        order = np.argsort(-totals, kind='stable')
+        order = order[totals[order] > 0]
+
+        return [(int(candidate_ids[position]), float(totals[position])) for position in order]
+
+
+def recommend_collaborative(user: User, media_type: str, predicates: list[Predicate], count: int,
+                            index: ItemIndex | None = None) -> list[Anime | Manga]:
+    """Returns the media, not on the user's list (whatever their status), that users with a similar taste liked most.
+
+    The user's ratings are fetched, the index ranks the neighbours of what they rated, and the ranked media are then
+    looked up 50 at a time and filtered until `count` of them pass every predicate. The ratings aren't stored, users
+    only count towards the index once they've been collected (see `index.py`).
+
+    Args:
+        user (User): The user.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        predicates (list[Predicate]): The predicates the recommendations have to pass (see `filter.build_predicates`).
+        count (int): The number of recommendations.
+        index (ItemIndex | None): The item index. Defaults to the one at `get_index_path(media_type)`.
+
+    Returns:
+        list[Anime | Manga]: At most `count` media entries, best first.
+
+    Raises:
+        IndexMissingError: if there's no index for the type of media
+    """
+    if index is None:
+        try:
+            index = ItemIndex(get_index_path(media_type))
+        except FileNotFoundError:
+            raise IndexMissingError(f'there\'s no {media_type.lower()} index yet, build one with '
+                                    f'`index.py build {media_type.lower()}`') from None
+
+    completed_entries = user.get_completed_entries(media_type)
+    media_ids, scores = unpack_ratings(pack_ratings(completed_entries))
+
+    exclude = fetch_list_ids(user.username, media_type)
+    # The completed entries may come from the list cache, and be ahead of the list as it's fetched here.
+    exclude.update(entry['media']['id'] for entry in completed_entries)
+
+    ranked = [media_id for media_id, _ in index.recommend(media_ids, scores, exclude)]
+    recommendations: list[Anime | Manga] = []
+
+    for start in range(0, len(ranked), 50):
+        batch = (build_media(media, media_type) for media in fetch_media(ranked[start:start + 50]))
+        recommendations.extend(filter_media(batch, predicates))
+        if len(recommendations) >= count:
+            break
+
+    return recommendations[:count]
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,759 @@
+"""Fetchers that download the relevant entries (those which are 'Planning' or 'Paused') of a user's AniList media list.
+
+Every fetcher exposes the same `fetch` method, so the different ways of talking to the AniList API can be swapped for
+one another and compared.
+"""
+
+
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterable, Iterator
+import requests
+import client
+from stream import EntryStream
+
+if TYPE_CHECKING:
+    from snapshot import Snapshot
+
+
+# The statuses on a user's list which are considered for recommendations.
+wanted_statuses = ['PLANNING', 'PAUSED']
+
+# The fields of a piece of media which only some runs need. They're left out of a list's query unless they're asked for
+# (see `get_media_fields`): tags are only needed to rank by similarity, and the final recommendations get theirs along
+# with their descriptions (see `fetch_details`).
+optional_fields = {'tags': '''
+    tags {
+        name
+        rank
+    }
+'''}
+
+# The fields giving the length of each type of media.
+length_fields = {'ANIME': ['episodes'], 'MANGA': ['chapters', 'volumes']}
+
+
+@functools.cache
+def get_media_fields(media_type: str | None = None, fields: frozenset[str] = frozenset(optional_fields)) -> str:
+    """Returns the fields requested for every piece of media, trimmed to what a run needs.
+
+    Descriptions are never included, they are by far the largest field and are only needed for the final
+    recommendations (see `fetch_details`).
+
+    Args:
+        media_type (str | None): The type of media, either 'ANIME' or 'MANGA', to only ask for the length fields of
+            that type. Both types' are asked for if it's `None`.
+        fields (frozenset[str]): The optional fields (see `optional_fields`) to include.
+
+    Raises:
+        ValueError: if one of `fields` isn't an optional field
+
+    Returns:
+        str: The fields, for the body of a GraphQL selection.
+    """
+    if unknown := fields - optional_fields.keys():
+        raise ValueError(f'unknown media fields: {", ".join(sorted(unknown))}')
+
+    lengths = length_fields[media_type] if media_type is not None else length_fields['ANIME'] + length_fields['MANGA']
+
+    return '''
+    id
+    title {
+        english
+        romaji
+    }
+    status
+
+    %s
+
+    isAdult
+
+    genres
+    %s
+    averageScore
+''' % ('\n    '.join(lengths), ''.join(optional_fields[field] for field in sorted(fields)))
+
+
+@functools.cache
+def get_entry_fields(media_type: str | None = None, fields: frozenset[str] = frozenset(optional_fields)) -> str:
+    """Returns the fields requested for every entry of a user's list (see `get_media_fields`). `updatedAt` is what
+    incremental syncing is based on.
+
+    Args:
+        media_type (str | None): The type of media, either 'ANIME' or 'MANGA', or `None` for both.
+        fields (frozenset[str]): The optional fields (see `optional_fields`) to include.
+
+    Returns:
+        str: The fields, for the body of a GraphQL selection.
+    """
+    return '''
+    media {
+        %s
+    }
+
+    status
+    updatedAt
+''' % get_media_fields(media_type, fields)
+
+
+@functools.cache
+def get_list_query(template: str, media_type: str | None = None,
+                   fields: frozenset[str] = frozenset(optional_fields)) -> str:
+    """Returns a query for the entries of a user's list, trimmed to what a run needs.
+
+    Args:
+        template (str): The query, with a `%s` where the entry fields go (e.g. `page_template`).
+        media_type (str | None): The type of media, either 'ANIME' or 'MANGA', or `None` for both.
+        fields (frozenset[str]): The optional fields (see `optional_fields`) to include.
+
+    Returns:
+        str: The query.
+    """
+    return template % get_entry_fields(media_type, fields)
+
+
+# Every field, for both types of media. Kept for anything that builds its own queries.
+media_fields = get_media_fields()
+entry_fields = get_entry_fields()
+
+page_template = '''
+    query ($page: Int, $perPage: Int, $userName: String, $type: MediaType) {
+        Page (page: $page, perPage: $perPage) {
+            pageInfo {
+                lastPage
+            }
+
+            mediaList (userName: $userName, type: $type) {
+                %s
+            }
+        }
+    }
+'''
+
+collection_template = '''
+    query ($userName: String, $type: MediaType, $statusIn: [MediaListStatus], $chunk: Int, $perChunk: Int) {
+        MediaListCollection (userName: $userName, type: $type, status_in: $statusIn, chunk: $chunk,
+                             perChunk: $perChunk) {
+            lists {
+                entries {
+                    %s
+                }
+            }
+
+            hasNextChunk
+        }
+    }
+'''
+
+# Every status is asked for here, since an entry leaving 'Planning'/'Paused' has to be removed from a stored list.
+changes_template = '''
+    query ($page: Int, $perPage: Int, $userName: String, $type: MediaType) {
+        Page (page: $page, perPage: $perPage) {
+            mediaList (userName: $userName, type: $type, sort: UPDATED_TIME_DESC) {
+                %s
+            }
+        }
+    }
+'''
+
+page_query = get_list_query(page_template)
+collection_query = get_list_query(collection_template)
+changes_query = get_list_query(changes_template)
+
+
+class Fetcher:
+    """The interface shared by every fetcher.
+
+    Attributes:
+        fields (frozenset[str]): The optional media fields (see `optional_fields`) asked for.
+        requests_made (int): The number of requests that have been sent to the AniList API by this fetcher.
+    """
+    def __init__(self, fields: Iterable[str] = optional_fields) -> None:
+        """Initialises the `Fetcher` class.
+
+        Args:
+            fields (Iterable[str]): The optional media fields (see `optional_fields`) to ask for.
+        """
+        self.fields = frozenset(fields)
+        self.requests_made = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the fetcher.
+
+        Returns:
+            str: A string representation of the fetcher.
+        """
+        return f'{self.__class__.__name__}()'
+
+    def post(self, query: str, query_variables: dict) -> dict:
+        """Sends a query to the AniList API and returns the `data` part of the response.
+
+        Args:
+            query (str): The query string that will be sent to the AL API.
+            query_variables (dict): The variables required for the query to the AL API.
+
+        Returns:
+            dict: The `data` part of the API's response.
+        """
+        with self._lock:
+            self.requests_made += 1
+
+        return client.post_query(query, query_variables)
+
+    def open(self, query: str, query_variables: dict) -> requests.Response:
+        """Sends a query to the AniList API and returns the response with its body still unread (see
+        `client.open_query`).
+
+        Args:
+            query (str): The query string that will be sent to the AL API.
+            query_variables (dict): The variables required for the query to the AL API.
+
+        Returns:
+            requests.Response: The response.
+        """
+        with self._lock:
+            self.requests_made += 1
+
+        return client.open_query(query, query_variables)
+
+    def fetch(self, username: str, media_type: str) -> list[dict]:
+        """Returns the entries of a user's media list which are either 'Planning' or 'Paused'.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            list[dict]: The matching entries, each one containing the entry's `status` and its `media`.
+        """
+        raise NotImplementedError
+
+    def iter_entries(self, username: str, media_type: str) -> Iterator[dict]:
+        """Yields the entries of a user's media list which are either 'Planning' or 'Paused', as soon as they arrive.
+
+        Fetchers which download a list in several parts override this to yield each part as soon as it's been
+        downloaded, so that it can be processed while the rest is still on its way.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Yields:
+            dict: The matching entries, each one containing the entry's `status` and its `media`.
+        """
+        yield from self.fetch(username, media_type)
+
+    def get_fetched_at(self, username: str, media_type: str) -> float:
+        """Returns how recent the media of a user's list will be when it's next fetched (see `iter_entries`), so
+        that they aren't mistaken for newer data than they are (see `catalogue.MediaCatalogue.add`).
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            float: When the media's data was fetched from AniList, from `time.time`: now, since the list is downloaded.
+        """
+        return time.time()
+
+    def open_snapshot(self, username: str, media_type: str) -> 'Snapshot | None':
+        """Opens a snapshot of a user's list (see `snapshot.py`) if the list would be read from one rather than
+        downloaded, so that it can be ranked without being decoded (see `cache.CachedFetcher.open_snapshot`).
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            Snapshot | None: The snapshot, which the caller has to close: never, since the list is downloaded.
+        """
+        return None
+
+    def fetch_completed(self, username: str, media_type: str) -> list[dict]:
+        """Returns the 'Completed' entries of a user's media list, with the user's score for each of them (see
+        `fetch_completed`).
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            list[dict]: The entries, each one containing the user's `score` and the `media`'s genres and tags.
+        """
+        return fetch_completed(username, media_type)
+
+    def fetch_details(self, media_ids: list[int]) -> dict[int, dict]:
+        """Returns the description and tags of the given media (see `fetch_details`).
+
+        Args:
+            media_ids (list[int]): The IDs of the media on AniList.
+
+        Returns:
+            dict[int, dict]: The `description` and `tags` of each piece of media, keyed by its ID.
+        """
+        return fetch_details(media_ids)
+
+
+class PageFetcher(Fetcher):
+    """Fetches a user's media list by paginating through `Page.mediaList` and discarding the unwanted statuses on the
+    client. This is the original way of fetching a list and is kept as a fallback.
+
+    The first page is fetched on its own. If the query asks for `pageInfo { lastPage }` the remaining pages are then
+    fetched concurrently by up to `workers` threads, otherwise they are fetched one after the other until an empty page
+    is returned.
+
+    Attributes:
+        query (str | None): The query string that will be sent to the AL API, or `None` to build one from `fields`
+            for the type of media being fetched (see `get_list_query`).
+        per_page (int): The number of entries requested per page (AniList allows at most 50).
+        workers (int): The maximum number of pages fetched at the same time.
+    """
+    def __init__(self, query: str | None = None, per_page: int = 50, workers: int = 8,
+                 fields: Iterable[str] = optional_fields) -> None:
+        """Initialises the `PageFetcher` class.
+
+        Args:
+            query (str | None): The query string that will be sent to the AL API, or `None` to build one.
+            per_page (int): The number of entries requested per page (AniList allows at most 50).
+            workers (int): The maximum number of pages fetched at the same time.
+            fields (Iterable[str]): The optional media fields (see `optional_fields`) to ask for, if `query` isn't
+                given.
+        """
+        super().__init__(fields)
+        self.query = query
+        self.per_page = per_page
+        self.workers = min(workers, client.pool_size)
+
+    def get_page(self, query_variables: dict) -> dict:
+        """Returns a single page of a user's media list, as `Page` was returned by the API.
+
+        Args:
+            query_variables (dict): The variables required for the query to the AL API.
+
+        Returns:
+            dict: The page, containing `mediaList` and (if the query asked for it) `pageInfo`.
+        """
+        query = self.query if self.query is not None else get_list_query(page_template, query_variables['type'],
+                                                                         self.fields)
+
+        return self.post(query, query_variables)['Page']
+
+    def paginate(self, query_variables: dict) -> list[dict]:
+        """Returns a single page of a user's media list, or an empty list once pagination has come to an end.
+
+        Args:
+            query_variables (dict): The variables required for the query to the AL API.
+
+        Returns:
+            list[dict]: The elements of the user's media list on this page.
+        """
+        return self.get_page(query_variables)['mediaList'] or []
+
+    def iter_pages(self, query_variables: dict) -> Iterator[list[dict]]:
+        """Yields every page of a user's media list, in page order, as soon as each one has been downloaded.
+
+        Args:
+            query_variables (dict): The variables required for the query to the AL API, starting at the first page.
+
+        Yields:
+            list[dict]: The elements of the user's media list on each page.
+        """
+        first_page = self.get_page(query_variables)
+        last_page = (first_page.get('pageInfo') or {}).get('lastPage')
+
+        if not first_page['mediaList']:
+            return
+        yield first_page['mediaList']
+
+        if last_page is None:
+            page = query_variables['page']
+            while results := self.paginate(query_variables | {'page': page + 1}):
+                yield results
+                page += 1
+            return
+
+        remaining = [query_variables | {'page': page} for page in range(query_variables['page'] + 1, last_page + 1)]
+        if remaining:
+            # `map` hands the results back in the order the pages were submitted, regardless of which finishes first.
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(remaining))) as executor:
+                yield from executor.map(self.paginate, remaining)
+
+    def get_pages(self, query_variables: dict) -> list[list[dict]]:
+        """Returns every page of a user's media list, in page order.
+
+        Args:
+            query_variables (dict): The variables required for the query to the AL API, starting at the first page.
+
+        Returns:
+            list[list[dict]]: The elements of the user's media list, one list per page.
+        """
+        return list(self.iter_pages(query_variables))
+
+    def fetch(self, username: str, media_type: str) -> list[dict]:
+        """Returns the entries of a user's media list which are either 'Planning' or 'Paused'.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            list[dict]: The matching entries, each one containing the entry's `status` and its `media`.
+        """
+        return list(self.iter_entries(username, media_type))
+
+    def iter_entries(self, username: str, media_type: str) -> Iterator[dict]:
+        """Yields the entries of a user's media list which are either 'Planning' or 'Paused', page by page.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Yields:
+            dict: The matching entries, each one containing the entry's `status` and its `media`.
+        """
+        query_variables = {'page': 1,
+                           'perPage': self.per_page,
+                           'userName': username,
+                           'type': media_type}
+
+        for page in self.iter_pages(query_variables):
+            yield from (entry for entry in page if entry['status'] in wanted_statuses)
+
+
+class CollectionFetcher(Fetcher):
+    """Fetches a user's media list through `MediaListCollection`, letting AniList filter by status on the server. Most
+    lists fit into a single chunk, so they are fetched in a single request.
+
+    Each chunk is parsed while it's being downloaded (see `stream.EntryStream`), so its entries are yielded one by one
+    as they arrive, rather than once the whole chunk has been downloaded and decoded.
+
+    Attributes:
+        per_chunk (int): The number of entries requested per chunk (AniList allows at most 500).
+        stream (bool): Whether chunks are parsed while they're downloaded, rather than decoded once they have been.
+    """
+    def __init__(self, per_chunk: int = 500, fields: Iterable[str] = optional_fields, stream: bool = True) -> None:
+        """Initialises the `CollectionFetcher` class.
+
+        Args:
+            per_chunk (int): The number of entries requested per chunk (AniList allows at most 500).
+            fields (Iterable[str]): The optional media fields (see `optional_fields`) to ask for.
+            stream (bool): Whether chunks are parsed while they're downloaded, rather than decoded once they have been.
+        """
+        super().__init__(fields)
+        self.per_chunk = per_chunk
+        self.stream = stream
+
+    def fetch(self, username: str, media_type: str) -> list[dict]:
+        """Returns the entries of a user's media list which are either 'Planning' or 'Paused'.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            list[dict]: The matching entries, each one containing the entry's `status` and its `media`.
+        """
+        return list(self.iter_entries(username, media_type))
+
+    def iter_entries(self, username: str, media_type: str) -> Iterator[dict]:
+        """Yields the entries of a user's media list which are either 'Planning' or 'Paused', chunk by chunk.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Yields:
+            dict: The matching entries, each one containing the entry's `status` and its `media`.
+        """
+        seen = set()
+        query = get_list_query(collection_template, media_type, self.fields)
+        query_variables: dict = {'userName': username,
+                                 'type': media_type,
+                                 'statusIn': wanted_statuses,
+                                 'chunk': 1,
+                                 'perChunk': self.per_chunk}
+
+        while True:
+            if self.stream:
+                collection = EntryStream(self.open(query, query_variables))
+                entries: Iterable[dict] = collection
+            else:
+                data = self.post(query, query_variables)['MediaListCollection']
+                entries = (entry for media_list in data['lists'] for entry in media_list['entries'])
+
+            # An entry can show up in more than one list when the user also keeps it in a custom list.
+            for entry in entries:
+                if entry['media']['id'] not in seen:
+                    seen.add(entry['media']['id'])
+                    yield entry
+
+            if not (collection.has_next_chunk if self.stream else data['hasNextChunk']):
+                break
+            query_variables['chunk'] += 1
+
+
+# A user's finished entries, along with the score they gave each one, which is what their taste is inferred from.
+completed_query = '''
+    query ($userName: String, $type: MediaType, $chunk: Int, $perChunk: Int) {
+        MediaListCollection (userName: $userName, type: $type, status_in: [COMPLETED], chunk: $chunk,
+                             perChunk: $perChunk) {
+            lists {
+                entries {
+                    score (format: POINT_100)
+                    media {
+                        id
+                        genres
+                        tags {
+                            name
+                            rank
+                        }
+                    }
+                }
+            }
+
+            hasNextChunk
+        }
+    }
+'''
+
+# The IDs of every piece of media on a user's list, whatever its status.
+list_ids_query = '''
+    query ($userName: String, $type: MediaType, $chunk: Int, $perChunk: Int) {
+        MediaListCollection (userName: $userName, type: $type, chunk: $chunk, perChunk: $perChunk) {
+            lists {
+                entries {
+                    media {
+                        id
+                    }
+                }
+            }
+
+            hasNextChunk
+        }
+    }
+'''
+
+media_query = '''
+    query ($ids: [Int], $perPage: Int) {
+        Page (perPage: $perPage) {
+            media (id_in: $ids) {
+                %s
+            }
+        }
+    }
+''' % media_fields
+
+# The heavy fields which are left out of a list's query, for the few media that are actually recommended.
+details_query = '''
+    query ($ids: [Int], $perPage: Int) {
+        Page (perPage: $perPage) {
+            media (id_in: $ids) {
+                id
+                description
+                %s
+            }
+        }
+    }
+''' % optional_fields['tags']
+
+
+def fetch_completed(username: str, media_type: str, per_chunk: int = 500) -> list[dict]:
+    """Returns the 'Completed' entries of a user's media list, with the user's score (out of 100) for each of them.
+
+    Args:
+        username (str): The user's AniList username.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        per_chunk (int): The number of entries requested per chunk (AniList allows at most 500).
+
+    Returns:
+        list[dict]: The entries, each one containing the user's `score` and the `media`'s genres and tags.
+    """
+    entries: dict[int, dict] = {}
+    query_variables: dict = {'userName': username,
+                             'type': media_type,
+                             'chunk': 1,
+                             'perChunk': per_chunk}
+
+    while True:
+        collection = client.post_query(completed_query, query_variables)['MediaListCollection']
+
+        for media_list in collection['lists']:
+            entries.update((entry['media']['id'], entry) for entry in media_list['entries'])
+
+        if not collection['hasNextChunk']:
+            return list(entries.values())
+        query_variables['chunk'] += 1
+
+
+def fetch_list_ids(username: str, media_type: str, per_chunk: int = 500) -> set[int]:
+    """Returns the IDs of every piece of media on a user's list, whatever the status of its entry (unlike the
+    fetchers, which only keep 'Planning' and 'Paused' entries).
+
+    Args:
+        username (str): The user's AniList username.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        per_chunk (int): The number of entries requested per chunk (AniList allows at most 500).
+
+    Returns:
+        set[int]: The IDs of the media.
+    """
+    media_ids: set[int] = set()
+    query_variables: dict = {'userName': username,
+                             'type': media_type,
+                             'chunk': 1,
+                             'perChunk': per_chunk}
+
+    while True:
+        collection = client.post_query(list_ids_query, query_variables)['MediaListCollection']
+
+        for media_list in collection['lists']:
+            media_ids.update(entry['media']['id'] for entry in media_list['entries'])
+
+        if not collection['hasNextChunk']:
+            return media_ids
+        query_variables['chunk'] += 1
+
+
+def fetch_media(media_ids: list[int]) -> list[dict]:
+    """Returns the given media (which needn't be on anyone's list), fetching up to 50 of them per request.
+
+    Args:
+        media_ids (list[int]): The IDs of the media on AniList.
+
+    Returns:
+        list[dict]: The media that were found, in the order of `media_ids`, with the same fields as a list entry's
+        `media`.
+    """
+    found: dict[int, dict] = {}
+
+    for start in range(0, len(media_ids), 50):
+        batch = media_ids[start:start + 50]
+        results = client.post_query(media_query, {'ids': batch, 'perPage': len(batch)})['Page']['media']
+        found.update((media['id'], media) for media in results)
+
+    return [found[media_id] for media_id in media_ids if media_id in found]
+
+
+def fetch_details(media_ids: list[int]) -> dict[int, dict]:
+    """Returns the description and tags of the given media, fetching up to 50 of them per request.
+
+    Args:
+        media_ids (list[int]): The IDs of the media on AniList.
+
+    Returns:
+        dict[int, dict]: The `description` and `tags` of each piece of media, keyed by its ID.
+    """
+    details: dict[int, dict] = {}
+
+    for start in range(0, len(media_ids), 50):
+        batch = media_ids[start:start + 50]
+        results = client.post_query(details_query, {'ids': batch, 'perPage': len(batch)})['Page']['media']
+        details.update((media['id'], media) for media in results)
+
+    return details
+
+
+def fetch_changes(username: str, media_type: str, since: int, per_page: int = 50,
+                  fields: Iterable[str] = optional_fields) -> tuple[list[dict], int]:
+    """Returns every entry of a user's media list (whatever its status) that was updated at or after `since`.
+
+    The list is paged through from the most recently updated entry backwards, stopping at the first entry older than
+    `since`, so only the changes (plus at most one page of older entries) are downloaded.
+
+    Args:
+        username (str): The user's AniList username.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        since (int): A Unix timestamp, usually the newest `updatedAt` seen at the last sync.
+        per_page (int): The number of entries requested per page (AniList allows at most 50).
+        fields (Iterable[str]): The optional media fields (see `optional_fields`) to ask for, which should be the
+            same as the stored list's.
+
+    Returns:
+        tuple[list[dict], int]: The changed entries, and the number of requests it took to find them.
+    """
+    changes: list[dict] = []
+    query = get_list_query(changes_template, media_type, frozenset(fields))
+    query_variables: dict = {'page': 1,
+                             'perPage': per_page,
+                             'userName': username,
+                             'type': media_type}
+
+    while results := client.post_query(query, query_variables)['Page']['mediaList']:
+        for entry in results:
+            if entry['updatedAt'] < since:
+                return changes, query_variables['page']
+            changes.append(entry)
+        query_variables['page'] += 1
+
+    return changes, query_variables['page']
+
+
+def merge_changes(entries: list[dict], changes: list[dict]) -> list[dict]:
+    """Applies changed entries (see `fetch_changes`) to a stored list of 'Planning'/'Paused' entries.
+
+    Changed entries which are still 'Planning' or 'Paused' replace the stored entry for the same media (or are added
+    if it's new to the list), any others are removed from the list.
+
+    Args:
+        entries (list[dict]): The stored entries.
+        changes (list[dict]): The entries that have changed since the stored entries were fetched.
+
+    Returns:
+        list[dict]: The updated entries.
+    """
+    merged = {entry['media']['id']: entry for entry in entries}
+
+    # `changes` is newest first, so it's applied oldest first for the newest version of an entry to win.
+    for entry in reversed(changes):
+        if entry['status'] in wanted_statuses:
+            merged[entry['media']['id']] = entry
+        else:
+            merged.pop(entry['media']['id'], None)
+
+    return list(merged.values())
+
+
+def get_high_water_mark(entries: list[dict]) -> int:
+    """Returns the newest `updatedAt` among a list of entries.
+
+    Args:
+        entries (list[dict]): Entries of a user's media list.
+
+    Returns:
+        int: The newest `updatedAt`, or 0 if there are no entries.
+    """
+    return max((entry.get('updatedAt') or 0 for entry in entries), default=0)
+
+
+fetchers = {'collection': CollectionFetcher,
+            'page': PageFetcher}
+
+
+def get_fetcher(fetch_mode: str, fields: Iterable[str] = optional_fields) -> Fetcher:
+    """Returns a new fetcher for the given fetch mode.
+
+    Args:
+        fetch_mode (str): One of the keys of `fetchers`.
+        fields (Iterable[str]): The optional media fields (see `optional_fields`) to ask for.
+
+    Raises:
+        ValueError: if `fetch_mode` is not a known fetch mode
+
+    Returns:
+        Fetcher: A fetcher for the given fetch mode.
+    """
+    if fetch_mode not in fetchers:
+        raise ValueError(f'\'{fetch_mode}\' is not a valid fetch mode')
+
+    return fetchers[fetch_mode](fields=fields)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
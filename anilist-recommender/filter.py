@@ -1,20 +1,141 @@
 """Takes entries from the user's AniList and filters them based on the criteria given in the command line arguments."""
 
 
+import argparse
+import heapq
+from typing import Callable, Iterable, Iterator
 from media import Anime, Manga
 import prep
+import profiling
 
 
-def sort_score(media_list: list[Anime | Manga]) -> list[Anime | Manga]:
-    """Sorts a list of anime or manga, by their scores on AniList, in descending order.
+def score_key(media: Anime | Manga) -> int:
+    """Returns the value that media entries are ranked by: their score on AniList, or -1 for entries without a score so
+    that they are ranked last.
+
+    Args:
+        media (Anime | Manga): A piece of media on AniList.
+
+    Returns:
+        int: The ranking value of the media.
+    """
+    return media.score if media.score is not None else -1
+
+
+def sort_score(media_list: list[Anime | Manga], count: int | None = None) -> list[Anime | Manga]:
+    """Sorts a list of anime or manga, by their scores on AniList, in descending order. Entries without a score are
+    placed last, and entries with the same score keep their order from `media_list`.
 
     Args:
         media_list (list[Anime | Manga]): A list of anime or manga, containing instances of the `Anime`/`Manga` classes.
+        count (int | None): If given, only the `count` best entries are selected (see `top_k`) instead of the whole
+            list being sorted.
 
     Returns:
         list[Anime | Manga]: A sorted list of anime or manga entries, in descending order of their scores on AniList.
     """
-    return sorted(media_list, key=lambda media: media.score, reverse=True)
+    if count is not None:
+        return top_k(media_list, count)
+
+    return sorted(media_list, key=score_key, reverse=True)
+
+
+def top_k(media_iterable: Iterable[Anime | Manga], count: int) -> list[Anime | Manga]:
+    """Returns the `count` best entries by score, in the same order that `sort_score` would put them in.
+
+    Only a heap of `count` entries is kept while the entries are consumed, so this takes O(n log k) time instead of
+    O(n log n), and works on any iterable (e.g. a generator over a list that is still being downloaded) without the
+    whole list ever being held in memory.
+
+    Args:
+        media_iterable (Iterable[Anime | Manga]): The media entries to choose from.
+        count (int): The number of entries to return.
+
+    Returns:
+        list[Anime | Manga]: At most `count` media entries, in descending order of their scores on AniList.
+    """
+    ranking = StreamingTopK(count)
+    # Entries are pulled through the filter (and the fetch before it) by the ranking, whose own spans are taken off.
+    with profiling.span('rank'):
+        ranking.extend(media_iterable)
+
+        return ranking.result()
+
+
+class StreamingTopK:
+    """Keeps a running selection of the best `count` entries by score, as entries are added one by one.
+
+    Ties are broken deterministically in favour of the entry that was added first, which is what a stable sort would
+    do as well.
+
+    Attributes:
+        count (int): The number of entries to keep.
+        seen (int): The number of entries that have been added so far.
+    """
+    def __init__(self, count: int) -> None:
+        """Initialises the `StreamingTopK` class.
+
+        Args:
+            count (int): The number of entries to keep.
+        """
+        self.count = count
+        self.seen = 0
+
+        # A min-heap of (score, -arrival, media), so the root is always the entry that would be dropped next.
+        self._heap: list[tuple[int, int, Anime | Manga]] = []
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `StreamingTopK` class.
+
+        Returns:
+            str: A string representation of the `StreamingTopK` class and it's initialisation arguments.
+        """
+        return f'StreamingTopK({self.count})'
+
+    def push(self, media: Anime | Manga) -> None:
+        """Adds an entry to the selection, if it's better than the worst entry currently kept.
+
+        Args:
+            media (Anime | Manga): A piece of media on AniList.
+        """
+        self.extend((media,))
+
+    def extend(self, media_iterable: Iterable[Anime | Manga]) -> None:
+        """Adds every entry of an iterable to the selection.
+
+        Args:
+            media_iterable (Iterable[Anime | Manga]): The media entries to add.
+        """
+        heap = self._heap
+        count = self.count
+        seen = self.seen
+        threshold = heap[0][0] if len(heap) == count and heap else None
+
+        # This loop is the hot path when ranking large lists, so `score_key` is inlined and the heap's root is only
+        # looked at again when it changes. An entry arriving later loses a tie, so it has to beat the worst score kept.
+        for media in media_iterable:
+            score = media.score if media.score is not None else -1
+
+            if threshold is None:
+                if count > 0:
+                    heapq.heappush(heap, (score, -seen, media))
+                    if len(heap) == count:
+                        threshold = heap[0][0]
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, -seen, media))
+                threshold = heap[0][0]
+
+            seen += 1
+
+        self.seen = seen
+
+    def result(self) -> list[Anime | Manga]:
+        """Returns the entries currently selected, best first.
+
+        Returns:
+            list[Anime | Manga]: At most `count` media entries, in descending order of their scores on AniList.
+        """
+        return [item[2] for item in sorted(self._heap, key=lambda item: item[:2], reverse=True)]
 
 
 def match_genre(user_genres: list[str], media: Anime | Manga, strict_match: bool) -> bool:
@@ -28,6 +149,9 @@ def match_genre(user_genres: list[str], media: Anime | Manga, strict_match: bool
     However with `strict_match`, the aim is to have the media's genres precisely match with the user's genres, no
     extras at all.
 
+    Both are checked with the genre bitmasks (see `prep.get_genre_mask`): the media's bitmask has to contain the user's
+    for a non-strict match, and has to be contained by it for a strict match.
+
     Args:
         user_genres (list[str]): A list of genres that the user is interested in.
         media (Anime | Manga): A piece of media on AniList.
@@ -36,21 +160,91 @@ def match_genre(user_genres: list[str], media: Anime | Manga, strict_match: bool
     Returns:
         bool: Will return a boolean value, indicating whether the media entry satisfied the genre requirements or not.
     """
-    media_genres = prep.get_list_lowercase(media.genres)
+    return match_genre_mask(prep.get_genre_mask(user_genres), media.genre_mask, strict_match)
+
 
+def match_genre_mask(user_mask: int, media_mask: int, strict_match: bool) -> bool:
+    """Does the same as `match_genre`, but on genre bitmasks which have already been computed.
+
+    Args:
+        user_mask (int): The bitmask of the genres that the user is interested in.
+        media_mask (int): The bitmask of the media's genres.
+        strict_match (bool): Whether the user is looking for strict matches or not.
+
+    Returns:
+        bool: Whether the media's genres satisfy the genre requirements or not.
+    """
     if not strict_match:
-        for genre in user_genres:
-            if genre not in media_genres:
-                return False
-        return True
+        return media_mask & user_mask == user_mask
     else:
-        for genre in media_genres:
-            if genre not in user_genres:
-                return False
-        return True
+        return media_mask & ~user_mask == 0
+
+
+class GenreIndex:
+    """An inverted index from each genre to the media entries that have it, so that genre queries only have to look at
+    the entries which could possibly match instead of the whole list.
+
+    Attributes:
+        media_list (list[Anime | Manga]): The indexed media entries.
+        postings (dict[int, list[int]]): The positions in `media_list` of the entries which have each genre, keyed by
+            the genre's bit.
+        no_genres (list[int]): The positions in `media_list` of the entries without any genres.
+    """
+    def __init__(self, media_list: list[Anime | Manga]) -> None:
+        """Initialises the `GenreIndex` class.
+
+        Args:
+            media_list (list[Anime | Manga]): The media entries to index.
+        """
+        self.media_list = list(media_list)
+        self.postings: dict[int, list[int]] = {}
+        self.no_genres: list[int] = []
+
+        for position, media in enumerate(self.media_list):
+            mask = media.genre_mask
+            if not mask:
+                self.no_genres.append(position)
+            while mask:
+                bit = mask & -mask
+                self.postings.setdefault(bit, []).append(position)
+                mask ^= bit
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `GenreIndex` class.
+
+        Returns:
+            str: A string representation of the `GenreIndex` class.
+        """
+        return f'GenreIndex({len(self.media_list)} entries, {len(self.postings)} genres)'
+
+    def query(self, user_genres: list[str], strict_match: bool) -> list[Anime | Manga]:
+        """Returns the indexed entries which fit the genre requirements (see `match_genre`), in their original order.
+
+        Args:
+            user_genres (list[str]): A list of the user's preferred genres.
+            strict_match (bool): Whether the user is looking for strict matches or not.
+
+        Returns:
+            list[Anime | Manga]: The matching media entries.
+        """
+        user_mask = prep.get_genre_mask(user_genres)
+        bits = [1 << bit for bit in range(user_mask.bit_length()) if user_mask >> bit & 1]
+
+        if not bits:
+            candidates: Iterable[int] = range(len(self.media_list)) if not strict_match else self.no_genres
+        elif not strict_match:
+            # Every match has to appear in the shortest posting list, so it's the only one that needs to be checked.
+            shortest: list[int] = min((self.postings.get(bit, []) for bit in bits), key=len)
+            candidates = shortest
+        else:
+            candidates = set(self.no_genres).union(*(self.postings.get(bit, []) for bit in bits))
+
+        return [self.media_list[position] for position in sorted(candidates)
+                if match_genre_mask(user_mask, self.media_list[position].genre_mask, strict_match)]
 
 
-def filter_genre(user_genres: list[str], media_list: list[Anime | Manga], strict_match: bool) -> list[Anime | Manga]:
+def filter_genre(user_genres: list[str], media_list: list[Anime | Manga], strict_match: bool,
+                 index: GenreIndex | None = None) -> list[Anime | Manga]:
     """Given: the user's list of preferred genres, a list of anime or manga, and whether the user is okay with strict
     matches or not, this function will filter the given media list and discard any entries that do not fit the genre
     requirements.
@@ -59,11 +253,170 @@ def filter_genre(user_genres: list[str], media_list: list[Anime | Manga], strict
         user_genres (list[str]): A list of the user's preferred genres
         media_list (list[Anime | Manga]): A list containing media entries.
         strict_match (bool): A boolean indicating whether the user is okay with strict matches or not.
+        index (GenreIndex | None): A `GenreIndex` of `media_list`. When given, only the entries which could match are
+            looked at, which pays off when the same (large) list is queried repeatedly.
 
     Returns:
         list[Anime | Manga]: The list of media entries filtered according to the genre requirements.
     """
-    return [media for media in media_list if match_genre(user_genres, media, strict_match)]
+    if index is not None:
+        return index.query(user_genres, strict_match)
+
+    user_mask = prep.get_genre_mask(user_genres)
+
+    return [media for media in media_list if match_genre_mask(user_mask, media.genre_mask, strict_match)]
+
+
+# A named test that a media entry has to pass to be recommended.
+Predicate = tuple[str, Callable[[Anime | Manga], bool]]
+
+
+def get_length(media: Anime | Manga) -> int | None:
+    """Returns the length of a piece of media, which is what `--lower-bound` and `--upper-bound` apply to: the number
+    of episodes for anime, and the number of chapters (or volumes, if the chapters aren't known) for manga.
+
+    Args:
+        media (Anime | Manga): A piece of media on AniList.
+
+    Returns:
+        int | None: The length of the media, or `None` if it isn't known (e.g. because it's still releasing).
+    """
+    if isinstance(media, Anime):
+        return media.episodes
+
+    return media.chapters if media.chapters is not None else media.volumes
+
+
+def build_predicates(genres: list[str] | None = None, strict_match: bool = False, adult: bool = False,
+                     lower_bound: int | None = None, upper_bound: int | None = None,
+                     statuses: Iterable[str] | None = None) -> list[Predicate]:
+    """Returns the predicates that media entries have to pass for the given criteria, cheapest first.
+
+    Only the criteria that are actually set produce a predicate, so an unfiltered run doesn't pay for any checks.
+
+    Args:
+        genres (list[str] | None): A list of the user's preferred genres.
+        strict_match (bool): Whether the user is looking for strict matches or not.
+        adult (bool): Whether the user is okay with series marked as 'Adult' on AniList.
+        lower_bound (int | None): A lower bound on the length of the media (see `get_length`).
+        upper_bound (int | None): An upper bound on the length of the media (see `get_length`).
+        statuses (Iterable[str] | None): The statuses on the user's list that are allowed.
+
+    Returns:
+        list[Predicate]: The named predicates, in the order that they should be checked in.
+    """
+    predicates: list[Predicate] = []
+
+    if not adult:
+        predicates.append(('adult', lambda media: not media.adult))
+
+    if statuses is not None:
+        allowed_statuses = frozenset(statuses)
+        predicates.append(('status', lambda media: media.user_status in allowed_statuses))
+
+    # Media of unknown length can't be shown to be within a bound, so they fail it.
+    if lower_bound is not None and upper_bound is not None:
+        predicates.append(('bounds', lambda media: (length := get_length(media)) is not None
+                           and lower_bound <= length <= upper_bound))
+    elif lower_bound is not None:
+        predicates.append(('bounds', lambda media: (length := get_length(media)) is not None and length >= lower_bound))
+    elif upper_bound is not None:
+        predicates.append(('bounds', lambda media: (length := get_length(media)) is not None and length <= upper_bound))
+
+    if genres is not None:
+        user_mask = prep.get_genre_mask(genres)
+        if not strict_match:
+            predicates.append(('genre', lambda media: media.genre_mask & user_mask == user_mask))
+        else:
+            predicates.append(('genre', lambda media: media.genre_mask & ~user_mask == 0))
+
+    return predicates
+
+
+def get_predicates(args: argparse.Namespace) -> list[Predicate]:
+    """Returns the predicates for the criteria given in the command line arguments (see `build_predicates`).
+
+    Args:
+        args (argparse.Namespace): The arguments that the user entered and their values.
+
+    Returns:
+        list[Predicate]: The named predicates, in the order that they should be checked in.
+    """
+    return build_predicates(args.genre, args.strict_match, args.adult, args.lower_bound, args.upper_bound)
+
+
+def filter_media(media_iterable: Iterable[Anime | Manga], predicates: list[Predicate]) -> Iterator[Anime | Manga]:
+    """Lazily yields the media entries that pass every predicate, in a single pass over `media_iterable`.
+
+    Each entry is checked against the predicates in order and dropped at the first one it fails, so adding more
+    criteria never adds another pass over the list.
+
+    Args:
+        media_iterable (Iterable[Anime | Manga]): The media entries to filter.
+        predicates (list[Predicate]): The named predicates (see `build_predicates`).
+
+    Yields:
+        Anime | Manga: The media entries that pass every predicate.
+    """
+    if profiling.enabled:
+        yield from _filter_media_profiled(media_iterable, predicates)
+        return
+
+    tests = [test for _, test in predicates]
+
+    for media in media_iterable:
+        for test in tests:
+            if not test(media):
+                break
+        else:
+            yield media
+
+
+def _filter_media_profiled(media_iterable: Iterable[Anime | Manga],
+                           predicates: list[Predicate]) -> Iterator[Anime | Manga]:
+    """Does the same as `filter_media`, but also times the checks (as the `filter` stage) and counts the entries that
+    each predicate filters out (as `filtered_out_<predicate>`).
+
+    Args:
+        media_iterable (Iterable[Anime | Manga]): The media entries to filter.
+        predicates (list[Predicate]): The named predicates (see `build_predicates`).
+
+    Yields:
+        Anime | Manga: The media entries that pass every predicate.
+    """
+    filtered_out = dict.fromkeys((name for name, _ in predicates), 0)
+    checked = 0
+
+    try:
+        for media in media_iterable:
+            checked += 1
+            with profiling.Span('filter'):
+                for name, test in predicates:
+                    if not test(media):
+                        filtered_out[name] += 1
+                        break
+                else:
+                    name = None
+            if name is None:
+                yield media
+    finally:
+        profiling.count('entries_checked', checked)
+        for name, value in filtered_out.items():
+            profiling.count(f'filtered_out_{name}', value)
+
+
+def recommend(media_iterable: Iterable[Anime | Manga], args: argparse.Namespace) -> list[Anime | Manga]:
+    """Filters media entries by the criteria given in the command line arguments and returns the best `args.count` of
+    them, feeding the filter straight into the ranking so that the entries are only gone through once.
+
+    Args:
+        media_iterable (Iterable[Anime | Manga]): The media entries to choose from.
+        args (argparse.Namespace): The arguments that the user entered and their values.
+
+    Returns:
+        list[Anime | Manga]: At most `args.count` media entries, in descending order of their scores on AniList.
+    """
+    return top_k(filter_media(media_iterable, get_predicates(args)), args.count)
 
 
 def main():
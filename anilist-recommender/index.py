@@ -0,0 +1,83 @@
+"""Collects users' ratings and builds the item index behind collaborative recommendations (see `collaborative.py`).
+
+`python index.py collect anime usernames.txt` fetches the completed entries of every listed user and stores their
+ratings, and `python index.py build anime` builds the index from them (incrementally, after the first time).
+"""
+
+
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import IO, Iterable
+import args
+import client
+from batch import read_usernames
+from collaborative import RatingStore, build_index
+from fetch import fetch_completed
+
+
+def collect_ratings(usernames: Iterable[str], media_type: str, store: RatingStore, workers: int = 8,
+                    progress: IO | None = None) -> tuple[int, int]:
+    """Fetches the completed entries of many users and stores their ratings.
+
+    Like `batch.run_batch`, only a few more users than are fetched at once are read ahead, so that a huge list of
+    usernames doesn't have to be held in memory.
+
+    Args:
+        usernames (Iterable[str]): The users' AniList usernames.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        store (RatingStore): Where the ratings are stored.
+        workers (int): The number of users fetched at the same time (requests are still paced by the shared
+            scheduler, see `client.Scheduler`).
+        progress (IO | None): Where failures are reported, if anywhere.
+
+    Returns:
+        tuple[int, int]: The number of users whose ratings changed and the number whose lists couldn't be fetched.
+    """
+    def collect(username: str) -> bool | None:
+        try:
+            return store.put(username, media_type, fetch_completed(username, media_type))
+        except client.AniListError as error:
+            if progress is not None:
+                print(f'{username}: {error}', file=progress)
+            return None
+
+    changed = failed = 0
+
+    def count(done: set[Future]) -> None:
+        nonlocal changed, failed
+        for future in done:
+            changed += future.result() is True
+            failed += future.result() is None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: set[Future] = set()
+
+        for username in usernames:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                count(done)
+            pending.add(executor.submit(collect, username))
+
+        count(wait(pending).done)
+
+    return changed, failed
+
+
+def main():
+    arguments = args.add_index_args()
+    media_type = arguments.type.upper()
+    store = RatingStore()
+
+    if arguments.command == 'collect':
+        with open(arguments.usernames) if arguments.usernames != '-' else sys.stdin as lines:
+            changed, failed = collect_ratings(read_usernames(lines), media_type, store, arguments.workers, sys.stderr)
+        print(f'{changed} users\' ratings changed, {failed} users couldn\'t be fetched')
+    else:
+        meta = build_index(store, media_type, arguments.path, arguments.neighbours, full=arguments.full)
+        print(f'{meta["media"]} media from {meta["users"]} users ({meta["ratings"]} ratings), '
+              f'{"incremental" if meta["incremental"] else "full"} build of {meta["changed_users"]} users\' '
+              f'ratings in {meta["seconds"]:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,175 @@
-query = '''
-    query ($page: Int, $perPage: Int, $userName: String, $type: MediaType) {
-        Page (page: $page, perPage: $perPage) {
-            mediaList (userName: $userName, type: $type) {
-                media {
-                    title {
-                        english
-                        romaji
-                    }
-                    status
+"""Generates anime/manga recommendations for an AniList user, using the arguments given on the command line."""
 
-                    episodes
 
-                    chapters
-                    volumes
+import re
+import sys
+from typing import Iterator
+import args
+import profiling
+from cache import CachedFetcher, CacheMissError, ListCache
+from catalogue import MediaCatalogue, load_user_list
+from client import AniListError
+from fetch import Fetcher, get_fetcher, page_query as query  # noqa: F401 (`main.query` is kept for compatibility)
+from filter import filter_media, get_predicates, recommend
+from media import Anime, Manga
+from user import User, load_descriptions
 
-                    isAdult
 
-                    genres
-                    description
+def get_list_fields(arguments) -> frozenset[str]:
+    """Returns the optional media fields (see `fetch.optional_fields`) that a user's whole list has to be fetched with
+    for the arguments given. Anything else that the output needs is only fetched for the final recommendations.
 
-                    averageScore
-                }
+    Args:
+        arguments (argparse.Namespace): The arguments that the user entered and their values.
 
-                status
-            }
-        }
-    }
-'''
+    Returns:
+        frozenset[str]: The optional fields: tags when ranking by similarity, and nothing otherwise.
+    """
+    if getattr(arguments, 'rank', 'score') == 'similarity' and not getattr(arguments, 'collaborative', False):
+        return frozenset({'tags'})
+
+    return frozenset()
+
+
+def get_cached_fetcher(arguments) -> CachedFetcher:
+    """Returns the fetcher (and cache) described by the arguments given.
+
+    Args:
+        arguments (argparse.Namespace): The arguments that the user entered and their values.
+
+    Returns:
+        CachedFetcher: A fetcher for `arguments.fetch_mode`, only asking for the fields that the arguments need (see
+        `get_list_fields`), wrapped in the list cache.
+    """
+    return CachedFetcher(get_fetcher(arguments.fetch_mode, get_list_fields(arguments)),
+                         ListCache(ttl=arguments.cache_ttl), refresh=arguments.refresh, offline=arguments.offline,
+                         full_sync_ttl=arguments.full_sync_ttl)
+
+
+def get_media_max_age(arguments) -> float:
+    """Returns how old the media of a list served by the fetcher from `get_cached_fetcher` can be. A stored list is
+    used for `cache_ttl` seconds after it was last synced, and a synced list keeps the media of its last full download,
+    which is at most `full_sync_ttl` seconds older (see `cache.CachedFetcher`).
+
+    A media catalogue mustn't refresh the media of such a list by ID any sooner (see `catalogue.MediaCatalogue`):
+    that takes a request per 50 media, against one per 500 for downloading the whole list again.
+
+    Args:
+        arguments (argparse.Namespace): The arguments that the user entered and their values.
+
+    Returns:
+        float: The age, in seconds.
+    """
+    return arguments.cache_ttl + arguments.full_sync_ttl
+
+
+def get_recommendations(arguments, username: str | None = None, fetcher: Fetcher | None = None,
+                        catalogue: MediaCatalogue | None = None) -> list[Anime | Manga]:
+    """Fetches the user's media list and returns the entries which best fit the arguments given.
+
+    Args:
+        arguments (argparse.Namespace): The arguments that the user entered and their values.
+        username (str | None): The user's AniList username. Defaults to `arguments.username`.
+        fetcher (Fetcher | None): The fetcher used to download the user's list, so that it can be shared between
+            users. Defaults to a new one from `get_cached_fetcher`.
+        catalogue (MediaCatalogue | None): A catalogue shared between users, so that media on several users' lists
+            are only built (and have their descriptions fetched) once. Only used when ranking by score, for lists that
+            are downloaded or synced: a list served from the cache as it is is ranked from its snapshot instead (see
+            `cache.ListCache.open_snapshot`).
+
+    Returns:
+        list[Anime | Manga]: At most `arguments.count` media entries, in descending order of their scores on AniList.
+    """
+    if fetcher is None:
+        fetcher = get_cached_fetcher(arguments)
+    user = User(username if username is not None else arguments.username, fetcher)
+
+    media_iterable: Iterator[Anime | Manga]
+    if arguments.type == 'anime':
+        media_iterable = user.iter_anime_list()
+    else:
+        media_iterable = user.iter_manga_list()
+
+    if getattr(arguments, 'collaborative', False):
+        # Imported here so that NumPy is only needed (and loaded) when it's actually used.
+        from collaborative import recommend_collaborative
+
+        with profiling.span('rank'):
+            recommendations = recommend_collaborative(user, arguments.type.upper(), get_predicates(arguments),
+                                                      arguments.count)
+    elif getattr(arguments, 'rank', 'score') == 'similarity':
+        from rank import rank_similarity
+
+        candidates = list(filter_media(media_iterable, get_predicates(arguments)))
+        with profiling.span('rank'):
+            recommendations = rank_similarity(candidates, user.get_completed_entries(arguments.type.upper()),
+                                              arguments.count)
+    elif (snapshot := fetcher.open_snapshot(user.username, arguments.type.upper())) is not None:
+        # The list is served from the cache as it is, so it's ranked straight from the columns of its snapshot, and
+        # only the recommendations are built.
+        with snapshot, profiling.span('rank'):
+            recommendations = snapshot.recommend(arguments)
+    elif catalogue is not None:
+        fetched_at = fetcher.get_fetched_at(user.username, arguments.type.upper())
+        user_list = load_user_list(user.iter_entries(arguments.type.upper()), arguments.type.upper(), catalogue,
+                                   fetched_at)
+        recommendations = recommend(user_list.iter_media(offline=arguments.offline), arguments)
+        load_descriptions(recommendations, fetcher)
+        # The catalogue's media are shared, the user gets copies of them with their own statuses.
+        return user_list.attach(recommendations)
+    else:
+        # The ranking is kept up to date while the list is still arriving, the whole list is never held or sorted.
+        recommendations = recommend(media_iterable, arguments)
+    # Served from the list cache where possible, and never fetched when offline (see `CachedFetcher.fetch_details`).
+    load_descriptions(recommendations, fetcher)
+
+    return recommendations
+
+
+def format_media(media: Anime | Manga) -> str:
+    """Returns a short, human readable summary of a media entry.
+
+    Args:
+        media (Anime | Manga): A piece of media on AniList.
+
+    Returns:
+        str: The title of the media, followed by its score, genres, length and (if it was fetched) description.
+    """
+    title = media.title_english or media.title_romaji
+
+    if isinstance(media, Anime):
+        length = f'{media.episodes} episodes'
+    else:
+        length = f'{media.chapters} chapters, {media.volumes} volumes'
+
+    summary = f'{title}\n    Score: {media.score}\n    Genres: {", ".join(media.genres)}\n    Length: {length}'
+
+    if media.description:
+        # AniList descriptions are HTML, only the text of the first paragraph is shown.
+        description = re.sub(r'<[^>]+>', '', media.description.split('<br>')[0]).strip()
+        summary += f'\n    Description: {description}'
+
+    return summary
 
 
 def main():
-    pass
+    arguments = args.add_args()
+    args.check_args(arguments)
+    profiling.enable(arguments.profile)
+
+    try:
+        with profiling.capture(arguments.profile_capture):
+            recommendations = get_recommendations(arguments)
+    except (AniListError, CacheMissError, ImportError) as error:
+        # An `ImportError` is an optional dependency that the ranking needs, with how to install it (see
+        # `rank.require_numpy`).
+        raise SystemExit(f'error: {error}')
+
+    for rank, media in enumerate(recommendations, start=1):
+        print(f'{rank}. {format_media(media)}')
+
+    if arguments.profile:
+        print(profiling.format_breakdown(profiling.get_metrics()), file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,401 @@
+"""A store of precomputed recommendations for the server, so that a request which has been answered before is served
+with a single lookup instead of the user's list being filtered and ranked again.
+
+Results are kept per user and combination of options (type, genres, strict matching, bounds and adult), with the best
+`depth` entries each, which covers any `count` up to `depth`. A result stays valid for as long as nothing it was
+computed from has changed:
+
+- the user's list must still be the one held by the `server.MediaListStore`. When a list is fetched again (which syncs
+  it incrementally, see `cache.CachedFetcher`) and turns out not to have changed, the store keeps the list it held, so
+  the result stays valid;
+- none of the media on the list may have changed their score, genres, adult rating or length in the media catalogue
+  since (see `catalogue.MediaCatalogue.changed_since`).
+
+A background refresher recomputes the results which have become invalid, and those whose list is about to expire,
+before they're next requested. It goes through them in order of how often they've been requested lately, and drops
+the ones which haven't been. A result that fails to be recomputed is dropped too, and unexpected errors are logged
+(and counted) rather than stopping the refresher.
+"""
+
+
+import argparse
+import logging
+import threading
+from typing import TYPE_CHECKING
+from catalogue import UserList
+from cache import CacheMissError
+from client import AniListError
+from filter import recommend
+import profiling
+from user import load_descriptions
+
+if TYPE_CHECKING:
+    from server import MediaListStore
+
+logger = logging.getLogger(__name__)
+
+
+Key = tuple[str, str, tuple[str, ...] | None, bool, int | None, int | None, bool]
+
+
+def get_key(arguments: argparse.Namespace) -> Key:
+    """Returns the key that the recommendations for a request are stored under. The order of the genres and the case
+    of the username don't matter, and neither does `count`.
+
+    Args:
+        arguments (argparse.Namespace): The arguments of the request (see `server.parse_query`).
+
+    Returns:
+        Key: The username, type, genres, strict matching, bounds and adult option of the request.
+    """
+    return (arguments.username.lower(), arguments.type,
+            tuple(sorted(set(arguments.genre))) if arguments.genre is not None else None,
+            arguments.strict_match, arguments.lower_bound, arguments.upper_bound, arguments.adult)
+
+
+class Materialized:
+    """The precomputed recommendations for a user and combination of options.
+
+    Attributes:
+        arguments (argparse.Namespace): The arguments of the request that they were first computed for.
+        user_list (UserList): The list they were computed from.
+        generation (int): The catalogue's generation when they were computed (or last checked).
+        recommendations (list[dict]): The best `depth` media on the list, as they're sent to clients.
+        depth (int): The number of recommendations that were asked for.
+        requests (float): The number of times they've been requested lately (see `RecommendationStore.decay`).
+    """
+    __slots__ = ('arguments', 'user_list', 'generation', 'recommendations', 'depth', 'requests')
+
+    def __init__(self, arguments: argparse.Namespace, user_list: UserList, generation: int,
+                 recommendations: list[dict], depth: int) -> None:
+        """Initialises the `Materialized` class.
+
+        Args:
+            arguments (argparse.Namespace): The arguments of the request that they were computed for.
+            user_list (UserList): The list they were computed from.
+            generation (int): The catalogue's generation when they were computed.
+            recommendations (list[dict]): The best `depth` media on the list, as they're sent to clients.
+            depth (int): The number of recommendations that were asked for.
+        """
+        self.arguments = arguments
+        self.user_list = user_list
+        self.generation = generation
+        self.recommendations = recommendations
+        self.depth = depth
+        self.requests = 0.0
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `Materialized` class.
+
+        Returns:
+            str: A string representation of the `Materialized` class and it's initialisation arguments.
+        """
+        return f'Materialized({self.arguments}, {self.user_list!r}, {self.generation}, ' \
+               f'<{len(self.recommendations)} recommendations>, {self.depth})'
+
+    def covers(self, count: int) -> bool:
+        """Returns whether the first `count` recommendations are all held.
+
+        Args:
+            count (int): The number of recommendations asked for.
+
+        Returns:
+            bool: `True` if `count` is at most `depth`, or if the list had fewer matching media than `depth`.
+        """
+        return count <= self.depth or len(self.recommendations) < self.depth
+
+
+class RecommendationStore:
+    """Serves recommendations from precomputed results where possible, computing (and keeping) them otherwise.
+
+    At most `max_entries` results are kept, and when there are more the least requested ones are dropped. With
+    `max_entries` set to 0 nothing is kept, and every request is computed.
+
+    Attributes:
+        lists (server.MediaListStore): The store that users' lists are taken from.
+        max_entries (int): The maximum number of results kept.
+        depth (int): The number of recommendations computed for each result, at least.
+        refresh_interval (float): The number of seconds between the background refresher's rounds.
+        hits (int): The number of requests served from a precomputed result.
+        misses (int): The number of requests that had to be computed.
+        refreshed (int): The number of results recomputed by the refresher.
+        dropped (int): The number of results dropped, for not being requested or for failing to be recomputed.
+        errors (int): The number of unexpected errors the refresher ran into (see `refresh`).
+    """
+    # The request counts are multiplied by this after every round of the refresher, so that they reflect recent
+    # requests, and results requested fewer than `min_requests` times (after that) are dropped instead of refreshed.
+    decay = 0.5
+    min_requests = 0.1
+
+    # The maximum number of results recomputed in one round of the refresher.
+    refreshes_per_round = 100
+
+    def __init__(self, lists: 'MediaListStore', max_entries: int = 10_000, depth: int = 20,
+                 refresh_interval: float = 60) -> None:
+        """Initialises the `RecommendationStore` class.
+
+        Args:
+            lists (server.MediaListStore): The store that users' lists are taken from.
+            max_entries (int): The maximum number of results kept.
+            depth (int): The number of recommendations computed for each result, at least.
+            refresh_interval (float): The number of seconds between the background refresher's rounds.
+
+        Raises:
+            ValueError: if `max_entries` < 0, `depth` <= 0 or `refresh_interval` <= 0
+        """
+        if max_entries < 0:
+            raise ValueError('`max_entries` must be 0 or greater')
+        if depth <= 0:
+            raise ValueError('`depth` must be greater than 0')
+        if refresh_interval <= 0:
+            raise ValueError('`refresh_interval` must be greater than 0')
+
+        self.lists = lists
+        self.max_entries = max_entries
+        self.depth = depth
+        self.refresh_interval = refresh_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshed = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self._entries: dict[Key, Materialized] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._refresher: threading.Thread | None = None
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `RecommendationStore` class.
+
+        Returns:
+            str: A string representation of the `RecommendationStore` class and it's initialisation arguments.
+        """
+        return f'RecommendationStore({self.lists!r}, {self.max_entries}, {self.depth}, {self.refresh_interval})'
+
+    def __len__(self) -> int:
+        """Returns the number of results kept.
+
+        Returns:
+            int: The number of results.
+        """
+        return len(self._entries)
+
+    def is_valid(self, entry: Materialized, max_age: float | None = None) -> bool:
+        """Returns whether a result is still what computing it again would give.
+
+        Args:
+            entry (Materialized): The result.
+            max_age (float | None): The age (in seconds) up to which the user's list is used. Defaults to the list
+                store's `ttl`.
+
+        Returns:
+            bool: `True` if the user's list is still held (and fresh) and none of its media changed since.
+        """
+        username, media_type = entry.arguments.username, entry.arguments.type
+        if self.lists.peek(username, media_type, max_age) is not entry.user_list:
+            return False
+
+        catalogue = self.lists.catalogue
+        generation = catalogue.generation
+        if entry.generation != generation:
+            changed = catalogue.changed_since(entry.generation)
+            if changed is None or not changed.isdisjoint(entry.user_list.media_ids):
+                return False
+            # The changes don't concern this list, so they needn't be gone through again next time.
+            entry.generation = generation
+
+        return True
+
+    def compute(self, arguments: argparse.Namespace, depth: int, max_age: float | None = None) -> Materialized:
+        """Computes the recommendations for a request.
+
+        Args:
+            arguments (argparse.Namespace): The arguments of the request.
+            depth (int): The number of recommendations computed.
+            max_age (float | None): The age (in seconds) up to which a held list is used. Defaults to the list
+                store's `ttl`.
+
+        Raises:
+            AniListError: if the list (or media on it) had to be fetched and fetching it failed
+            CacheMissError: if the list had to be fetched and the fetcher is offline
+
+        Returns:
+            Materialized: The recommendations.
+        """
+        # Read first, so that changes made while the list is being ranked make the result out of date.
+        generation = self.lists.catalogue.generation
+        user_list = self.lists.get(arguments.username, arguments.type, max_age)
+
+        recommendations = recommend(user_list.iter_media(), argparse.Namespace(**{**vars(arguments), 'count': depth}))
+        load_descriptions(recommendations, self.lists.fetcher)
+
+        return Materialized(arguments, user_list, generation,
+                            [media.to_dict() for media in user_list.attach(recommendations)], depth)
+
+    def get(self, arguments: argparse.Namespace) -> list[dict]:
+        """Returns the recommendations for a request, from a precomputed result if there's a valid one.
+
+        Args:
+            arguments (argparse.Namespace): The arguments of the request (see `server.parse_query`).
+
+        Raises:
+            AniListError: if the list (or media on it) had to be fetched and fetching it failed
+            CacheMissError: if the list had to be fetched and the fetcher is offline
+
+        Returns:
+            list[dict]: At most `arguments.count` media, in descending order of their scores on AniList.
+        """
+        key = get_key(arguments)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.requests += 1
+
+        if entry is not None and entry.covers(arguments.count) and self.is_valid(entry):
+            with self._lock:
+                self.hits += 1
+            profiling.count('materialized_hits')
+            return entry.recommendations[:arguments.count]
+
+        with self._lock:
+            self.misses += 1
+        profiling.count('materialized_misses')
+
+        if not self.max_entries:
+            return self.compute(arguments, arguments.count).recommendations
+
+        computed = self.compute(arguments, max(self.depth, arguments.count))
+        self._put(key, computed, entry.requests if entry is not None else 1)
+
+        return computed.recommendations[:arguments.count]
+
+    def _put(self, key: Key, entry: Materialized, requests: float) -> None:
+        """Keeps a result, dropping the least requested tenth of the results if there are too many.
+
+        Args:
+            key (Key): The key of the result.
+            entry (Materialized): The result.
+            requests (float): The number of times it's been requested lately.
+        """
+        entry.requests = requests
+
+        with self._lock:
+            self._entries[key] = entry
+            if len(self._entries) <= self.max_entries:
+                return
+
+            # Dropping a batch at a time means the results are only sorted every so often.
+            by_requests = sorted(self._entries, key=lambda held: self._entries[held].requests)
+            for held in by_requests[:max(1, len(by_requests) // 10)]:
+                del self._entries[held]
+            self.dropped += max(1, len(by_requests) // 10)
+
+    def _drop(self, key: Key) -> None:
+        """Drops a result, if it's still kept.
+
+        Args:
+            key (Key): The key of the result.
+        """
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.dropped += 1
+
+    def refresh(self) -> None:
+        """Runs one round of the refresher: recomputes the most requested results that are invalid or whose list
+        would expire before the next round, and drops the ones that haven't been requested lately.
+
+        Results that fail to be recomputed are dropped, so that they're computed when they're next requested. Errors
+        other than a failed fetch (e.g. a bug, or a broken disk cache) are logged and counted in `errors`, and the
+        round goes on with the next result.
+        """
+        # Lists due to expire before the next round are fetched again (and synced) now.
+        max_age = max(self.lists.ttl - self.refresh_interval, 0)
+
+        with self._lock:
+            for entry in self._entries.values():
+                entry.requests *= self.decay
+            entries = list(self._entries.items())
+
+        due = [(key, entry) for key, entry in entries if not self.is_valid(entry, max_age)]
+        stale = [key for key, entry in due if entry.requests < self.min_requests]
+        due = sorted((item for item in due if item[1].requests >= self.min_requests),
+                     key=lambda item: item[1].requests, reverse=True)
+
+        for key in stale:
+            self._drop(key)
+
+        for key, entry in due[:self.refreshes_per_round]:
+            try:
+                with profiling.span('refresh'):
+                    # A list which is fetched again (and synced) but hasn't changed is kept, along with the results
+                    # computed from it, so those don't have to be computed again.
+                    self.lists.get(entry.arguments.username, entry.arguments.type, max_age)
+                    if self.is_valid(entry, max_age):
+                        continue
+                    computed = self.compute(entry.arguments, entry.depth, max_age)
+            except (AniListError, CacheMissError):
+                self._drop(key)
+                continue
+            except Exception:
+                logger.exception('failed to refresh the recommendations of %r', entry.arguments.username)
+                with self._lock:
+                    self.errors += 1
+                self._drop(key)
+                continue
+
+            with self._lock:
+                # Results dropped in the meantime stay dropped.
+                if key not in self._entries:
+                    continue
+                computed.requests = self._entries[key].requests
+                self._entries[key] = computed
+                self.refreshed += 1
+
+    def _run(self) -> None:
+        """Runs the refresher until `stop` is called. A round that fails is logged and counted, and the next round
+        goes ahead as usual."""
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('a round of the recommendation refresher failed')
+                with self._lock:
+                    self.errors += 1
+
+    def start(self) -> None:
+        """Starts the background refresher, if results are kept."""
+        if self.max_entries and self._refresher is None:
+            self._refresher = threading.Thread(target=self._run, name='recommendation-refresher', daemon=True)
+            self._refresher.start()
+
+    def stop(self) -> None:
+        """Stops the background refresher."""
+        self._stopped.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
+
+    def stats(self) -> dict[str, int]:
+        """Returns the store's counters.
+
+        Returns:
+            dict[str, int]: The number of results kept, hits, misses, results refreshed, results dropped and
+            refresher errors so far.
+        """
+        return {'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshed': self.refreshed,
+                'dropped': self.dropped,
+                'errors': self.errors}
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,77 @@
 """Classes representing a general `Media` object on AniList and it's subsequent `Anime` and `Manga` subclasses."""
 
 
-from typing import Dict
+import copy
+import sys
+from typing import Dict, TypeVar
+from prep import get_genre_mask
+
+
+# Every distinct combination of genres is only stored once, and shared by all of the entries which have it.
+_genre_tuples: dict[tuple[str, ...], tuple[str, ...]] = {}
+
+MediaT = TypeVar('MediaT', bound='Media')
+
+
+def intern_genres(genres: list[str] | tuple[str, ...]) -> tuple[str, ...]:
+    """Returns a shared tuple holding the given genres.
+
+    Args:
+        genres (list[str] | tuple[str, ...]): A list of genres that fit a piece of media.
+
+    Returns:
+        tuple[str, ...]: A tuple equal to `genres`, which is the same object for every entry with the same genres.
+    """
+    key = tuple(genres)
+
+    return _genre_tuples.setdefault(key, tuple(map(sys.intern, key)))
 
 
 class Media:
-    """A class representing a base `Media` object on AniList, from which the `Anime` and `Manga` classes are derived."""
-    def __init__(self, title: Dict[str, str], user_status: str, media_status: str, score: int, genres: list[str],
-                 description: str, adult: bool, episodes: None | int, chapters: None | int,
-                 volumes: None | int) -> None:
+    """A class representing a base `Media` object on AniList, from which the `Anime` and `Manga` classes are derived.
+
+    Many of these are kept in memory at once, so the class is kept compact: it uses `__slots__` instead of a `__dict__`,
+    the title is stored as two plain strings, statuses are interned and genre tuples are shared between entries (see
+    `intern_genres`). The genres are also kept as a bitmask (see `prep.get_genre_mask`) for fast matching.
+    Descriptions are optional, and are usually only fetched for the final recommendations (see
+    `fetch.fetch_details`). Not counting its title strings, an entry without a description takes up roughly 150
+    bytes, against roughly 560 bytes for the previous `__dict__`-based class with its title dict and genre list
+    (`benchmarks/bench_media.py` measures both).
+    """
+    __slots__ = ('media_id', 'title_english', 'title_romaji', 'user_status', 'media_status', 'score', 'genres',
+                 'genre_mask', 'tags', 'description', 'adult', 'episodes', 'chapters', 'volumes')
+
+    def __init__(self, title: Dict[str, str | None], user_status: str | None, media_status: str, score: int | None,
+                 genres: list[str],
+                 description: str | None, adult: bool, episodes: None | int, chapters: None | int,
+                 volumes: None | int, media_id: None | int = None, tags: None | list[dict] = None) -> None:
         """Initialises the Media class.
 
         Args:
-            title (Dict[str, str]): The title of the media (in English and Romaji).
-            user_status (str): The status of the media on the user's list.
+            title (Dict[str, str | None]): The title of the media (in English and Romaji).
+            user_status (str | None): The status of the media on the user's list, or `None` if it isn't on it.
             media_status (str): The status of the media i.e finished, airing, etc.
-            score (int): The score of the media from 0 to 100.
+            score (int | None): The score of the media from 0 to 100, if it has one.
             genres (list[str]): A list of genres that fit the media.
-            description (str): A string describing the media.
+            description (str | None): A string describing the media, or `None` if it hasn't been fetched.
             adult (bool): A boolean showing whether the media is rated `Adult` on AniList or not.
             episodes (None | int): The number of episodes the media has (anime specific).
             chapters (None | int): The number of chapters the media has (manga specific).
             volumes (None | int): The number of  volumes the media has (manga specific).
+            media_id (None | int): The ID of the media on AniList.
+            tags (None | list[dict]): The media's tags on AniList, each with a `name` and a `rank` (its relevance,
+                from 0 to 100).
         """
         # General
-        self.title = title
-        self.user_status = user_status
-        self.media_status = media_status
+        self.media_id = media_id
+        self.title_english = title.get('english')
+        self.title_romaji = title.get('romaji')
+        self.user_status = sys.intern(user_status) if user_status is not None else None
+        self.media_status = sys.intern(media_status) if media_status is not None else None
         self.score = score
-        self.genres = genres
+        self.genres = intern_genres(genres)
+        self.genre_mask = get_genre_mask(self.genres)
+        self.tags = tuple((sys.intern(tag['name']), tag['rank']) for tag in tags) if tags else ()
         self.description = description
         self.adult = adult
 
@@ -40,6 +83,51 @@ class Media:
         self.chapters = chapters
         self.volumes = volumes
 
+    @property
+    def title(self) -> Dict[str, str | None]:
+        """The title of the media (in English and Romaji).
+
+        Returns:
+            Dict[str, str | None]: The title of the media, keyed by `english` and `romaji`. Either one can be `None`
+            if the media doesn't have a title in that language.
+        """
+        return {'english': self.title_english, 'romaji': self.title_romaji}
+
+    def with_user_status(self: MediaT, user_status: str | None) -> MediaT:
+        """Returns a copy of the media with a different status on the user's list, sharing everything else (the
+        strings, genres and tags). Media held in a `catalogue.MediaCatalogue` are shared by every user, so each user
+        gets a copy like this of the ones recommended to them.
+
+        Args:
+            user_status (str | None): The status of the media on the user's list.
+
+        Returns:
+            Media: The copy, of the same class.
+        """
+        media = copy.copy(self)
+        media.user_status = sys.intern(user_status) if user_status is not None else None
+
+        return media
+
+    def to_dict(self) -> dict:
+        """Returns the media as a dictionary which can be serialised to JSON.
+
+        Returns:
+            dict: The media's attributes, keyed by their names.
+        """
+        return {'id': self.media_id,
+                'title': self.title,
+                'user_status': self.user_status,
+                'media_status': self.media_status,
+                'score': self.score,
+                'genres': list(self.genres),
+                'tags': [{'name': name, 'rank': rank} for name, rank in self.tags],
+                'description': self.description,
+                'adult': self.adult,
+                'episodes': self.episodes,
+                'chapters': self.chapters,
+                'volumes': self.volumes}
+
     def __repr__(self) -> str:
         """Returns a string representing the `Media` object (or any subclasses).
 
@@ -56,26 +144,32 @@ class Anime(Media):
     Args:
         Media (class): A class representing a `Media` object on AniList.
     """
-    def __init__(self, title: Dict[str, str], user_status: str, media_status: str, score: int, genres: list[str],
-                 description: str, adult: bool, episodes: int, chapters=None, volumes=None) -> None:
+    __slots__ = ()
+
+    def __init__(self, title: Dict[str, str | None], user_status: str | None, media_status: str, score: int | None,
+                 genres: list[str],
+                 description: str | None, adult: bool, episodes: int | None, chapters=None, volumes=None,
+                 media_id: None | int = None, tags: None | list[dict] = None) -> None:
         """Initialisation of the `Anime` class
 
         Args:
-            title (Dict[str, str]): The title of the anime (in English and Romaji).
-            user_status (str): The status of the anime on the user's list.
+            title (Dict[str, str | None]): The title of the anime (in English and Romaji).
+            user_status (str | None): The status of the anime on the user's list, or `None` if it isn't on it.
             media_status (str): The status of the anime i.e finished, airing, etc.
-            score (int): The score of the anime from 0 to 100.
+            score (int | None): The score of the anime from 0 to 100, if it has one.
             genres (list[str]): A list of genres that fit the anime.
-            description (str): A string describing the anime.
+            description (str | None): A string describing the anime, or `None` if it hasn't been fetched.
             adult (bool): A boolean showing whether the anime is rated `Adult` on AniList or not.
-            episodes (None): The number of episodes the anime has.
+            episodes (int | None): The number of episodes the anime has, if it's known.
             chapters (int): The number of chapters the media has (manga specific). Inherited attribute, so it's
                 default value is set to `None`.
             volumes (int): The number of volumes the media has (manga specific). Inherited attribute, so it's
                 default value is set to `None`.
+            media_id (None | int): The ID of the anime on AniList.
+            tags (None | list[dict]): The anime's tags on AniList, each with a `name` and a `rank`.
         """
         super().__init__(title, user_status, media_status, score, genres, description, adult, episodes, chapters,
-                         volumes)
+                         volumes, media_id, tags)
 
 
 class Manga(Media):
@@ -84,25 +178,31 @@ class Manga(Media):
     Args:
         Media (class): A class representing a `Media` object on AniList.
     """
-    def __init__(self, title: Dict[str, str], user_status: str, media_status: str, score: int, genres: list[str],
-                 description: str, adult: bool, chapters: int, volumes: int, episodes=None,) -> None:
+    __slots__ = ()
+
+    def __init__(self, title: Dict[str, str | None], user_status: str | None, media_status: str, score: int | None,
+                 genres: list[str],
+                 description: str | None, adult: bool, chapters: int | None, volumes: int | None, episodes=None,
+                 media_id: None | int = None, tags: None | list[dict] = None) -> None:
         """Initialisation of the `Manga` class
 
         Args:
-            title (Dict[str, str]): The title of the manga (in English and Romaji).
-            user_status (str): The status of the manga on the user's list.
+            title (Dict[str, str | None]): The title of the manga (in English and Romaji).
+            user_status (str | None): The status of the manga on the user's list, or `None` if it isn't on it.
             media_status (str): The status of the manga i.e finished, airing, etc.
-            score (int): The score of the manga from 0 to 100.
+            score (int | None): The score of the manga from 0 to 100, if it has one.
             genres (list[str]): A list of genres that fit the manga.
-            description (str): A string describing the manga.
+            description (str | None): A string describing the manga, or `None` if it hasn't been fetched.
             adult (bool): A boolean showing whether the manga is rated `Adult` on AniList or not.
             episodes (None): The number of episodes the media has (anime specific). Inherited attribute, so it's
                 default value is set to `None`.
-            chapters (int): The number of chapters the manga has.
-            volumes (int): The number of volumes the manga has.
+            chapters (int | None): The number of chapters the manga has, if it's known.
+            volumes (int | None): The number of volumes the manga has, if it's known.
+            media_id (None | int): The ID of the manga on AniList.
+            tags (None | list[dict]): The manga's tags on AniList, each with a `name` and a `rank`.
         """
         super().__init__(title, user_status, media_status, score, genres, description, adult, episodes, chapters,
-                         volumes)
+                         volumes, media_id, tags)
 
 
 def main():
@@ -0,0 +1,227 @@
+"""Ranks many users' lists on several CPU cores at once, for bulk jobs where filtering and ranking the media (rather
+than fetching them) is what takes the time.
+
+The parent process only makes sure that each user's list is in the list cache (see `cache.CachedFetcher.prefetch`),
+which doesn't even decode a list that's already stored, and hands a pool of worker processes the path of the cache
+and the username. Every stored list has a snapshot (see `snapshot.py`), which the worker maps into memory and filters
+and ranks straight from its columns, only building the media that are recommended. Snapshots are read-only files, so
+workers ranking the same list share its pages through the OS page cache rather than each holding a copy, and nothing
+is decoded. Handing a user to a worker therefore costs the same however long their list is, and only the final
+recommendations are sent back. A list without a snapshot (e.g. one stored by an older version) is decoded and built
+by the worker instead.
+
+Results are always returned (and written) in the order that the users were given in, and every worker ranks with the
+same code as the single process path, so the output doesn't depend on the number of processes.
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import IO, Iterable
+import client
+from batch import get_percentile
+from cache import CachedFetcher, CacheMissError, ListCache
+from fetch import Fetcher
+from filter import build_predicates, filter_media, top_k
+from main import get_cached_fetcher
+from media import Anime, Manga
+from user import User, load_descriptions
+
+
+# The criteria that a list is ranked by: media type, genres, strict match, adult, lower bound, upper bound and count.
+Query = tuple[str, list[str] | None, bool, bool, int | None, int | None, int]
+
+# The fetchers that read lists from the cache in this process, keyed by the path of the cache, so that a worker opens
+# the cache once rather than once per user.
+_fetchers: dict[str, CachedFetcher] = {}
+
+
+def get_query(arguments: argparse.Namespace) -> Query:
+    """Returns the ranking criteria given in the command line arguments, in a form that's cheap to send to a worker.
+
+    Args:
+        arguments (argparse.Namespace): The arguments that the user entered and their values.
+
+    Returns:
+        Query: The criteria.
+    """
+    return (arguments.type.upper(), arguments.genre, arguments.strict_match, arguments.adult, arguments.lower_bound,
+            arguments.upper_bound, arguments.count)
+
+
+def rank_cached(path: str, username: str, query: Query) -> list[Anime | Manga]:
+    """Ranks a user's list from the list cache (from its snapshot if it has one) and returns its best entries for the
+    criteria given, in the same order as `filter.recommend`.
+
+    This is what the worker processes run. The list has to be in the cache already (see `stage_user`); it's read
+    however old it is, so that the worker never touches the network.
+
+    Args:
+        path (str): The path of the list cache (see `cache.ListCache`).
+        username (str): The user's AniList username.
+        query (Query): The criteria (see `get_query`).
+
+    Raises:
+        CacheMissError: if the list isn't in the cache (e.g. it was evicted in the meantime)
+
+    Returns:
+        list[Anime | Manga]: At most `count` media entries, in descending order of their scores on AniList.
+    """
+    media_type, genres, strict_match, adult, lower_bound, upper_bound, count = query
+    if path not in _fetchers:
+        # Ranking by score doesn't need any of the optional fields (see `main.get_list_fields`).
+        _fetchers[path] = CachedFetcher(Fetcher(fields=()), ListCache(path), offline=True)
+
+    if (snapshot := _fetchers[path].open_snapshot(username, media_type)) is not None:
+        with snapshot:
+            positions = snapshot.filter(genres, strict_match, adult, lower_bound, upper_bound)
+            return [snapshot.get(position) for position in snapshot.top_k(positions, count)]
+
+    user = User(username, _fetchers[path])
+    media_iterable = user.iter_anime_list() if media_type == 'ANIME' else user.iter_manga_list()
+
+    return top_k(filter_media(media_iterable, build_predicates(genres, strict_match, adult, lower_bound, upper_bound)),
+                 count)
+
+
+def get_pool(processes: int) -> ProcessPoolExecutor | None:
+    """Returns a pool of `processes` worker processes, or `None` if the ranking should stay in this process.
+
+    The workers are spawned rather than forked, since forking a process that already has threads running (like the
+    fetching threads) can deadlock.
+
+    Args:
+        processes (int): The number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor | None: The pool, or `None` for a single process.
+    """
+    if processes <= 1:
+        return None
+
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+def stage_user(arguments: argparse.Namespace, username: str, fetcher: CachedFetcher,
+               pool: ProcessPoolExecutor | None) -> Future | list[Anime | Manga] | str:
+    """Makes sure that a user's list is in the list cache and hands the user to the pool to be ranked.
+
+    Args:
+        arguments (argparse.Namespace): The arguments that the user entered and their values.
+        username (str): The user's AniList username.
+        fetcher (CachedFetcher): The fetcher shared by every user in the batch.
+        pool (ProcessPoolExecutor | None): The worker processes, or `None` to rank the list in this thread.
+
+    Returns:
+        Future | list[Anime | Manga] | str: The future of the recommendations (or the recommendations themselves
+        without a pool), or the error message if the list couldn't be fetched.
+    """
+    try:
+        fetcher.prefetch(username, arguments.type.upper())
+        if pool is None:
+            return rank_cached(fetcher.cache.path, username, get_query(arguments))
+    except (client.AniListError, CacheMissError) as error:
+        return str(error)
+    except Exception as error:
+        return f'unexpected error: {error!r}'
+
+    return pool.submit(rank_cached, fetcher.cache.path, username, get_query(arguments))
+
+
+def get_result(username: str, staged: Future | list[Anime | Manga] | str, fetcher: Fetcher) -> dict:
+    """Waits for a user's recommendations and turns them into a result, in the same form as `batch.recommend_user`.
+
+    Args:
+        username (str): The user's AniList username.
+        staged (Future | list[Anime | Manga] | str): What `stage_user` returned.
+        fetcher (Fetcher): The fetcher shared by every user in the batch, which the descriptions of the
+            recommendations are loaded through (see `user.load_descriptions`).
+
+    Returns:
+        dict: The result for the user: their username and either their `recommendations` or an `error`.
+    """
+    if isinstance(staged, str):
+        return {'username': username, 'error': staged}
+
+    try:
+        recommendations = staged.result() if isinstance(staged, Future) else staged
+        load_descriptions(recommendations, fetcher)
+    except (client.AniListError, CacheMissError) as error:
+        return {'username': username, 'error': str(error)}
+    except Exception as error:
+        # Including a worker process that died, which only loses the users it was ranking.
+        return {'username': username, 'error': f'unexpected error: {error!r}'}
+
+    return {'username': username, 'recommendations': [media.to_dict() for media in recommendations]}
+
+
+def run_parallel(arguments: argparse.Namespace, usernames: Iterable[str], output: IO[str]) -> dict:
+    """Generates recommendations for every user like `batch.run_batch`, but ranks the users' lists on
+    `arguments.processes` worker processes, and writes the results in the order of `usernames`.
+
+    Lists are fetched by `arguments.workers` threads while the workers rank the lists fetched before them, and only a
+    few more users than can be worked on at once are read ahead.
+
+    Args:
+        arguments (argparse.Namespace): The arguments that the user entered and their values.
+        usernames (Iterable[str]): The AniList usernames.
+        output (IO[str]): Where the JSON lines are written to.
+
+    Returns:
+        dict: A summary of the batch, the same as `batch.run_batch`'s.
+    """
+    fetcher = get_cached_fetcher(arguments)
+    window = (arguments.workers + arguments.processes) * 2
+    latencies: list[float] = []
+    errors = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=arguments.workers) as threads:
+        pool = get_pool(arguments.processes)
+        pending: deque[tuple[str, float, Future]] = deque()
+
+        def write() -> None:
+            nonlocal errors
+            username, started, staged = pending.popleft()
+            result = get_result(username, staged.result(), fetcher)
+            result['latency'] = time.perf_counter() - started
+            latencies.append(result['latency'])
+            errors += 'error' in result
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+
+        try:
+            for username in usernames:
+                if len(pending) >= window:
+                    write()
+                pending.append((username, time.perf_counter(),
+                                threads.submit(stage_user, arguments, username, fetcher, pool)))
+
+            while pending:
+                write()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+
+    return {'users': len(latencies),
+            'errors': errors,
+            'seconds': elapsed,
+            'users_per_second': len(latencies) / elapsed if elapsed else 0.0,
+            'latency_p50': get_percentile(latencies, 50),
+            'latency_p90': get_percentile(latencies, 90),
+            'latency_p99': get_percentile(latencies, 99),
+            **client.get_scheduler().stats()}
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
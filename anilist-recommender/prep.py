@@ -1,11 +1,53 @@
 """Handles all of the necessary preparatory work. Can be thought of as a module for general utilities as well."""
 
 
+import json
+import os
+import threading
+import time
+from typing import Iterable
 import requests
+from client import AniListError, query_url, post_query  # noqa: F401 (`query_url` is re-exported)
+
+# How long (in seconds) the on-disk copy of the genre catalogue is trusted before it is refreshed from AniList.
+genre_cache_ttl = 7 * 24 * 60 * 60
+
+# Bundled snapshot of AniList's `GenreCollection`, used when there is neither a usable on-disk copy nor a connection.
+fallback_genres = ['Action', 'Adventure', 'Comedy', 'Drama', 'Ecchi', 'Fantasy', 'Hentai', 'Horror', 'Mahou Shoujo',
+                   'Mecha', 'Music', 'Mystery', 'Psychological', 'Romance', 'Sci-Fi', 'Slice of Life', 'Sports',
+                   'Supernatural', 'Thriller']
+
+# In-memory copy of the genre catalogue, filled in on first use by `load_genres`.
+_genres: list[str] | None = None
+
+# The bit used for each (lowercase) genre in genre bitmasks. The bundled genres always take the same bits, genres
+# which aren't in the bundled snapshot are given the next free bit when they're first seen.
+genre_bits: dict[str, int] = {genre.lower(): 1 << bit for bit, genre in enumerate(fallback_genres)}
+_genre_masks: dict[tuple[str, ...], int] = {}
+_genre_bits_lock = threading.Lock()
 
 
 # General
 
+def get_cache_dir() -> str:
+    """Returns the directory used for on-disk caches, creating it if it doesn't exist yet.
+
+    The location can be overridden with the `ANILIST_RECOMMENDER_CACHE` environment variable, otherwise
+    `$XDG_CACHE_HOME/anilist-recommender` (or `~/.cache/anilist-recommender`) is used.
+
+    Returns:
+        str: The path to the cache directory.
+    """
+    cache_dir = os.environ.get('ANILIST_RECOMMENDER_CACHE')
+    if cache_dir is None:
+        xdg_cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        cache_dir = os.path.join(xdg_cache_home, 'anilist-recommender')
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    return cache_dir
+
+
 def get_anilist_genres() -> list:
     """Queries the AniList API and returns a list of all of the genres.
 
@@ -17,17 +59,95 @@ def get_anilist_genres() -> list:
             GenreCollection
         }
     '''
-    genres = requests.post(query_url, json={'query': query}).json()
-    genres = genres['data']['GenreCollection']
+    genres = post_query(query)['GenreCollection']
 
     return genres
 
 
-def get_list_lowercase(array: list[str]) -> list[str]:
+def read_genre_cache() -> tuple[list[str], float] | None:
+    """Reads the genre catalogue from the on-disk cache.
+
+    Returns:
+        tuple[list[str], float] | None: The cached genres and the time at which they were fetched, or `None` if there
+        is no readable cache.
+    """
+    try:
+        with open(os.path.join(get_cache_dir(), 'genres.json')) as cache_file:
+            cached = json.load(cache_file)
+        return cached['genres'], cached['fetched_at']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_genre_cache(genres: list[str]) -> None:
+    """Writes the genre catalogue to the on-disk cache. Failing to do so is not an error, the next run simply has to
+    fetch the genres again.
+
+    Args:
+        genres (list[str]): A list of all of the genres on AniList.
+    """
+    try:
+        path = os.path.join(get_cache_dir(), 'genres.json')
+        with open(path + '.tmp', 'w') as cache_file:
+            json.dump({'fetched_at': time.time(), 'genres': genres}, cache_file)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass
+
+
+def load_genres(refresh: bool = False, offline: bool = False) -> list[str]:
+    """Returns the AniList genre catalogue, loading it on first use instead of at import time.
+
+    The genres are looked up in order of: the in-memory copy, the on-disk cache (if it is younger than
+    `genre_cache_ttl`), the AniList API, and finally a stale on-disk copy or the bundled `fallback_genres`. This means
+    that at most one request is made per `genre_cache_ttl`, and that no request is made at all when offline.
+
+    Args:
+        refresh (bool): Whether to ignore the in-memory copy and the on-disk cache and ask AniList again.
+        offline (bool): Whether to skip the AniList API, using a stale on-disk copy or the bundled genres instead.
+
+    Returns:
+        list[str]: A list of all of the genres on AniList.
+    """
+    global _genres
+
+    if _genres is not None and not refresh:
+        return _genres
+
+    cached = read_genre_cache()
+    if cached is not None and not refresh and time.time() - cached[1] < genre_cache_ttl:
+        _genres = cached[0]
+        return _genres
+
+    if offline:
+        return cached[0] if cached is not None else list(fallback_genres)
+
+    try:
+        _genres = get_anilist_genres()
+        write_genre_cache(_genres)
+    except (AniListError, requests.RequestException, ValueError, KeyError, TypeError):
+        _genres = cached[0] if cached is not None else list(fallback_genres)
+
+    return _genres
+
+
+def get_genres_lowercase(offline: bool = False) -> list[str]:
+    """Returns the AniList genre catalogue with every genre being lowercase.
+
+    Args:
+        offline (bool): Whether to skip the AniList API (see `load_genres`).
+
+    Returns:
+        list[str]: A list of all of the genres on AniList, in lowercase.
+    """
+    return get_list_lowercase(load_genres(offline=offline))
+
+
+def get_list_lowercase(array: Iterable[str]) -> list[str]:
     """Takes in a list of strings and returns that same list, with every string being lowercase.
 
     Args:
-        array (list[str]): The list of strings.
+        array (Iterable[str]): The list of strings (or any other iterable of them, e.g. a tuple).
 
     Returns:
         list[str]: The same list of strings, but with every string being lowercase.
@@ -36,8 +156,59 @@ def get_list_lowercase(array: list[str]) -> list[str]:
     return list(map(str.lower, array))
 
 
-query_url = 'https://graphql.anilist.co'
-anilist_genres = get_anilist_genres()
+def get_genre_mask(genres: list[str] | tuple[str, ...]) -> int:
+    """Encodes a collection of genres as an integer bitmask, with one bit per genre (see `genre_bits`).
+
+    Genres are compared case-insensitively, so `['Slice of Life']` and `['slice of life']` give the same mask.
+
+    Args:
+        genres (list[str] | tuple[str, ...]): A collection of genres.
+
+    Returns:
+        int: The bitmask of the genres.
+    """
+    key = tuple(genres)
+    if (mask := _genre_masks.get(key)) is not None:
+        return mask
+
+    mask = 0
+    with _genre_bits_lock:
+        for genre in get_list_lowercase(key):
+            if genre not in genre_bits:
+                genre_bits[genre] = 1 << len(genre_bits)
+            mask |= genre_bits[genre]
+        _genre_masks[key] = mask
+
+    return mask
+
+
+def get_genres_from_mask(mask: int) -> list[str]:
+    """Decodes a genre bitmask (see `get_genre_mask`) back into a list of lowercase genres.
+
+    Args:
+        mask (int): The bitmask of a collection of genres.
+
+    Returns:
+        list[str]: The lowercase genres, in the order of their bits.
+    """
+    return [genre for genre, bit in genre_bits.items() if mask & bit]
+
+
+def __getattr__(name: str) -> list[str]:
+    """Keeps `prep.anilist_genres` working, but only loads the genres when the attribute is first accessed.
+
+    Args:
+        name (str): The name of the module attribute being accessed.
+
+    Raises:
+        AttributeError: if `name` is not a lazily loaded attribute of this module.
+
+    Returns:
+        list[str]: A list of all of the genres on AniList.
+    """
+    if name == 'anilist_genres':
+        return load_genres()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def main():
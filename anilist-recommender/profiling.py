@@ -0,0 +1,312 @@
+"""Built-in timing spans and counters for the stages of a run (requests, decoding, building media, filtering, ranking,
+...), so that a slow run can be broken down without an external profiler.
+
+Profiling is off by default, and costs next to nothing while it is: `span` hands back a shared do-nothing context
+manager, `count` returns straight away, and the per-entry stages (see `timed` and `filter.filter_media`) pick their
+uninstrumented code path once per list rather than checking for every entry. It's turned on with `enable` (e.g. by
+`--profile`).
+
+Spans measure exclusive time: time spent in a span that was entered inside another one (e.g. a request made while a
+list is being ranked, since lists are streamed into the ranking) is taken off the outer span, so the stages add up to
+the time that was measured, without being counted twice. Spans are tracked per thread, and the totals are shared by
+every thread, so when several threads are working at once (batch mode, the server) the stages add up to more than the
+elapsed time, and include the time a thread spent waiting for the others to let go of the GIL.
+
+`capture` wraps a run in cProfile and/or tracemalloc, for when the stage breakdown isn't detailed enough. Those are
+only imported when they're used, so that importing this module (which every other one does) stays cheap.
+"""
+
+
+import contextlib
+import io
+import json
+import sys
+import threading
+import time
+from typing import Callable, IO, Iterator
+
+
+enabled = False
+
+# The totals: counter values by name, and [calls, exclusive seconds] by span name.
+counters: dict[str, int] = {}
+spans: dict[str, list] = {}
+
+_lock = threading.Lock()
+_local = threading.local()
+
+# The prefix of the metric names in the Prometheus text format.
+metric_prefix = 'anilist_recommender'
+
+
+def enable(on: bool = True) -> None:
+    """Turns profiling on (or off).
+
+    Args:
+        on (bool): Whether spans and counters should be recorded.
+    """
+    global enabled
+    enabled = on
+
+
+def reset() -> None:
+    """Clears every counter and span."""
+    with _lock:
+        counters.clear()
+        spans.clear()
+
+
+def count(name: str, value: int = 1) -> None:
+    """Adds to a counter, if profiling is enabled.
+
+    Args:
+        name (str): The name of the counter.
+        value (int): The amount to add.
+    """
+    if not enabled:
+        return
+
+    with _lock:
+        counters[name] = counters.get(name, 0) + value
+
+
+class Span:
+    """A timed stage, used as a context manager (see `span`).
+
+    Attributes:
+        name (str): The name of the stage.
+        start (float): When the span was entered, from `time.perf_counter`.
+        inner (float): The time spent in spans entered inside this one, in seconds.
+    """
+    __slots__ = ('name', 'start', 'inner')
+
+    def __init__(self, name: str) -> None:
+        """Initialises the `Span` class.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        self.name = name
+        self.start = 0.0
+        self.inner = 0.0
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `Span` class.
+
+        Returns:
+            str: A string representation of the `Span` class and it's initialisation arguments.
+        """
+        return f'Span({self.name!r})'
+
+    def __enter__(self) -> 'Span':
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].inner += elapsed
+
+        with _lock:
+            totals = spans.setdefault(self.name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed - self.inner
+
+
+_null_span = contextlib.nullcontext()
+
+
+def span(name: str) -> Span | contextlib.nullcontext:
+    """Returns a context manager which times the code inside it as the stage `name`, if profiling is enabled.
+
+    Args:
+        name (str): The name of the stage.
+
+    Returns:
+        Span | contextlib.nullcontext: The span, or a shared context manager which does nothing.
+    """
+    return Span(name) if enabled else _null_span
+
+
+def timed(name: str, function: Callable, counter: str | None = None) -> Callable:
+    """Returns a version of `function` which times every call as the stage `name` (and adds 1 to `counter`), if
+    profiling is enabled. Meant to be called once before a loop, so that the loop itself doesn't have to check.
+
+    Args:
+        name (str): The name of the stage.
+        function (Callable): The function being timed.
+        counter (str | None): A counter to add 1 to for every call.
+
+    Returns:
+        Callable: The timed function, or `function` itself if profiling is disabled.
+    """
+    if not enabled:
+        return function
+
+    def timed_function(*function_args, **function_kwargs):
+        with Span(name):
+            result = function(*function_args, **function_kwargs)
+        if counter is not None:
+            count(counter)
+        return result
+
+    return timed_function
+
+
+def get_metrics() -> dict:
+    """Returns every counter and span recorded so far.
+
+    Returns:
+        dict: The `counters` by name, and the `spans` by name, each with its number of `calls` and its exclusive
+        `seconds`.
+    """
+    with _lock:
+        return {'counters': dict(counters),
+                'spans': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in spans.items()}}
+
+
+def format_breakdown(metrics: dict) -> str:
+    """Returns a human readable breakdown of the metrics (see `get_metrics`): the time spent in each stage, slowest
+    first, followed by the counters.
+
+    Args:
+        metrics (dict): The metrics.
+
+    Returns:
+        str: The breakdown, on several lines.
+    """
+    total = sum(stage['seconds'] for stage in metrics['spans'].values())
+    lines = [f'{"stage":<14}{"calls":>10}{"seconds":>12}{"share":>9}']
+
+    for name, stage in sorted(metrics['spans'].items(), key=lambda item: -item[1]['seconds']):
+        share = stage['seconds'] / total if total else 0.0
+        lines.append(f'{name:<14}{stage["calls"]:>10,}{stage["seconds"]:>12.4f}{share:>9.1%}')
+    lines.append(f'{"total":<14}{"":>10}{total:>12.4f}')
+
+    if metrics['counters']:
+        lines.append('')
+        lines.extend(f'{name:<32}{value:>12,}' for name, value in sorted(metrics['counters'].items()))
+
+    return '\n'.join(lines)
+
+
+def format_prometheus(metrics: dict) -> str:
+    """Returns the metrics (see `get_metrics`) in the Prometheus text exposition format.
+
+    Args:
+        metrics (dict): The metrics.
+
+    Returns:
+        str: The metrics, one sample per line.
+    """
+    lines = [f'# TYPE {metric_prefix}_stage_seconds_total counter']
+    lines.extend(f'{metric_prefix}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}'
+                 for name, stage in sorted(metrics['spans'].items()))
+    lines.append(f'# TYPE {metric_prefix}_stage_calls_total counter')
+    lines.extend(f'{metric_prefix}_stage_calls_total{{stage="{name}"}} {stage["calls"]}'
+                 for name, stage in sorted(metrics['spans'].items()))
+
+    for name, value in sorted(metrics['counters'].items()):
+        lines.append(f'# TYPE {metric_prefix}_{name}_total counter')
+        lines.append(f'{metric_prefix}_{name}_total {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path: str) -> None:
+    """Writes the metrics to a file: in the Prometheus text format if the file name ends in `.prom`, as JSON otherwise.
+
+    Args:
+        path (str): The path of the file.
+    """
+    metrics = get_metrics()
+
+    with open(path, 'w') as file:
+        if path.endswith('.prom'):
+            file.write(format_prometheus(metrics))
+        else:
+            json.dump(metrics, file, indent=2)
+            file.write('\n')
+
+
+@contextlib.contextmanager
+def capture(kinds: list[str] | None, output: IO[str] = sys.stderr, limit: int = 25) -> Iterator[None]:
+    """Runs the code inside it under cProfile (`cpu`) and/or tracemalloc (`memory`), then writes the slowest functions
+    and the biggest allocations to `output`. Every thread's functions are reported together.
+
+    From Python 3.12 cProfile sees every thread at once, so the threads which were already running (e.g. a pool created
+    beforehand) are profiled as well as the ones started inside. Before 3.12 a profiler only sees the thread that
+    enabled it, so each thread started inside (e.g. the workers of a batch) is given one of its own as it starts, and
+    threads which were already running aren't profiled. Those profilers can only be turned off by their own thread,
+    so a thread which is still running when the capture ends (rather than having been joined inside it) goes on being
+    profiled until it finishes, although only what it did up to the end of the capture is reported.
+
+    Args:
+        kinds (list[str] | None): What to capture, `cpu` and/or `memory`. Nothing is captured if it's empty.
+        output (IO[str]): Where the reports are written to.
+        limit (int): The number of functions (and lines that allocated memory) reported.
+
+    Yields:
+        None: Once the capture has started.
+    """
+    kinds = kinds or []
+    profilers = []
+    per_thread = sys.version_info < (3, 12)
+
+    if 'cpu' in kinds:
+        import cProfile
+        import pstats
+    if 'memory' in kinds:
+        import tracemalloc
+
+    def profile_thread(*_) -> None:
+        # Called on the first event of every thread started from now on: swaps itself for a profiler of its own.
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with _lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    if 'memory' in kinds:
+        tracemalloc.start()
+    if 'cpu' in kinds:
+        if per_thread:
+            threading.setprofile(profile_thread)
+        profile_thread()
+
+    try:
+        yield
+    finally:
+        if 'cpu' in kinds:
+            if per_thread:
+                threading.setprofile(None)
+            # Only the calling thread's profiler (the only one from Python 3.12) can be turned off from here.
+            profilers[0].disable()
+            report = io.StringIO()
+            with _lock:
+                pstats.Stats(*profilers, stream=report).sort_stats('cumulative').print_stats(limit)
+            print(report.getvalue(), file=output)
+
+        if 'memory' in kinds:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'memory: {current / 2 ** 20:.1f} MiB allocated at the end, {peak / 2 ** 20:.1f} MiB at the peak',
+                  file=output)
+            for statistic in snapshot.statistics('lineno')[:limit]:
+                print(f'  {statistic}', file=output)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
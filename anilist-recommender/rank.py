@@ -0,0 +1,205 @@
+"""Content-based ranking: scores the entries on a user's list by how similar they are to what the user has already
+finished and liked, instead of by their AniList score alone.
+
+A piece of media is described by a sparse feature vector over its genres (weight 1 each, taken from its genre bitmask)
+and tags (weighted by their relevance rank). The user's taste vector is the sum of the feature vectors of their
+'Completed' entries, each weighted by the score the user gave it. Candidates are then ranked by a blend of their cosine
+similarity to the taste vector and their AniList score.
+
+The vectors are kept as coordinate (row, column, value) arrays, so that every step is a handful of vectorised NumPy
+operations over all of the candidates at once, however many there are. NumPy is an optional dependency, only needed
+for this ranking (`pip install .[similarity]`).
+"""
+
+
+import threading
+from filter import score_key
+from media import Anime, Manga
+import prep
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore[assignment]
+
+
+# How much the similarity to the user's taste counts for, against the AniList score, by default.
+default_similarity_weight = 0.7
+
+
+def require_numpy(feature: str = 'similarity ranking') -> None:
+    """Makes sure that NumPy is available.
+
+    Args:
+        feature (str): What NumPy is needed for, for the error message.
+
+    Raises:
+        ImportError: if NumPy isn't installed
+    """
+    if np is None:
+        raise ImportError(f'{feature} needs NumPy, install it with `pip install .[similarity]`')
+
+
+# The column of each tag in the feature vectors (see `get_tag_column`).
+tag_columns: dict[str, int] = {}
+_tag_columns_lock = threading.Lock()
+
+
+def get_tag_column(name: str) -> int:
+    """Returns the column of a tag in the feature vectors, giving it the next free column if it's new.
+
+    Genres take the first columns (one per bit of `prep.genre_bits`) and tags come after them, in the order that they
+    were first seen.
+
+    Args:
+        name (str): The name of the tag.
+
+    Returns:
+        int: The tag's column, counted from the first tag column.
+    """
+    column = tag_columns.get(name)
+    if column is not None:
+        return column
+
+    # Batch and server rank lists on several threads, which mustn't give two new tags the same column.
+    with _tag_columns_lock:
+        return tag_columns.setdefault(name, len(tag_columns))
+
+
+def build_coordinates(genre_masks: list[int],
+                      tag_lists: list[tuple[tuple[str, int], ...]]) -> tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+    """Turns the genres and tags of many pieces of media into a sparse feature matrix, in coordinate form.
+
+    Genres are read straight from the genre bitmasks with vectorised bit operations, and tags are looked up in one
+    flat pass, so there's no per-feature work in Python beyond a dictionary lookup per tag.
+
+    Args:
+        genre_masks (list[int]): The genre bitmask of each piece of media (see `prep.get_genre_mask`).
+        tag_lists (list[tuple[tuple[str, int], ...]]): The tags of each piece of media, as (name, rank) pairs.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The row (media), column (feature) and value of every non-zero
+        entry of the matrix. Genres have a value of 1, tags their rank divided by 100.
+    """
+    genre_count = len(prep.genre_bits)
+
+    if genre_count <= 63:
+        masks = np.array(genre_masks, dtype=np.int64)
+        genre_rows, genre_columns = np.nonzero((masks[:, None] >> np.arange(genre_count)) & 1)
+    else:
+        genre_rows, genre_columns = np.nonzero([[mask >> bit & 1 for bit in range(genre_count)]
+                                                for mask in genre_masks])
+
+    tag_rows = np.repeat(np.arange(len(tag_lists)), [len(tags) for tags in tag_lists])
+    flat_tags = [tag for tags in tag_lists for tag in tags]
+    tag_columns_ = np.array([get_tag_column(name) for name, _ in flat_tags], dtype=np.int64) + genre_count
+    tag_values = np.array([rank for _, rank in flat_tags], dtype=np.float64) / 100
+
+    return (np.concatenate([genre_rows, tag_rows]).astype(np.int64),
+            np.concatenate([genre_columns, tag_columns_]).astype(np.int64),
+            np.concatenate([np.ones(len(genre_rows)), tag_values]))
+
+
+def get_feature_count() -> int:
+    """Returns the number of features (columns) known so far.
+
+    Returns:
+        int: The number of genres plus the number of tags.
+    """
+    return len(prep.genre_bits) + len(tag_columns)
+
+
+def build_taste_vector(completed_entries: list[dict]) -> 'np.ndarray':
+    """Builds the user's taste vector from their 'Completed' entries (see `user.User.get_completed_entries`).
+
+    Each entry counts in proportion to the score the user gave it. Entries that the user didn't score count as much as
+    the user's average score.
+
+    Args:
+        completed_entries (list[dict]): The user's completed entries, with their scores.
+
+    Returns:
+        np.ndarray: The taste vector, with one value per feature.
+    """
+    rows, columns, values = build_coordinates(
+        [prep.get_genre_mask(entry['media']['genres']) for entry in completed_entries],
+        [tuple((tag['name'], tag['rank']) for tag in entry['media'].get('tags') or []) for entry in completed_entries])
+
+    scores = np.array([entry.get('score') or 0 for entry in completed_entries], dtype=np.float64)
+    if scores.any():
+        scores[scores == 0] = scores[scores > 0].mean()
+    else:
+        scores[:] = 1
+
+    return np.bincount(columns, weights=values * scores[rows] / 100, minlength=get_feature_count())
+
+
+def get_similarities(candidates: list[Anime | Manga], taste: 'np.ndarray') -> 'np.ndarray':
+    """Returns the cosine similarity of every candidate to the user's taste vector.
+
+    Args:
+        candidates (list[Anime | Manga]): The media entries being ranked.
+        taste (np.ndarray): The user's taste vector (see `build_taste_vector`).
+
+    Returns:
+        np.ndarray: The similarity of each candidate, from 0 to 1 (0 for candidates without any features).
+    """
+    rows, columns, values = build_coordinates([media.genre_mask for media in candidates],
+                                              [media.tags for media in candidates])
+
+    # Features that only candidates have can't match the taste vector, but do count towards the candidates' norms.
+    taste = np.concatenate([taste, np.zeros(get_feature_count() - len(taste))])
+
+    dots = np.bincount(rows, weights=values * taste[columns], minlength=len(candidates))
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(candidates))) * np.linalg.norm(taste)
+
+    return np.divide(dots, norms, out=np.zeros(len(candidates)), where=norms > 0)
+
+
+def rank_similarity(candidates: list[Anime | Manga], completed_entries: list[dict], count: int,
+                    similarity_weight: float = default_similarity_weight) -> list[Anime | Manga]:
+    """Returns the `count` candidates that best fit the user's taste, blended with their AniList score.
+
+    Each candidate is given `similarity_weight * similarity + (1 - similarity_weight) * score / 100`, where unscored
+    media count as having a score of 0. Ties are broken in favour of the candidate that comes first. If the user has
+    no completed entries, this ranks by AniList score alone.
+
+    Args:
+        candidates (list[Anime | Manga]): The media entries being ranked (usually already filtered).
+        completed_entries (list[dict]): The user's completed entries, with their scores.
+        count (int): The number of entries to return.
+        similarity_weight (float): How much the similarity counts for, from 0 to 1.
+
+    Returns:
+        list[Anime | Manga]: At most `count` media entries, best first.
+    """
+    require_numpy()
+
+    if not candidates or count <= 0:
+        return []
+
+    taste = build_taste_vector(completed_entries)
+    similarities = get_similarities(candidates, taste)
+    scores = np.array([max(score_key(media), 0) for media in candidates], dtype=np.float64) / 100
+
+    blended = similarity_weight * similarities + (1 - similarity_weight) * scores
+
+    # `argpartition` finds the best `count` without sorting everything, then only those are sorted. The stable sort
+    # on the negated values keeps ties in their original order.
+    if count < len(candidates):
+        best = np.argpartition(-blended, count - 1)[:count]
+        threshold = blended[best].min()
+        best = np.flatnonzero(blended >= threshold)
+    else:
+        best = np.arange(len(candidates))
+    best = best[np.argsort(-blended[best], kind='stable')][:count]
+
+    return [candidates[position] for position in best]
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
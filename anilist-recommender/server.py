@@ -0,0 +1,397 @@
+"""A long-running HTTP server which answers recommendation requests as JSON, keeping its state warm between requests.
+
+The genre catalogue and recently used user lists are kept in memory, so a request for a user that has been seen
+recently doesn't touch the network (or the disk cache) at all. Concurrent requests for the same user's list share a
+single download. Lists are held as arrays of media IDs and statuses, with the media themselves in a media catalogue
+shared by every user (see `catalogue.py`), so memory grows with the number of distinct titles rather than with the
+number of users. A list that's in the disk cache is read from its snapshot (see `snapshot.py`), so only the media that
+the catalogue doesn't hold yet are built. Answers are precomputed and kept per user and combination of options, and
+only recomputed once the list or the media on it change (see `materialize.py`).
+
+Usage: `GET /recommendations?username=...&type=anime&count=5&genre=drama&genre=comedy&strict_match=true
+&lower_bound=10&upper_bound=30&adult=false`. The parameters mirror the command line arguments of `main.py`.
+
+With `--profile`, `GET /metrics` serves the time spent in each stage and the counters (see `profiling.py`) in the
+Prometheus text format, or as JSON with `?format=json`.
+"""
+
+
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import args
+import prep
+import profiling
+from cache import CacheMissError
+from catalogue import MediaCatalogue, UserList, get_catalogue, load_snapshot_list, load_user_list
+from client import AniListError
+from fetch import Fetcher
+from main import get_cached_fetcher, get_media_max_age
+from materialize import RecommendationStore
+from user import User
+
+
+class Flight:
+    """A fetch of a user's list that is in progress, which other requests for the same list can wait on.
+
+    Attributes:
+        leader (int): The ID of the thread doing the fetch.
+        done (threading.Event): Set once the fetch has finished, successfully or not.
+        result (UserList | None): The fetched list.
+        error (Exception | None): The error the fetch failed with.
+    """
+    __slots__ = ('leader', 'done', 'result', 'error')
+
+    def __init__(self) -> None:
+        """Initialises the `Flight` class, led by the current thread."""
+        self.leader = threading.get_ident()
+        self.done = threading.Event()
+        self.result: UserList | None = None
+        self.error: Exception | None = None
+
+
+class MediaListStore:
+    """An in-memory, size-bounded store of users' media lists (as `UserList`s, with their media in a catalogue), in
+    front of a fetcher.
+
+    The least recently used lists are evicted once more than `max_users` lists are held, and lists older than `ttl`
+    seconds are fetched again. When several threads ask for a list that isn't held, only the first one fetches it and
+    the others wait for its result. If a list fetched again turns out not to have changed, the list held until then is
+    kept (and is fresh again), so anything computed from it stays valid (see `materialize.py`).
+
+    Attributes:
+        fetcher (Fetcher): The fetcher used to download lists that aren't held.
+        max_users (int): The maximum number of lists held.
+        ttl (float): The number of seconds for which a held list is used.
+        catalogue (MediaCatalogue): The catalogue holding the media on the lists.
+        hits (int): The number of lists that were served from memory.
+        misses (int): The number of lists that had to be fetched.
+        coalesced (int): The number of requests that waited on another request's fetch instead of fetching.
+    """
+    def __init__(self, fetcher: Fetcher, max_users: int = 1024, ttl: float = 300,
+                 catalogue: MediaCatalogue | None = None) -> None:
+        """Initialises the `MediaListStore` class.
+
+        Args:
+            fetcher (Fetcher): The fetcher used to download lists that aren't held.
+            max_users (int): The maximum number of lists held.
+            ttl (float): The number of seconds for which a held list is used.
+            catalogue (MediaCatalogue | None): The catalogue holding the media on the lists. Defaults to the
+                process-wide one.
+        """
+        self.fetcher = fetcher
+        self.max_users = max_users
+        self.ttl = ttl
+        self.catalogue = catalogue if catalogue is not None else get_catalogue()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._lists: OrderedDict[tuple[str, str], tuple[float, UserList]] = OrderedDict()
+        self._in_flight: dict[tuple[str, str], Flight] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `MediaListStore` class.
+
+        Returns:
+            str: A string representation of the `MediaListStore` class and it's initialisation arguments.
+        """
+        return f'MediaListStore({self.fetcher!r}, {self.max_users}, {self.ttl}, {self.catalogue!r})'
+
+    def peek(self, username: str, media_type: str, max_age: float | None = None) -> UserList | None:
+        """Returns a user's media list if it's held and fresh, without fetching it or counting a hit.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'anime' or 'manga'.
+            max_age (float | None): The age (in seconds) up to which the list is fresh. Defaults to `ttl`.
+
+        Returns:
+            UserList | None: The user's list, or `None` if it isn't held or is too old.
+        """
+        held = self._lists.get((username.lower(), media_type))
+        if held is None or time.monotonic() - held[0] >= (max_age if max_age is not None else self.ttl):
+            return None
+
+        return held[1]
+
+    def get(self, username: str, media_type: str, max_age: float | None = None) -> UserList:
+        """Returns a user's media list, from memory if possible.
+
+        Args:
+            username (str): The user's AniList username.
+            media_type (str): The type of media, either 'anime' or 'manga'.
+            max_age (float | None): The age (in seconds) up to which a held list is used. Defaults to `ttl`.
+
+        Raises:
+            AniListError: if the list had to be fetched and fetching it failed
+            CacheMissError: if the list had to be fetched and the fetcher is offline
+
+        Returns:
+            UserList: The user's 'Planning' and 'Paused' entries.
+        """
+        key = (username.lower(), media_type)
+
+        with self._lock:
+            held = self._lists.get(key)
+            if held is not None and time.monotonic() - held[0] < (max_age if max_age is not None else self.ttl):
+                self._lists.move_to_end(key)
+                self.hits += 1
+                return held[1]
+
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+            else:
+                flight = self._in_flight[key] = Flight()
+                self.misses += 1
+
+        if flight.leader != threading.get_ident():
+            # Somebody else is already fetching this list, so its result (or error) is used instead.
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            assert flight.result is not None
+            return flight.result
+
+        try:
+            fetched_at = self.fetcher.get_fetched_at(username, media_type.upper())
+            if (snapshot := self.fetcher.open_snapshot(username, media_type.upper())) is not None:
+                with snapshot:
+                    flight.result = load_snapshot_list(snapshot, self.catalogue, fetched_at)
+            else:
+                flight.result = load_user_list(User(username, self.fetcher).iter_entries(media_type.upper()),
+                                               media_type.upper(), self.catalogue, fetched_at)
+        except Exception as error:
+            flight.error = error
+            raise
+        else:
+            with self._lock:
+                held = self._lists.get(key)
+                if held is not None and held[1].media_ids == flight.result.media_ids \
+                        and held[1].statuses == flight.result.statuses:
+                    flight.result = held[1]
+                self._lists[key] = (time.monotonic(), flight.result)
+                self._lists.move_to_end(key)
+                while len(self._lists) > self.max_users:
+                    self._lists.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.done.set()
+
+        return flight.result
+
+    def stats(self) -> dict[str, int]:
+        """Returns the store's counters.
+
+        Returns:
+            dict[str, int]: The number of lists held, hits, misses and coalesced requests so far, and the number of
+            distinct media held in the catalogue.
+        """
+        return {'users': len(self._lists),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'media': len(self.catalogue)}
+
+
+def parse_bool(value: str) -> bool:
+    """Parses a boolean query parameter.
+
+    Args:
+        value (str): The value of the parameter.
+
+    Raises:
+        ValueError: if `value` isn't a recognised boolean
+
+    Returns:
+        bool: The value as a boolean.
+    """
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError(f'\'{value}\' is not a valid boolean')
+
+
+def parse_query(query: str) -> argparse.Namespace:
+    """Turns the query string of a request into the same arguments that `args.add_args` would produce, and checks them
+    with `args.check_args`.
+
+    Args:
+        query (str): The query string of the request.
+
+    Raises:
+        ValueError: if a parameter is missing or invalid
+
+    Returns:
+        argparse.Namespace: The arguments of the request.
+    """
+    parameters = parse_qs(query, keep_blank_values=True)
+
+    def get(name: str, default: str = '') -> str:
+        return parameters[name][-1] if name in parameters else default
+
+    username = get('username')
+    if not username:
+        raise ValueError('`username` is required')
+
+    media_type = get('type', 'anime')
+    if media_type not in ('anime', 'manga'):
+        raise ValueError('`type` must be either \'anime\' or \'manga\'')
+
+    # Genres can be given as repeated parameters and/or comma separated.
+    genres = [genre.strip().lower() for value in parameters.get('genre', []) for genre in value.split(',')]
+
+    arguments = argparse.Namespace(username=username,
+                                   type=media_type,
+                                   count=int(get('count', '5')),
+                                   genre=[genre for genre in genres if genre] or None,
+                                   strict_match=parse_bool(get('strict_match', 'false')),
+                                   lower_bound=int(value) if (value := get('lower_bound')) else None,
+                                   upper_bound=int(value) if (value := get('upper_bound')) else None,
+                                   adult=parse_bool(get('adult', 'false')))
+    args.check_args(arguments)
+
+    return arguments
+
+
+class RecommendationHandler(BaseHTTPRequestHandler):
+    """Handles the requests made to the recommendation server."""
+    store: MediaListStore
+    recommendations: RecommendationStore
+
+    def send_json(self, status: int, body: dict) -> None:
+        """Sends a JSON response.
+
+        Args:
+            status (int): The HTTP status code.
+            body (dict): The body of the response.
+        """
+        payload = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_metrics(self, query: str) -> None:
+        """Sends the profiling metrics, as Prometheus text or (with `format=json`) as JSON.
+
+        Args:
+            query (str): The query string of the request.
+        """
+        metrics = profiling.get_metrics()
+        if parse_qs(query).get('format', ['prometheus'])[-1] == 'json':
+            self.send_json(200, metrics)
+            return
+
+        payload = profiling.format_prometheus(metrics).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        """Answers `GET /recommendations`, `GET /stats`, `GET /metrics` and `GET /health`."""
+        url = urlsplit(self.path)
+
+        if url.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif url.path == '/stats':
+            self.send_json(200, {**self.store.stats(), 'recommendations': self.recommendations.stats()})
+        elif url.path == '/metrics':
+            self.send_metrics(url.query)
+        elif url.path == '/recommendations':
+            try:
+                arguments = parse_query(url.query)
+            except ValueError as error:
+                self.send_json(400, {'error': str(error)})
+                return
+
+            try:
+                recommendations = self.recommendations.get(arguments)
+            except CacheMissError as error:
+                self.send_json(404, {'error': str(error)})
+                return
+            except AniListError as error:
+                # AniList answers 404 for users that don't exist, anything else is a failure on its side.
+                self.send_json(404 if error.status == 404 else 502, {'error': str(error)})
+                return
+            except Exception as error:
+                self.send_json(500, {'error': f'internal error: {error}'})
+                return
+
+            self.send_json(200, {'username': arguments.username,
+                                 'type': arguments.type,
+                                 'recommendations': recommendations})
+        else:
+            self.send_json(404, {'error': f'no such endpoint \'{url.path}\''})
+
+    def log_message(self, format: str, *log_args) -> None:
+        """Silences the per-request logging of `BaseHTTPRequestHandler`, which would dominate the cost of warm
+        requests."""
+
+
+def make_server(host: str, port: int, store: MediaListStore,
+                recommendations: RecommendationStore | None = None) -> ThreadingHTTPServer:
+    """Returns a recommendation server (which isn't running yet) that serves lists from `store`.
+
+    Args:
+        host (str): The address the server listens on.
+        port (int): The port the server listens on.
+        store (MediaListStore): The store of users' media lists.
+        recommendations (RecommendationStore | None): The store of precomputed recommendations. Defaults to one in
+            front of `store`, without a background refresher.
+
+    Returns:
+        ThreadingHTTPServer: The server.
+    """
+    if recommendations is None:
+        recommendations = RecommendationStore(store)
+
+    handler = type('BoundRecommendationHandler', (RecommendationHandler,),
+                   {'store': store, 'recommendations': recommendations})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    return server
+
+
+def main():
+    arguments = args.add_server_args()
+    arguments.refresh = arguments.offline = False
+    profiling.enable(arguments.profile)
+
+    # Loaded up front so that no request has to wait for it.
+    prep.load_genres()
+
+    # Lists are held for up to `list_ttl` seconds on top of how old their media can be when they're fetched.
+    catalogue = MediaCatalogue(get_media_max_age(arguments) + arguments.list_ttl, arguments.max_media)
+    store = MediaListStore(get_cached_fetcher(arguments), arguments.max_users, arguments.list_ttl, catalogue)
+    recommendations = RecommendationStore(store, arguments.max_materialized,
+                                          refresh_interval=arguments.refresh_interval)
+    server = make_server(arguments.host, arguments.port, store, recommendations)
+    print(f'Serving recommendations on http://{arguments.host}:{server.server_address[1]}')
+
+    recommendations.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recommendations.stop()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
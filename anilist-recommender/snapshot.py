@@ -0,0 +1,523 @@
+"""A columnar, memory-mapped snapshot format for media lists, so that a large list can be loaded, filtered and ranked
+without rebuilding an `Anime`/`Manga` object (or even parsing JSON) for every entry.
+
+A snapshot is a single file: a short header followed by one fixed-width column per numeric attribute (ID, score,
+length, episodes, chapters, volumes, adult flag, statuses and genre bitmask) and, for every string attribute (the two
+titles, the description and the tags), an array of offsets into a blob of UTF-8 text. Opening a snapshot (`Snapshot`)
+only reads the header and maps the file into memory, so it takes the same time however many entries there are, and
+processes that open the same snapshot share its pages through the OS page cache instead of each holding a copy.
+
+`Snapshot.filter` and `Snapshot.top_k` work straight on the columns, with the same semantics as
+`filter.build_predicates` and `filter.top_k`, and only the entries that are finally recommended are turned back into
+`Anime`/`Manga` objects (`Snapshot.get`). The columns are read through NumPy when it's installed and through plain
+memoryviews otherwise.
+
+The list cache writes a snapshot of every list it stores (see `cache.ListCache.open_snapshot`), and lists that are
+served from the cache as they are get ranked from their snapshots: by `main.get_recommendations` (and so in batch
+mode), by the worker processes of `parallel.py`, and by the server, which only builds the media its catalogue doesn't
+already hold (see `catalogue.load_snapshot_list`).
+
+File layout (all integers in the byte order of the machine that wrote the snapshot, which is recorded in the header):
+
+    magic (8 bytes) | header length (4 bytes) | JSON header | padding | column | padding | column | ...
+
+The header gives the number of entries, the media type, the stamp the snapshot was written with (if any), the genre
+of every bit of the genre bitmasks, the statuses and genre combinations that the status and genre columns index into,
+and the type code, offset and length of every column. Columns start on 8-byte boundaries.
+"""
+
+
+import argparse
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from typing import Iterable, Union
+import prep
+from filter import get_length
+from media import Anime, Manga
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore[assignment]
+
+
+magic = b'ALSNAP1\n'
+
+# The fixed-width columns and their `array` type codes. Scores and lengths that aren't known are stored as -1, and
+# statuses and genres (which are shared between entries, see `media.intern_genres`) as indices into lists in the
+# header.
+numeric_columns = {'media_id': 'q', 'score': 'h', 'length': 'i', 'episodes': 'i', 'chapters': 'i', 'volumes': 'i',
+                   'adult': 'B', 'nulls': 'B', 'user_status': 'B', 'media_status': 'B', 'genre_mask': 'Q',
+                   'genre_set': 'I'}
+
+# The string columns, each stored as `<name>_offsets` (one more offset than there are entries) and `<name>_blob`.
+string_columns = ('title_english', 'title_romaji', 'description', 'tags')
+
+# The bits of the `nulls` column, for strings which are `None` rather than empty.
+null_bits = {'title_english': 1, 'title_romaji': 2, 'description': 4}
+
+_numpy_types = {'q': 'i8', 'h': 'i2', 'i': 'i4', 'B': 'u1', 'Q': 'u8', 'I': 'u4'}
+
+# A column as `Snapshot` reads it: a NumPy array when NumPy is installed, and a memoryview of the map otherwise. Both
+# index and slice the same way, anything else is only done to NumPy arrays (see `Snapshot._array`).
+Column = Union['np.ndarray', memoryview]
+
+
+def _pad(size: int) -> int:
+    """Returns the number of bytes needed to bring `size` up to a multiple of 8."""
+    return -size % 8
+
+
+def _encode_tags(tags: tuple[tuple[str, int], ...]) -> str:
+    """Encodes a media entry's tags as one `rank name` line per tag."""
+    return '\n'.join(f'{rank} {name}' for name, rank in tags)
+
+
+def _decode_tags(text: str) -> list[dict]:
+    """Decodes tags encoded by `_encode_tags` into the form that `Media` takes them in."""
+    return [{'name': name, 'rank': int(rank)} for rank, name in (line.split(' ', 1) for line in text.split('\n'))] \
+        if text else []
+
+
+class SnapshotWriter:
+    """Collects media entries one at a time into the columns of a snapshot, then writes them out (see `write`), so
+    that a list can be snapshotted as it's downloaded without its media objects all being held at once.
+
+    Attributes:
+        count (int): The number of entries added so far.
+    """
+    def __init__(self) -> None:
+        """Initialises the `SnapshotWriter` class."""
+        self.count = 0
+
+        self._columns = {name: array(code) for name, code in numeric_columns.items()}
+        self._blobs = {name: bytearray() for name in string_columns}
+        self._offsets = {name: array('q', [0]) for name in string_columns}
+        self._statuses: dict[str, dict[str | None, int]] = {'user_status': {}, 'media_status': {}}
+        self._genre_sets: dict[tuple[str, ...], int] = {}
+        self._media_class: type | None = None
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `SnapshotWriter` class.
+
+        Returns:
+            str: A string representation of the `SnapshotWriter` class and it's initialisation arguments.
+        """
+        return 'SnapshotWriter()'
+
+    def add(self, media: Anime | Manga) -> None:
+        """Adds a media entry.
+
+        Args:
+            media (Anime | Manga): The entry, of the same type as every other entry added.
+
+        Raises:
+            ValueError: if the entries are a mix of anime and manga
+        """
+        columns = self._columns
+        if self._media_class is None:
+            self._media_class = type(media)
+        elif type(media) is not self._media_class:
+            raise ValueError('a snapshot can only hold one type of media')
+
+        columns['media_id'].append(media.media_id if media.media_id is not None else -1)
+        columns['score'].append(media.score if media.score is not None else -1)
+        for name, value in (('length', get_length(media)), ('episodes', media.episodes),
+                            ('chapters', media.chapters), ('volumes', media.volumes)):
+            columns[name].append(value if value is not None else -1)
+        columns['adult'].append(bool(media.adult))
+        columns['genre_mask'].append(media.genre_mask)
+        columns['genre_set'].append(self._genre_sets.setdefault(media.genres, len(self._genre_sets)))
+
+        nulls = 0
+        for name in string_columns:
+            text = getattr(media, name) if name != 'tags' else _encode_tags(media.tags)
+            if text is None:
+                nulls |= null_bits[name]
+                text = ''
+            self._blobs[name] += text.encode()
+            self._offsets[name].append(len(self._blobs[name]))
+        columns['nulls'].append(nulls)
+
+        for name, codes in self._statuses.items():
+            columns[name].append(codes.setdefault(getattr(media, name), len(codes)))
+        self.count += 1
+
+    def write(self, path: str, stamp: float | None = None) -> int:
+        """Writes the entries added so far to a snapshot file, replacing the file in one step so that readers never
+        see half of it.
+
+        Args:
+            path (str): The path of the snapshot file.
+            stamp (float | None): A value that readers can check the snapshot against (see `Snapshot.stamp`), e.g.
+                when the list it was written from was stored.
+
+        Raises:
+            ValueError: if there are more genres than fit in 64 bits
+
+        Returns:
+            int: The number of entries written.
+        """
+        genres = list(prep.genre_bits)
+        if len(genres) > 64:
+            raise ValueError(f'only 64 genres fit in a snapshot, but {len(genres)} are known')
+
+        arrays = dict(self._columns)
+        for name in string_columns:
+            arrays[f'{name}_offsets'] = self._offsets[name]
+            arrays[f'{name}_blob'] = array('B', self._blobs[name])
+
+        layout: dict[str, tuple[str, int, int]] = {}
+        header = {'count': self.count,
+                  'media_type': 'MANGA' if self._media_class is Manga else 'ANIME',
+                  'byteorder': sys.byteorder,
+                  'stamp': stamp,
+                  'genres': genres,
+                  'statuses': {name: list(codes) for name, codes in self._statuses.items()},
+                  'genre_sets': list(self._genre_sets),
+                  'columns': layout}
+
+        # The offsets of the columns depend on the length of the header, which depends on the offsets, so the columns
+        # are moved along until the header fits in front of them.
+        start = 0
+        while True:
+            position = start
+            for name, values in arrays.items():
+                layout[name] = (values.typecode, position, len(values))
+                position += len(values) * values.itemsize
+                position += _pad(position)
+            encoded = json.dumps(header).encode()
+            if len(magic) + 4 + len(encoded) <= start:
+                break
+            start = len(magic) + 4 + len(encoded)
+            start += _pad(start)
+
+        temporary = f'{path}.tmp{os.getpid()}.{threading.get_ident()}'
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(magic + struct.pack('<I', len(encoded)) + encoded)
+                for name, values in arrays.items():
+                    file.write(b'\0' * (layout[name][1] - file.tell()))
+                    values.tofile(file)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+        return self.count
+
+
+def write_snapshot(media_iterable: Iterable[Anime | Manga], path: str, stamp: float | None = None) -> int:
+    """Writes media entries to a snapshot file, replacing the file in one step so that readers never see half of it.
+
+    Args:
+        media_iterable (Iterable[Anime | Manga]): The entries, all of them anime or all of them manga.
+        path (str): The path of the snapshot file.
+        stamp (float | None): A value that readers can check the snapshot against (see `Snapshot.stamp`).
+
+    Raises:
+        ValueError: if the entries are a mix of anime and manga, or there are more genres than fit in 64 bits.
+
+    Returns:
+        int: The number of entries written.
+    """
+    writer = SnapshotWriter()
+    for media in media_iterable:
+        writer.add(media)
+
+    return writer.write(path, stamp)
+
+
+class Snapshot:
+    """A read-only, memory-mapped view of a snapshot file (see `write_snapshot`).
+
+    Attributes:
+        path (str): The path of the snapshot file.
+        count (int): The number of entries.
+        media_type (str): `ANIME` or `MANGA`.
+        stamp (float | None): The value that the snapshot was stamped with when it was written, if any.
+        genres (list[str]): The genre of every bit of the genre bitmasks, lowest bit first.
+        columns (dict): Every column, as a NumPy array or (without NumPy) a memoryview, keyed by its name.
+    """
+    def __init__(self, path: str) -> None:
+        """Initialises the `Snapshot` class, mapping the file into memory.
+
+        Args:
+            path (str): The path of the snapshot file.
+
+        Raises:
+            ValueError: if the file isn't a snapshot, or was written on a machine with a different byte order.
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(magic)] != magic:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a media snapshot')
+        (size,) = struct.unpack_from('<I', self._mmap, len(magic))
+        header = json.loads(self._mmap[len(magic) + 4:len(magic) + 4 + size])
+        if header['byteorder'] != sys.byteorder:
+            self._mmap.close()
+            raise ValueError(f'{path} was written on a {header["byteorder"]}-endian machine')
+
+        self.count = header['count']
+        self.media_type = header['media_type']
+        self.stamp = header.get('stamp')
+        self.genres = header['genres']
+        self._genre_bits = {genre: 1 << bit for bit, genre in enumerate(self.genres)}
+        self._statuses = header['statuses']
+        self._genre_sets = header['genre_sets']
+
+        self._buffer = memoryview(self._mmap)
+        self.columns: dict[str, Column] = {}
+        for name, (code, offset, length) in header['columns'].items():
+            if np is not None:
+                self.columns[name] = np.frombuffer(self._mmap, dtype=_numpy_types[code], count=length, offset=offset)
+            else:
+                size = array(code).itemsize
+                self.columns[name] = self._buffer[offset:offset + length * size].cast(code)
+
+    def __len__(self) -> int:
+        """Returns the number of entries in the snapshot.
+
+        Returns:
+            int: The number of entries.
+        """
+        return self.count
+
+    def __repr__(self) -> str:
+        """Returns a string representing the `Snapshot` object.
+
+        Returns:
+            str: A string representing the `Snapshot` object and it's initialisation arguments.
+        """
+        return f'{self.__class__.__name__}({self.path!r})'
+
+    @property
+    def user_statuses(self) -> list[str | None]:
+        """The statuses on the user's list that the `user_status` column indexes into.
+
+        Returns:
+            list[str | None]: The statuses.
+        """
+        return self._statuses['user_status']
+
+    def close(self) -> None:
+        """Unmaps the file. Arrays taken from `columns` must not be used afterwards."""
+        for column in self.columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self.columns = {}
+        self._buffer.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # NumPy arrays from `columns` are still referenced elsewhere, the map is closed once they're gone.
+            pass
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _array(self, name: str) -> 'np.ndarray':
+        """Returns a column as a NumPy array, for the code paths which only run when NumPy is installed.
+
+        Args:
+            name (str): The name of the column.
+
+        Returns:
+            np.ndarray: The column.
+        """
+        column = self.columns[name]
+        assert not isinstance(column, memoryview), 'the snapshot was opened without NumPy'
+        return column
+
+    def _get_string(self, name: str, position: int) -> str:
+        """Returns an entry's value of a string column.
+
+        Args:
+            name (str): The name of the string column.
+            position (int): The position of the entry.
+
+        Returns:
+            str: The decoded string.
+        """
+        offsets = self.columns[f'{name}_offsets']
+        return bytes(self.columns[f'{name}_blob'][offsets[position]:offsets[position + 1]]).decode()
+
+    def get(self, position: int) -> Anime | Manga:
+        """Builds the media object of an entry.
+
+        Args:
+            position (int): The position of the entry, from 0 to `len(snapshot) - 1`.
+
+        Returns:
+            Anime | Manga: The entry, equal to the one that was written.
+        """
+        def number(name: str) -> int | None:
+            value = int(self.columns[name][position])
+            return value if value != -1 else None
+
+        nulls = int(self.columns['nulls'][position])
+        strings = {name: self._get_string(name, position) if not nulls & bit else None
+                   for name, bit in null_bits.items()}
+
+        media_class = Manga if self.media_type == 'MANGA' else Anime
+        return media_class(title={'english': strings['title_english'], 'romaji': strings['title_romaji']},
+                           user_status=self._statuses['user_status'][self.columns['user_status'][position]],
+                           media_status=self._statuses['media_status'][self.columns['media_status'][position]],
+                           score=number('score'),
+                           genres=self._genre_sets[self.columns['genre_set'][position]],
+                           description=strings['description'],
+                           adult=bool(self.columns['adult'][position]),
+                           episodes=number('episodes'), chapters=number('chapters'), volumes=number('volumes'),
+                           media_id=number('media_id'),
+                           tags=_decode_tags(self._get_string('tags', position)))
+
+    def get_genre_mask(self, genres: list[str]) -> int | None:
+        """Encodes genres as a bitmask in the snapshot's own bits (which may differ from `prep.genre_bits`).
+
+        Args:
+            genres (list[str]): A list of genres, compared case-insensitively.
+
+        Returns:
+            int | None: The bitmask, or `None` if one of the genres doesn't appear in the snapshot at all.
+        """
+        mask = 0
+        for genre in prep.get_list_lowercase(genres):
+            if genre not in self._genre_bits:
+                return None
+            mask |= self._genre_bits[genre]
+
+        return mask
+
+    def filter(self, genres: list[str] | None = None, strict_match: bool = False, adult: bool = False,
+               lower_bound: int | None = None, upper_bound: int | None = None,
+               statuses: Iterable[str] | None = None) -> 'list[int] | np.ndarray':
+        """Returns the positions of the entries which fit the criteria, with the same semantics as
+        `filter.build_predicates`, without building any media objects.
+
+        Args:
+            genres (list[str] | None): A list of the user's preferred genres.
+            strict_match (bool): Whether the user is looking for strict matches or not.
+            adult (bool): Whether the user is okay with series marked as 'Adult' on AniList.
+            lower_bound (int | None): A lower bound on the length of the media (see `filter.get_length`).
+            upper_bound (int | None): An upper bound on the length of the media.
+            statuses (Iterable[str] | None): The statuses on the user's list that are allowed.
+
+        Returns:
+            list[int] | np.ndarray: The positions of the matching entries, in ascending order.
+        """
+        codes = None
+        if statuses is not None:
+            allowed = frozenset(statuses)
+            codes = [code for code, status in enumerate(self._statuses['user_status']) if status in allowed]
+
+        user_mask = self.get_genre_mask(genres) if genres is not None else None
+        if genres is not None and user_mask is None:
+            if not strict_match:
+                return [] if np is None else np.empty(0, dtype=np.int64)
+            # Genres which no entry has can't rule any entry out of a strict match.
+            user_mask = self.get_genre_mask([genre for genre in genres if genre.lower() in self._genre_bits])
+
+        if np is not None:
+            keep = np.ones(self.count, dtype=bool)
+            if not adult:
+                keep &= self._array('adult') == 0
+            if codes is not None:
+                keep &= np.isin(self._array('user_status'), codes)
+            if lower_bound is not None or upper_bound is not None:
+                lengths = self._array('length')
+                keep &= lengths != -1
+                if lower_bound is not None:
+                    keep &= lengths >= lower_bound
+                if upper_bound is not None:
+                    keep &= lengths <= upper_bound
+            if user_mask is not None:
+                masks = self._array('genre_mask')
+                if not strict_match:
+                    keep &= masks & np.uint64(user_mask) == user_mask
+                else:
+                    keep &= masks & np.uint64(~user_mask & (1 << 64) - 1) == 0
+            return np.flatnonzero(keep)
+
+        # The criteria are applied one at a time, cheapest first, each to the positions that passed the previous one.
+        columns = self.columns
+        positions: Iterable[int] = range(self.count)
+        if not adult:
+            column = columns['adult']
+            positions = [position for position in positions if not column[position]]
+        if codes is not None:
+            column, allowed_codes = columns['user_status'], frozenset(codes)
+            positions = [position for position in positions if column[position] in allowed_codes]
+        if lower_bound is not None or upper_bound is not None:
+            column = columns['length']
+            lower = lower_bound if lower_bound is not None else 0
+            upper = upper_bound if upper_bound is not None else float('inf')
+            positions = [position for position in positions
+                         if column[position] != -1 and lower <= column[position] <= upper]
+        if user_mask is not None:
+            column = columns['genre_mask']
+            if not strict_match:
+                positions = [position for position in positions if column[position] & user_mask == user_mask]
+            else:
+                positions = [position for position in positions if not column[position] & ~user_mask]
+
+        return list(positions)
+
+    def top_k(self, positions: 'list[int] | np.ndarray', count: int) -> list[int]:
+        """Returns the positions of the `count` best entries by score, in the order that `filter.top_k` would give them
+        in: highest score first, unscored entries last, and ties in favour of the earlier entry.
+
+        Args:
+            positions (list[int] | np.ndarray): The positions to choose from, in ascending order (see `filter`).
+            count (int): The number of entries to return.
+
+        Returns:
+            list[int]: At most `count` positions, best first.
+        """
+        if count <= 0 or len(positions) == 0:
+            return []
+
+        if np is not None:
+            candidates = np.asarray(positions, dtype=np.int64)
+            keys = -self._array('score')[candidates].astype(np.int32)
+            if count < len(candidates):
+                threshold = keys[np.argpartition(keys, count - 1)[:count]].max()
+                candidates = candidates[keys <= threshold]
+                keys = keys[keys <= threshold]
+            return candidates[np.argsort(keys, kind='stable')][:count].tolist()
+
+        scores = self.columns['score']
+        return heapq.nsmallest(count, positions, key=lambda position: (-scores[position], position))
+
+    def recommend(self, args: argparse.Namespace) -> list[Anime | Manga]:
+        """Filters the entries by the criteria given in the command line arguments and returns the best `args.count` of
+        them, as `filter.recommend` does for media objects.
+
+        Args:
+            args (argparse.Namespace): The arguments that the user entered and their values.
+
+        Returns:
+            list[Anime | Manga]: At most `args.count` media entries, in descending order of their scores on AniList.
+        """
+        positions = self.filter(args.genre, args.strict_match, args.adult, args.lower_bound, args.upper_bound)
+
+        return [self.get(position) for position in self.top_k(positions, args.count)]
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Parses the entries of a user's list out of a `MediaListCollection` response while it's still being downloaded, so
+that each entry can be built, filtered and dropped before the next one has even arrived.
+
+Decoding a response in one go (`response.json()`) holds the whole body, and then every entry of it as a dict, before
+the first entry can be looked at. An `EntryStream` reads the body a chunk at a time instead, and decodes one entry at a
+time out of it, so only a chunk of the body and the entry being worked on are ever held, however long the list is.
+
+Only the entries are decoded: the body is scanned for the `entries` arrays and `hasNextChunk`, which is all that the
+collection query (see `fetch.collection_template`) selects. A body which doesn't start with the collection (e.g. one
+with GraphQL errors) is read and decoded in full instead.
+"""
+
+
+import codecs
+import json
+import re
+from typing import Iterator
+import requests
+import client
+import profiling
+
+
+# The number of bytes of the body read at a time.
+chunk_size = 64 * 1024
+
+# How much of the body is read before deciding whether it can be streamed.
+head_size = 256
+
+_head = re.compile(r'\s*\{\s*"data"\s*:\s*\{\s*"MediaListCollection"\s*:\s*\{')
+_keys = re.compile(r'"entries"\s*:\s*\[|"hasNextChunk"\s*:\s*(true|false)')
+_separators = re.compile(r'[\s,]*')
+
+
+class EntryStream:
+    """The entries of a `MediaListCollection` response, decoded one at a time as the response is downloaded.
+
+    Iterating over it reads the response to the end (or until the iteration is stopped) and closes it, so it can only
+    be iterated over once.
+
+    Attributes:
+        response (requests.Response): The response, opened with `stream=True` (see `client.open_query`).
+        has_next_chunk (bool): Whether the list has more entries after this chunk. Only known once every entry has been
+            read.
+    """
+    def __init__(self, response: requests.Response) -> None:
+        """Initialises the `EntryStream` class.
+
+        Args:
+            response (requests.Response): The response, opened with `stream=True` and with its body still unread.
+        """
+        self.response = response
+        self.has_next_chunk = False
+
+        self._chunks = response.iter_content(chunk_size)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._text = ''
+        self._position = 0
+        self._finished = False
+
+    def __repr__(self) -> str:
+        """Returns a string representation of the `EntryStream` class.
+
+        Returns:
+            str: A string representation of the `EntryStream` class and it's initialisation arguments.
+        """
+        return f'EntryStream({self.response!r})'
+
+    def __iter__(self) -> Iterator[dict]:
+        """Yields the entries of every list in the response, in the order they were sent.
+
+        Raises:
+            AniListError: if the response has no data, is malformed or is cut short
+
+        Yields:
+            dict: The entries, each one as selected by the query.
+        """
+        try:
+            while len(self._text) < head_size and self._read():
+                pass
+
+            if (head := _head.match(self._text)) is None:
+                yield from self._decode_whole()
+                return
+
+            self._position = head.end()
+            decode = profiling.timed('decode', json.JSONDecoder().raw_decode)
+
+            while True:
+                if (key := _keys.search(self._text, self._position)) is None:
+                    if not self._read():
+                        return
+                    continue
+
+                self._position = key.end()
+                if key.group(1) is not None:
+                    self.has_next_chunk = key.group(1) == 'true'
+                else:
+                    yield from self._decode_entries(decode)
+        finally:
+            self.response.close()
+
+    def _read(self) -> bool:
+        """Adds the next chunk of the body to the text still to be parsed, dropping the text that has been parsed.
+
+        Raises:
+            AniListError: if the download fails part way through, or the body isn't valid UTF-8
+
+        Returns:
+            bool: Whether anything was read, i.e. `False` once the whole body has been.
+        """
+        if self._finished:
+            return False
+
+        try:
+            with profiling.span('request'):
+                chunk = next(self._chunks, None)
+            text = self._decoder.decode(chunk or b'', final=chunk is None)
+        except (requests.RequestException, UnicodeDecodeError) as error:
+            raise client.AniListError(f'failed to read the response: {error}') from error
+
+        if chunk is None:
+            self._finished = True
+        else:
+            profiling.count('bytes_received', len(chunk))
+
+        self._text = self._text[self._position:] + text
+        self._position = 0
+
+        return chunk is not None
+
+    def _decode_entries(self, decode) -> Iterator[dict]:
+        """Yields the items of an `entries` array, starting just after its opening bracket, and stops after its
+        closing bracket.
+
+        Args:
+            decode (Callable): `json.JSONDecoder.raw_decode`, possibly timed (see `profiling.timed`).
+
+        Raises:
+            AniListError: if the array is malformed or the body ends before it does
+
+        Yields:
+            dict: The entries.
+        """
+        while True:
+            # The pattern matches the empty string, so there's always a match.
+            separators = _separators.match(self._text, self._position)
+            assert separators is not None
+            self._position = separators.end()
+
+            if self._position == len(self._text):
+                if not self._read():
+                    raise client.AniListError('the response ended in the middle of a list')
+                continue
+
+            if self._text[self._position] == ']':
+                self._position += 1
+                return
+
+            try:
+                entry, self._position = decode(self._text, self._position)
+            except json.JSONDecodeError as error:
+                # Usually just an entry split between two chunks.
+                if not self._read():
+                    raise client.AniListError(f'the response is malformed: {error}') from error
+                continue
+
+            yield entry
+
+    def _decode_whole(self) -> Iterator[dict]:
+        """Reads and decodes the whole body, for responses which don't start with the collection.
+
+        Raises:
+            AniListError: if the response has no data (see `client.Scheduler.get_data`)
+
+        Yields:
+            dict: The entries.
+        """
+        while self._read():
+            pass
+
+        try:
+            with profiling.span('decode'):
+                results = json.loads(self._text)
+        except ValueError:
+            results = {}
+        self._text = ''
+
+        collection = client.get_scheduler().get_data(self.response, results)['MediaListCollection']
+        self.has_next_chunk = collection['hasNextChunk']
+
+        for media_list in collection['lists']:
+            yield from media_list['entries']
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,11 @@
 """A class representing an user on AniList."""
 
 
-import requests
-from typing import Dict
-from media import Anime, Manga
-from prep import query_url
+import sys
+from typing import Iterator, Sequence
+from media import Anime, Manga, Media
+from fetch import Fetcher, CollectionFetcher, PageFetcher, fetch_details
+import profiling
 
 
 class User:
@@ -12,14 +13,18 @@ class User:
 
     Attributes:
         username (str): The user's AniList username.
+        fetcher (Fetcher): The fetcher used to download the user's media list.
     """
-    def __init__(self, username: str) -> None:
+    def __init__(self, username: str, fetcher: Fetcher | None = None) -> None:
         """Initialises the `User` class.
 
         Args:
             username (str): The user's AniList username.
+            fetcher (Fetcher | None): The fetcher used to download the user's media list. Defaults to a
+                `CollectionFetcher`.
         """
         self.username = username
+        self.fetcher = fetcher if fetcher is not None else CollectionFetcher()
 
     def __repr__(self) -> str:
         """Returns a string representation of the `User` class.
@@ -29,116 +34,152 @@ class User:
         """
         return f'User({self.username})'
 
-    def get_query_variables(self) -> Dict[str, int | str | None]:
-        """Returns the variables required for the AL API query.
+    def get_entries(self, media_type: str, query: str | None = None) -> list[dict]:
+        """Returns the entries of the user's media list which are either 'Paused' or 'Planning'.
+
+        Args:
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            query (str | None): A query string for `Page.mediaList`. If given the list is paginated through with it,
+                instead of using the user's fetcher.
 
         Returns:
-            Dict[str, int | str, None]: The variables required for the AL API query.
+            list[dict]: The matching entries, each one containing the entry's `status` and its `media`.
+        """
+        return list(self.iter_entries(media_type, query))
+
+    def iter_entries(self, media_type: str, query: str | None = None) -> Iterator[dict]:
+        """Yields the entries of the user's media list which are either 'Paused' or 'Planning', as soon as the fetcher
+        has downloaded them.
+
+        Args:
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+            query (str | None): A query string for `Page.mediaList`. If given the list is paginated through with it,
+                instead of using the user's fetcher.
+
+        Yields:
+            dict: The matching entries, each one containing the entry's `status` and its `media`.
         """
-        return {'page': 1,
-                'perPage': 50,
-                'userName': self.username,
-                'type': None}
+        fetcher = self.fetcher if query is None else PageFetcher(query)
 
-    def paginate(self, query: str, query_variables: dict) -> list[dict]:
-        """Paginates through a user's media list using a given query to the API (`query`) and the variables required
-        to do so (`query_variables`).
+        yield from fetcher.iter_entries(self.username, media_type)
 
-        If elements in the media list can be found they are returned. If not an empty list is returned, indicating
-        that paginatnion has come to an end.
+    def iter_anime_list(self, query: str | None = None) -> Iterator[Anime]:
+        """Does the same as `get_anime_list`, but yields each `Anime` as soon as its page of the list has arrived.
 
         Args:
-            query (str): The query string that will be sent to the AL API.
-            query_variables (dict): The variables required for the query to the AL API.
+            query (str | None): A query string for `Page.mediaList`. If given the list is paginated through with it,
+                instead of using the user's fetcher.
 
-        Returns:
-            results (list[dict]): This list either contains elements of the user's media list, or it is empty, thereby
-            indicating that pagination has come to an end.
+        Yields:
+            Anime: The anime from the user's AL media list.
         """
-        results = requests.post(query_url,
-                                json={'query': query,
-                                      'variables': query_variables}).json()
-        results = results['data']['Page']
+        build = profiling.timed('build', build_media, 'entries_parsed')
+        for entry in self.iter_entries('ANIME', query):
+            yield build(entry['media'], 'ANIME', entry['status'])
 
-        if not results['mediaList']:
-            results = []
-            return results
-        else:
-            return results['mediaList']
+    def iter_manga_list(self, query: str | None = None) -> Iterator[Manga]:
+        """Does the same as `get_manga_list`, but yields each `Manga` as soon as its page of the list has arrived.
 
-    def get_anime_list(self, query: str) -> list[Anime]:
-        """Paginates through the user's media list, only considering anime entries which are either 'Paused' or
-        'Planning', and returns them as a list in the form of many `Anime` objects.
+        Args:
+            query (str | None): A query string for `Page.mediaList`. If given the list is paginated through with it,
+                instead of using the user's fetcher.
+
+        Yields:
+            Manga: The manga from the user's AL media list.
+        """
+        build = profiling.timed('build', build_media, 'entries_parsed')
+        for entry in self.iter_entries('MANGA', query):
+            yield build(entry['media'], 'MANGA', entry['status'])
+
+    def get_completed_entries(self, media_type: str) -> list[dict]:
+        """Returns the entries of the user's media list which are 'Completed', along with the score the user gave them.
+        These are what the user's taste is inferred from (see `rank.rank_similarity`).
+
+        Args:
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            list[dict]: The entries, each one containing the user's `score` and the `media`'s genres and tags.
+        """
+        return self.fetcher.fetch_completed(self.username, media_type)
+
+    def get_anime_list(self, query: str | None = None) -> list[Anime]:
+        """Fetches the user's media list, only considering anime entries which are either 'Paused' or 'Planning', and
+        returns them as a list in the form of many `Anime` objects.
 
         The returned list of objects contains entry-specific information such as the information such as the title of
-        the show, the number of episodes, etc.
+        the show, the number of episodes, etc. Descriptions aren't fetched (see `load_descriptions`).
 
         Args:
-            query (str): The query string that will be sent to the AL API.
+            query (str | None): A query string for `Page.mediaList`. If given the list is paginated through with it,
+                instead of using the user's fetcher.
 
         Returns:
             anime_list (list[Anime]): A list containing the anime from the user's AL media list.
         """
-        anime_list = []
-        query_variables = self.get_query_variables()
-        query_variables['type'] = 'ANIME'
-
-        # We will cycle through every page (since we have to use pagination with the AniList API) and continue until
-        # the results are exhausted.
-        while True:
-            if results := self.paginate(query, query_variables):
-                pass
-            else:
-                break
-
-            for entry in results:
-                anime = entry['media']
-                user_status = entry['status']
-                if user_status in ('PLANNING', 'PAUSED'):
-                    anime_list.append(Anime(anime['title'], user_status, anime['status'], anime['episodes'],
-                                            anime['isAdult'], anime['genres'], anime['description'],
-                                            anime['averageScore']))
-
-            query_variables['page'] += 1
-
-        return anime_list
-
-    def get_manga_list(self, query: str) -> list[Manga]:
-        """Paginates through the user's media list, only considering manga entries which are either 'Paused' or
-        'PLanning', and returns them as a list in the form of many `Manga` objects.
+        return list(self.iter_anime_list(query))
+
+    def get_manga_list(self, query: str | None = None) -> list[Manga]:
+        """Fetches the user's media list, only considering manga entries which are either 'Paused' or 'Planning', and
+        returns them as a list in the form of many `Manga` objects.
 
         The returned list of objects contains entry-specific information such as the information such as the title of
-        the manga, the number of chapters, etc.
+        the manga, the number of chapters, etc. Descriptions aren't fetched (see `load_descriptions`).
 
         Args:
-            query (str): The query string that will be sent to the AL API.
+            query (str | None): A query string for `Page.mediaList`. If given the list is paginated through with it,
+                instead of using the user's fetcher.
 
         Returns:
             manga_list (list[Manga]): A list containing the manga from the user's AL media list.
         """
-        manga_list = []
-        query_variables = self.get_query_variables()
-        query_variables['type'] = 'MANGA'
-
-        # We will cycle through every page (since we have to use pagination
-        # with the AniList API) and continue until the results are exhausted.
-        while True:
-            if results := self.paginate(query, query_variables):
-                pass
-            else:
-                break
-
-            for entry in results:
-                manga = entry['media']
-                user_status = entry['userStatus']
-                if user_status in ('PLANNING', 'PAUSED'):
-                    manga_list.append(Manga(manga['title'], user_status, manga['status'], manga['chapters'],
-                                            manga['volumes'], manga['isAdult'], manga['genres'], manga['description'],
-                                            manga['averageScore']))
-
-            query_variables['page'] += 1
-
-        return manga_list
+        return list(self.iter_manga_list(query))
+
+
+def build_media(media: dict, media_type: str, user_status: str | None = None) -> Anime | Manga:
+    """Builds an `Anime` or `Manga` object from a piece of media returned by the AniList API.
+
+    Args:
+        media (dict): The media, with the fields in `fetch.media_fields`.
+        media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+        user_status (str | None): The status of the media on the user's list, if it's on it.
+
+    Returns:
+        Anime | Manga: The media entry.
+    """
+    if media_type == 'ANIME':
+        return Anime(media['title'], user_status, media['status'], media['averageScore'], media['genres'],
+                     media.get('description'), media['isAdult'], media['episodes'], media_id=media['id'],
+                     tags=media.get('tags'))
+
+    return Manga(media['title'], user_status, media['status'], media['averageScore'], media['genres'],
+                 media.get('description'), media['isAdult'], media['chapters'], media['volumes'], media_id=media['id'],
+                 tags=media.get('tags'))
+
+
+def load_descriptions(media_list: Sequence[Media], fetcher: Fetcher | None = None) -> None:
+    """Fills in the descriptions of the given media entries, fetching them in as few requests as possible. Meant to be
+    used on the final recommendations only, rather than on a user's whole list. Entries without any tags (usually
+    because their list was fetched without them, see `fetch.get_media_fields`) get their tags at the same time.
+
+    Args:
+        media_list (Sequence[Media]): The media entries whose descriptions are missing.
+        fetcher (Fetcher | None): The fetcher whose `fetch_details` is used, so that details can be served from its
+            cache (see `cache.CachedFetcher.fetch_details`). Defaults to always fetching them.
+    """
+    missing = [(media.media_id, media) for media in media_list
+               if media.description is None and media.media_id is not None]
+    if not missing:
+        return
+
+    with profiling.span('descriptions'):
+        fetch = fetcher.fetch_details if fetcher is not None else fetch_details
+        details = fetch([media_id for media_id, _ in missing])
+        for media_id, media in missing:
+            found = details.get(media_id) or {}
+            media.description = found.get('description')
+            if not media.tags and found.get('tags'):
+                media.tags = tuple((sys.intern(tag['name']), tag['rank']) for tag in found['tags'])
 
 
 def main():
@@ -0,0 +1,113 @@
+"""Compares the memory held by many users' lists, and the time it takes to rank one, when every list has `Anime`
+objects of its own (as the server used to hold them) against `catalogue.UserList`s sharing a `catalogue.MediaCatalogue`.
+
+Users' lists are drawn from a pool of titles with a skewed popularity, so that popular titles are on many lists, like
+on AniList. Run with `python benchmarks/bench_catalogue.py [--users 500] [--entries 1000] [--titles 20000]`.
+"""
+
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+import catalogue  # noqa: E402
+import fake_anilist  # noqa: E402
+from filter import recommend  # noqa: E402
+from user import build_media  # noqa: E402
+
+
+query = argparse.Namespace(genre=['action'], strict_match=False, adult=False, lower_bound=None, upper_bound=None,
+                           count=10)
+
+
+def make_lists(users: int, entries: int, titles: int) -> list[list[dict]]:
+    """Returns synthetic list entries for every user, with the fields of a list fetched for ranking by score.
+
+    Args:
+        users (int): The number of users.
+        entries (int): The number of entries on every list.
+        titles (int): The number of distinct titles that lists are drawn from.
+
+    Returns:
+        list[list[dict]]: The entries of each user's list.
+    """
+    api = fake_anilist.FakeAniList()
+    rng = random.Random(0)
+    # Popularity falls off with the rank of a title, as on AniList, where a few titles are on most lists.
+    weights = [1 / (rank + 10) for rank in range(titles)]
+    media: dict[int, dict] = {}
+    lists = []
+
+    for _ in range(users):
+        media_ids: set[int] = set()
+        while len(media_ids) < entries:
+            media_ids.update(rng.choices(range(1, titles + 1), weights, k=entries - len(media_ids)))
+        for media_id in media_ids - media.keys():
+            media[media_id] = {key: value for key, value in api.make_media(media_id, 'ANIME').items()
+                               if key not in ('description', 'tags', 'popularity')}
+        lists.append([{'status': rng.choice(['PLANNING', 'PAUSED']), 'media': media[media_id]}
+                      for media_id in media_ids])
+
+    return lists
+
+
+def measure(build) -> tuple[object, int, float]:
+    """Runs `build` with memory tracing on.
+
+    Args:
+        build (Callable): Builds and returns the held lists.
+
+    Returns:
+        tuple[object, int, float]: The held lists, the traced bytes they take and the time it took to build them.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    held = build()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return held, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--entries', type=int, default=1000)
+    parser.add_argument('--titles', type=int, default=20_000)
+    arguments = parser.parse_args()
+
+    lists = make_lists(arguments.users, arguments.entries, arguments.titles)
+    media_catalogue = catalogue.MediaCatalogue()
+
+    media_lists, objects_size, objects_built = measure(
+        lambda: [[build_media(entry['media'], 'ANIME', entry['status']) for entry in entries] for entries in lists])
+    user_lists, catalogue_size, catalogue_built = measure(
+        lambda: [catalogue.load_user_list(entries, 'ANIME', media_catalogue) for entries in lists])
+
+    start = time.perf_counter()
+    expected = [recommend(media_list, query) for media_list in media_lists]
+    objects_ranked = time.perf_counter() - start
+    start = time.perf_counter()
+    recommendations = [user_list.attach(recommend(user_list.iter_media(), query)) for user_list in user_lists]
+    catalogue_ranked = time.perf_counter() - start
+
+    assert [[media.to_dict() for media in media_list] for media_list in recommendations] == \
+        [[media.to_dict() for media in media_list] for media_list in expected]
+
+    total = arguments.users * arguments.entries
+    print(f'{arguments.users:,} users x {arguments.entries:,} entries = {total:,} entries, '
+          f'{len(media_catalogue):,} distinct titles')
+    for name, size, built, ranked in (('Anime objects per list', objects_size, objects_built, objects_ranked),
+                                      ('catalogue + UserList', catalogue_size, catalogue_built, catalogue_ranked)):
+        print(f'    {name:24} {size / 2 ** 20:8.1f} MiB ({size / total:5.0f} bytes per entry), built in '
+              f'{built * 1e3:7.0f} ms, ranked in {ranked / arguments.users * 1e3:6.2f} ms per user')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Measures building the collaborative item index (`collaborative.build_index`) from synthetic ratings: a full build,
+an incremental rebuild after some users' ratings change, and the latency of a query. The incremental build is checked
+against a full build of the same ratings, which has to give the same statistics up to floating-point rounding.
+
+Users are given a taste (a few favourite clusters of media) so that the ratings have some structure. Run with
+`python benchmarks/bench_collaborative.py [--users 20000] [--media 5000] [--ratings 100] [--changed 0.01]`.
+"""
+
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+import numpy as np  # noqa: E402
+import collaborative  # noqa: E402
+
+
+def make_entries(rng: random.Random, media: int, ratings: int, clusters: int = 50) -> list[dict]:
+    """Returns a synthetic user's completed entries, most of them from a few clusters that the user likes.
+
+    Args:
+        rng (random.Random): The random number generator.
+        media (int): The number of media to choose from.
+        ratings (int): The average number of entries.
+        clusters (int): The number of clusters the media fall into.
+
+    Returns:
+        list[dict]: The entries, each with the user's `score` and the `media`'s ID.
+    """
+    favourites = set(rng.sample(range(clusters), 3))
+    media_ids = rng.sample(range(1, media + 1), max(2, int(rng.expovariate(1 / ratings))) % media or 2)
+
+    return [{'score': rng.randint(70, 100) if media_id % clusters in favourites else rng.randint(10, 80),
+             'media': {'id': media_id}} for media_id in media_ids]
+
+
+def get_pairs(index: collaborative.ItemIndex) -> tuple[np.ndarray, ...]:
+    """Returns the co-rating statistics of an index by pair of media IDs, which don't depend on which media have rows.
+
+    Args:
+        index (collaborative.ItemIndex): The index.
+
+    Returns:
+        tuple[np.ndarray, ...]: The keys of the pairs (the ID of the first piece of media times 2^32 plus the ID of the
+        second one) in ascending order, their sums of products and their counts.
+    """
+    indptr, columns, dots, counts = index.get_statistics()
+    media_ids = np.asarray(index.media_ids).astype(np.int64)
+    rows = np.repeat(media_ids, np.diff(indptr))
+
+    return (rows << 32) | media_ids[columns], np.asarray(dots), np.asarray(counts)
+
+
+def check_incremental(store: collaborative.RatingStore, path: str, full_path: str) -> None:
+    """Checks an incrementally built index against a full build of the same ratings.
+
+    The incremental index keeps (empty) rows for media that nobody rates any more, so the indexes are compared by
+    media ID.
+
+    Args:
+        store (collaborative.RatingStore): The stored ratings.
+        path (str): The directory of the incrementally built index.
+        full_path (str): The directory the full build is written to.
+    """
+    collaborative.build_index(store, 'ANIME', full_path, full=True)
+    incremental, full = collaborative.ItemIndex(path), collaborative.ItemIndex(full_path)
+    (keys, dots, counts), (expected_keys, expected_dots, expected_counts) = get_pairs(incremental), get_pairs(full)
+
+    assert np.array_equal(keys, expected_keys) and np.array_equal(counts, expected_counts)
+    assert np.allclose(dots, expected_dots, rtol=1e-9, atol=1e-6), 'the sums of products drifted'
+
+    rows = np.searchsorted(incremental.media_ids, full.media_ids)
+    similarities, neighbours = np.asarray(incremental.similarities)[rows], np.asarray(incremental.neighbours)[rows]
+    assert np.allclose(similarities, full.similarities, rtol=1e-6, atol=1e-7)
+
+    same = np.mean(neighbours == np.asarray(full.neighbours))
+    print(f'against a full build: {np.max(np.abs(dots - expected_dots), initial=0):.1e} largest difference of a sum '
+          f'of products, {same:.4%} of neighbours identical')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--media', type=int, default=5_000)
+    parser.add_argument('--ratings', type=int, default=100)
+    parser.add_argument('--changed', type=float, default=0.01)
+    arguments = parser.parse_args()
+
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = collaborative.RatingStore(os.path.join(directory, 'ratings.sqlite3'))
+        path = os.path.join(directory, 'index')
+
+        start = time.perf_counter()
+        for user in range(arguments.users):
+            store.put(f'user{user}', 'ANIME', make_entries(rng, arguments.media, arguments.ratings))
+        print(f'stored {store.count("ANIME")[1]:,} ratings of {arguments.users:,} users '
+              f'in {time.perf_counter() - start:.1f} s')
+
+        meta = collaborative.build_index(store, 'ANIME', path)
+        print(f'full build:        {meta["seconds"]:8.2f} s, {meta["media"]:,} media, {meta["pairs"]:,} co-rated pairs')
+
+        for user in rng.sample(range(arguments.users), int(arguments.users * arguments.changed)):
+            store.put(f'user{user}', 'ANIME', make_entries(rng, arguments.media, arguments.ratings))
+        meta = collaborative.build_index(store, 'ANIME', path)
+        print(f'incremental build: {meta["seconds"]:8.2f} s, {meta["changed_users"]:,} users\' ratings changed')
+        check_incremental(store, path, os.path.join(directory, 'full-index'))
+
+        start = time.perf_counter()
+        index = collaborative.ItemIndex(path)
+        opened = time.perf_counter() - start
+
+        queries = [store.get(f'user{user}', 'ANIME') for user in range(min(200, arguments.users))]
+        start = time.perf_counter()
+        for media_ids, scores in queries:
+            index.recommend(media_ids, scores, set(media_ids.tolist()))
+        elapsed = (time.perf_counter() - start) / len(queries)
+        print(f'open index:        {opened * 1e3:8.2f} ms')
+        print(f'query:             {elapsed * 1e3:8.2f} ms per user')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Benchmarks the hot paths of the recommender against the local stand-in API (`fake_anilist.py`): fetching a list
+(wall time, requests and bytes per user), filtering and ranking throughput, and the memory taken by a built list.
+
+Run with `python benchmarks/bench_fetch.py [--sizes 100 5000 50000] [--latency 0.02] [--json results.json]`. The
+JSON output of two runs can be compared to spot regressions.
+"""
+
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+import client  # noqa: E402
+import fetch  # noqa: E402
+import fake_anilist  # noqa: E402
+from filter import build_predicates, filter_media, sort_score, top_k  # noqa: E402
+from user import User  # noqa: E402
+
+
+def time_fetch(api: fake_anilist.FakeAniList, fetcher: fetch.Fetcher, username: str) -> dict:
+    """Fetches and builds a user's anime list, measuring the time, requests and bytes it took.
+
+    Args:
+        api (fake_anilist.FakeAniList): The stand-in API.
+        fetcher (fetch.Fetcher): The fetcher being measured.
+        username (str): The username.
+
+    Returns:
+        dict: The wall time (in seconds), number of requests, bytes received and entries built.
+    """
+    api.reset_counters()
+
+    start = time.perf_counter()
+    media_list = User(username, fetcher).get_anime_list()
+    elapsed = time.perf_counter() - start
+
+    return {'seconds': elapsed, 'requests': api.requests, 'bytes': api.bytes_sent, 'entries': len(media_list)}
+
+
+def time_rank(media_list: list, repeats: int) -> dict:
+    """Measures filtering and ranking throughput on a built list.
+
+    Args:
+        media_list (list): The built media entries.
+        repeats (int): The number of times each operation is repeated.
+
+    Returns:
+        dict: The entries per second for the filter pipeline and for ranking, both full sort and top-k.
+    """
+    predicates = build_predicates(['action'], lower_bound=5, upper_bound=30)
+    results = {}
+
+    for name, operation in (('filter', lambda: sum(1 for _ in filter_media(media_list, predicates))),
+                            ('sort_score', lambda: sort_score(media_list)),
+                            ('top_k', lambda: top_k(media_list, 5)),
+                            ('filter+top_k', lambda: top_k(filter_media(media_list, predicates), 5))):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            operation()
+        elapsed = time.perf_counter() - start
+        results[f'{name}_entries_per_second'] = len(media_list) * repeats / elapsed if elapsed else 0.0
+
+    return results
+
+
+def measure_memory(username: str) -> dict:
+    """Measures the memory taken by a user's built list, by fetching it again with tracing on.
+
+    Args:
+        username (str): The username.
+
+    Returns:
+        dict: The traced bytes held by the built list, in total and per entry.
+    """
+    tracemalloc.start()
+    media_list = User(username, fetch.CollectionFetcher()).get_anime_list()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {'bytes': size, 'bytes_per_entry': size / len(media_list) if media_list else 0.0}
+
+
+def run(sizes: list[int], latency: float) -> dict:
+    """Runs every benchmark at every list size.
+
+    Args:
+        sizes (list[int]): The list sizes.
+        latency (float): The latency added to every response of the stand-in API.
+
+    Returns:
+        dict: The results, keyed by list size and then by benchmark.
+    """
+    results = {}
+
+    for size in sizes:
+        api = fake_anilist.FakeAniList(list_size=size, latency=latency)
+        server, client.query_url = fake_anilist.start(api)
+
+        try:
+            # `collection_trimmed` only asks for the fields that ranking by score needs (see `main.get_list_fields`).
+            fetchers = {'collection': fetch.CollectionFetcher(),
+                        'collection_trimmed': fetch.CollectionFetcher(fields=()),
+                        'page_sequential': fetch.PageFetcher(workers=1),
+                        'page_concurrent': fetch.PageFetcher(workers=8)}
+            # The synthetic list is generated up front, so that it isn't part of the first measurement.
+            api.get_list('user', 'ANIME')
+            size_results: dict = {f'fetch_{name}': time_fetch(api, fetcher, 'user')
+                                  for name, fetcher in fetchers.items()}
+
+            media_list = User('user', fetch.CollectionFetcher()).get_anime_list()
+            size_results['rank'] = time_rank(media_list, max(1, 200_000 // size))
+            size_results['memory'] = measure_memory('user')
+            size_results['fetch_bytes_per_page_entry'] = \
+                size_results['fetch_page_sequential']['bytes'] / size if size else 0.0
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        results[size] = size_results
+
+    return results
+
+
+def print_results(results: dict) -> None:
+    """Prints the results as a table.
+
+    Args:
+        results (dict): The results of `run`.
+    """
+    for size, size_results in results.items():
+        print(f'{size} entries on the list')
+        for name, result in size_results.items():
+            if name.startswith('fetch_') and isinstance(result, dict):
+                print(f'    {name:24} {result["seconds"] * 1e3:9.1f} ms {result["requests"]:6} requests '
+                      f'{result["bytes"] / 1024:10.1f} KiB {result["entries"]:7} entries')
+        for name, value in size_results['rank'].items():
+            print(f'    {name:40} {value:14,.0f}')
+        print(f'    {"memory per built entry":40} {size_results["memory"]["bytes_per_entry"]:14,.0f} bytes')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 5_000, 50_000])
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--json', help='Also write the results to this file.')
+    arguments = parser.parse_args()
+
+    results = run(arguments.sizes, arguments.latency)
+    print_results(results)
+
+    if arguments.json:
+        with open(arguments.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Measures the time the server takes to answer a recommendation request (without the HTTP round trip) when every
+request is computed from the user's list held in memory, against serving precomputed results
+(`materialize.RecommendationStore`), and checks that both give the same answers.
+
+Requests are drawn with a skewed frequency from every combination of user, genre and bounds, so that a few are much
+more common than the rest, like on a real server. The lists are fetched from the stand-in API and held in memory
+before the timing starts. Run with `python benchmarks/bench_materialize.py [--users 50] [--entries 2000]
+[--requests 20000]`.
+"""
+
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+import client  # noqa: E402
+import fake_anilist  # noqa: E402
+from cache import CachedFetcher, ListCache  # noqa: E402
+from catalogue import MediaCatalogue  # noqa: E402
+from fetch import CollectionFetcher  # noqa: E402
+from materialize import RecommendationStore  # noqa: E402
+from server import MediaListStore  # noqa: E402
+
+
+genre_options = [None, ['action'], ['comedy'], ['drama'], ['action', 'comedy'], ['romance', 'drama']]
+bound_options = [(None, None), (None, 12), (10, 30), (24, None)]
+
+
+def make_requests(users: int, requests: int) -> list[argparse.Namespace]:
+    """Returns the arguments of synthetic requests.
+
+    Args:
+        users (int): The number of users.
+        requests (int): The number of requests.
+
+    Returns:
+        list[argparse.Namespace]: The arguments of every request, as `server.parse_query` would return them.
+    """
+    rng = random.Random(0)
+    combinations = [(f'user{user}', genres, bounds) for user in range(users) for genres in genre_options
+                    for bounds in bound_options]
+    rng.shuffle(combinations)
+    # The n-th most common combination is requested about 1/n as often as the most common one.
+    weights = [1 / (rank + 1) for rank in range(len(combinations))]
+
+    return [argparse.Namespace(username=username, type='anime', count=rng.choice([5, 10]), genre=genres,
+                               strict_match=False, lower_bound=bounds[0], upper_bound=bounds[1], adult=False)
+            for username, genres, bounds in rng.choices(combinations, weights, k=requests)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=20_000)
+    arguments = parser.parse_args()
+
+    api = fake_anilist.FakeAniList(arguments.entries)
+    server, client.query_url = fake_anilist.start(api)
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            fetcher = CachedFetcher(CollectionFetcher(500, fields=()), ListCache(os.path.join(directory, 'l.sqlite3')))
+            lists = MediaListStore(fetcher, arguments.users, 24 * 60 * 60, MediaCatalogue())
+            requests = make_requests(arguments.users, arguments.requests)
+
+            computed = RecommendationStore(lists, max_entries=0)
+            materialized = RecommendationStore(lists)
+            for user in range(arguments.users):
+                lists.get(f'user{user}', 'anime')
+            # Descriptions are fetched (and kept in the catalogue) the first time media are recommended, which isn't
+            # part of the measurement.
+            for request in requests:
+                computed.get(request)
+
+            results = {}
+            for name, store in (('computed', computed), ('materialized', materialized)):
+                start = time.perf_counter()
+                results[name] = [store.get(request) for request in requests]
+                elapsed = time.perf_counter() - start
+                print(f'{name:13} {elapsed / len(requests) * 1e6:8.1f} us per request')
+
+            assert results['computed'] == results['materialized']
+            print(f'{arguments.requests:,} requests for {arguments.users:,} users, {len(materialized):,} results kept, '
+                  f'{materialized.hits / arguments.requests:.0%} served from them')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
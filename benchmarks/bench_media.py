@@ -0,0 +1,111 @@
+"""Compares the memory footprint and construction time of `media.Anime` against the previous `__dict__`-based class.
+
+Run with `python benchmarks/bench_media.py [entries]`.
+"""
+
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+from media import Anime  # noqa: E402
+
+
+class DictAnime:
+    """The previous layout of `Anime`: a `__dict__` holding the title dict, the genre list and the description."""
+    def __init__(self, title, user_status, media_status, score, genres, description, adult, episodes, chapters=None,
+                 volumes=None):
+        self.title = title
+        self.user_status = user_status
+        self.media_status = media_status
+        self.score = score
+        self.genres = genres
+        self.description = description
+        self.adult = adult
+        self.episodes = episodes
+        self.chapters = chapters
+        self.volumes = volumes
+
+
+genre_pool = ['Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Romance', 'Sci-Fi', 'Slice of Life']
+
+
+def make_entries(count: int) -> list[dict]:
+    """Returns synthetic entries shaped like the ones decoded from the AniList API.
+
+    Args:
+        count (int): The number of entries.
+
+    Returns:
+        list[dict]: The entries.
+    """
+    rng = random.Random(0)
+    return [{'id': i,
+             'title': {'english': f'Show {i}', 'romaji': f'Shou {i}'},
+             'status': 'FINISHED',
+             'userStatus': 'PLANNING',
+             'averageScore': rng.randint(30, 95),
+             'genres': rng.sample(genre_pool, 3),
+             'description': 'x' * rng.randint(200, 1200),
+             'isAdult': False,
+             'episodes': rng.randint(1, 50)} for i in range(count)]
+
+
+def build(cls, entries: list[dict], keep_descriptions: bool) -> list:
+    """Builds one object per entry.
+
+    Args:
+        cls (type): `Anime` or `DictAnime`.
+        entries (list[dict]): The entries.
+        keep_descriptions (bool): Whether the objects hold the descriptions.
+
+    Returns:
+        list: The objects.
+    """
+    # Each entry gets its own copies, like freshly decoded JSON would.
+    return [cls(dict(entry['title']), ''.join(entry['userStatus']), ''.join(entry['status']), entry['averageScore'],
+                list(entry['genres']), ''.join(entry['description']) if keep_descriptions else None, entry['isAdult'],
+                entry['episodes']) for entry in entries]
+
+
+def measure(cls, entries: list[dict], keep_descriptions: bool) -> tuple[float, float]:
+    """Returns the memory per object and the construction time per object.
+
+    Args:
+        cls (type): `Anime` or `DictAnime`.
+        entries (list[dict]): The entries.
+        keep_descriptions (bool): Whether the objects hold the descriptions.
+
+    Returns:
+        tuple[float, float]: Bytes per object and microseconds per object.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = build(cls, entries, keep_descriptions)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+
+    return size / len(entries), elapsed / len(entries) * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    entries = make_entries(count)
+
+    print(f'{count} entries')
+    for name, cls, keep_descriptions in (('DictAnime (with descriptions)', DictAnime, True),
+                                         ('DictAnime (no descriptions)', DictAnime, False),
+                                         ('Anime (with descriptions)', Anime, True),
+                                         ('Anime (no descriptions)', Anime, False)):
+        size, elapsed = measure(cls, entries, keep_descriptions)
+        print(f'{name:32} {size:8.0f} bytes/entry {elapsed:6.2f} us/entry')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Measures how generating recommendations for many users from their cached lists scales with the number of worker
+processes (`parallel.run_parallel`), against the single process path (`batch.run_batch`), and checks that every run
+gives exactly the same recommendations.
+
+Every user's list is stored in a list cache first (along with its snapshot), and the runs are `--offline`, so what's
+timed is the whole path from a cached list to a written result: the parent making sure the list is cached and handing
+the user out, and the worker mapping the list's snapshot, filtering and ranking it and building the recommendations.
+Starting the workers is included too. `--no-snapshots` deletes the snapshots first, so that every list is decoded and
+built instead, as it was before lists had snapshots.
+Run with `python benchmarks/bench_parallel.py [--users 200] [--entries 10000] [--processes 1 2 4 8]`.
+"""
+
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+import batch  # noqa: E402
+import fake_anilist  # noqa: E402
+import parallel  # noqa: E402
+from cache import ListCache  # noqa: E402
+from fetch import wanted_statuses  # noqa: E402
+
+
+def get_arguments(processes: int) -> argparse.Namespace:
+    """Returns the batch arguments of a run.
+
+    Args:
+        processes (int): The number of worker processes, 0 for the single process path.
+
+    Returns:
+        argparse.Namespace: The arguments, as `args.add_args(batch=True)` would return them.
+    """
+    return argparse.Namespace(type='anime', count=10, genre=['action'], strict_match=False, lower_bound=10,
+                              upper_bound=40, adult=False, rank='score', collaborative=False, fetch_mode='collection',
+                              cache_ttl=24 * 60 * 60, full_sync_ttl=3 * 24 * 60 * 60, refresh=False, offline=True,
+                              workers=4, processes=processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--entries', type=int, default=10_000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--no-snapshots', action='store_true')
+    arguments = parser.parse_args()
+
+    api = fake_anilist.FakeAniList(arguments.entries)
+    usernames = [f'user{user}' for user in range(arguments.users)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The lists are stored in (and read back from) a list cache of their own.
+        os.environ['XDG_CACHE_HOME'] = directory
+        cache = ListCache()
+        for username in usernames:
+            # Lists are stored the way a list query leaves them: without descriptions or tags.
+            entries = [{**entry, 'media': {key: value for key, value in entry['media'].items()
+                                           if key not in ('description', 'tags')}}
+                       for entry in api.get_list(username, 'ANIME') if entry['status'] in wanted_statuses]
+            cache.put(username, 'ANIME', entries, fields=())
+            if arguments.no_snapshots:
+                os.remove(cache.get_snapshot_path(username, 'ANIME'))
+        print(f'{arguments.users} users of {arguments.entries:,} entries, {os.cpu_count()} CPUs')
+
+        baseline = None
+        expected = None
+        for processes in [0, *arguments.processes]:
+            run = parallel.run_parallel if processes else batch.run_batch
+            output = io.StringIO()
+            start = time.perf_counter()
+            summary = run(get_arguments(processes), iter(usernames), output)
+            elapsed = time.perf_counter() - start
+
+            results = [json.loads(line) for line in output.getvalue().splitlines()]
+            assert summary['errors'] == 0
+            if processes:
+                recommendations = [result['recommendations'] for result in results]
+            else:
+                # The single process path writes users as they complete, so they're put back in order to compare.
+                order = {username: position for position, username in enumerate(usernames)}
+                recommendations = [result['recommendations']
+                                   for result in sorted(results, key=lambda result: order[result['username']])]
+            expected = expected or recommendations
+            assert recommendations == expected
+
+            if not processes:
+                baseline = elapsed
+                print(f'single process (batch.py): {elapsed:8.2f} s')
+                continue
+            speedup = baseline / elapsed
+            print(f'{processes} process{"es" if processes > 1 else "":2} (parallel.py): {elapsed:8.2f} s, '
+                  f'speedup {speedup:5.2f}x, efficiency {speedup / processes:6.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Compares top-k selection (`filter.top_k`) against sorting the whole list with `sorted()`.
+
+Run with `python benchmarks/bench_rank.py [count]`.
+"""
+
+
+import heapq
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+from filter import score_key, top_k  # noqa: E402
+from media import Anime  # noqa: E402
+
+
+def make_media(size: int) -> list[Anime]:
+    """Returns synthetic anime, with some unscored entries and plenty of ties.
+
+    Args:
+        size (int): The number of entries.
+
+    Returns:
+        list[Anime]: The entries.
+    """
+    rng = random.Random(0)
+    return [Anime({'english': f'Show {i}', 'romaji': None}, 'PLANNING', 'FINISHED',
+                  None if rng.random() < 0.05 else rng.randint(30, 95), ['Action'], None, False, 12, media_id=i)
+            for i in range(size)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    for size in (1_000, 10_000, 100_000):
+        media_list = make_media(size)
+        assert top_k(media_list, count) == sorted(media_list, key=score_key, reverse=True)[:count]
+
+        repeats = max(1, 200_000 // size)
+        timings = {
+            'sorted()[:k]': timeit.timeit(lambda: sorted(media_list, key=score_key, reverse=True)[:count],
+                                          number=repeats),
+            'heapq.nlargest': timeit.timeit(lambda: heapq.nlargest(count, media_list, key=score_key), number=repeats),
+            'top_k': timeit.timeit(lambda: top_k(media_list, count), number=repeats),
+            'top_k (generator)': timeit.timeit(lambda: top_k((media for media in media_list), count), number=repeats),
+        }
+
+        print(f'{size} entries, k = {count}')
+        for name, elapsed in timings.items():
+            print(f'    {name:20} {elapsed / repeats * 1e3:8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Measures how long similarity ranking (`rank.rank_similarity`) takes for one user, at several candidate counts.
+
+Run with `python benchmarks/bench_similarity.py`.
+"""
+
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+import fake_anilist  # noqa: E402
+from media import Anime  # noqa: E402
+from rank import rank_similarity  # noqa: E402
+
+
+def make_candidates(api: fake_anilist.FakeAniList, size: int) -> list[Anime]:
+    """Returns synthetic candidates, built like the ones on a user's list.
+
+    Args:
+        api (fake_anilist.FakeAniList): The stand-in API, used for its synthetic media.
+        size (int): The number of candidates.
+
+    Returns:
+        list[Anime]: The candidates.
+    """
+    candidates = []
+    for media_id in range(1, size + 1):
+        media = api.make_media(media_id, 'ANIME')
+        candidates.append(Anime(media['title'], 'PLANNING', media['status'], media['averageScore'], media['genres'],
+                                None, media['isAdult'], media['episodes'], media_id=media_id, tags=media['tags']))
+
+    return candidates
+
+
+def main():
+    api = fake_anilist.FakeAniList()
+    rng = random.Random(0)
+    completed = [{'score': rng.choice([0, rng.randint(30, 100)]), 'media': api.make_media(media_id, 'ANIME')}
+                 for media_id in range(1_000_000, 1_000_500)]
+
+    for size in (1_000, 10_000, 50_000):
+        candidates = make_candidates(api, size)
+        rank_similarity(candidates, completed, 5)
+
+        repeats = max(3, 100_000 // size)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            rank_similarity(candidates, completed, 5)
+        elapsed = (time.perf_counter() - start) / repeats
+
+        print(f'{size:6} candidates, {len(completed)} completed entries: {elapsed * 1e3:7.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Compares loading a media list from JSON (decoding it and building an `Anime` per entry, as a list without a
+snapshot is loaded from the list cache) against opening a columnar snapshot of it (`snapshot.Snapshot`), and then
+filtering and ranking either one.
+
+Run with `python benchmarks/bench_snapshot.py [--entries 100000]`.
+"""
+
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+import filter  # noqa: E402
+import snapshot  # noqa: E402
+from user import build_media  # noqa: E402
+
+
+genre_pool = ['Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Romance', 'Sci-Fi', 'Slice of Life']
+
+
+def make_entries(count: int) -> list[dict]:
+    """Returns synthetic media shaped like the ones decoded from the AniList API.
+
+    Args:
+        count (int): The number of entries.
+
+    Returns:
+        list[dict]: The media, with the fields in `fetch.media_fields` and a description.
+    """
+    rng = random.Random(0)
+    return [{'id': i,
+             'title': {'english': f'Show {i}', 'romaji': f'Shou {i}'},
+             'status': 'FINISHED',
+             'averageScore': rng.choice([None, rng.randint(30, 95)]),
+             'genres': rng.sample(genre_pool, 3),
+             'tags': [{'name': f'Tag {rng.randint(0, 300)}', 'rank': rng.randint(0, 100)} for _ in range(5)],
+             'description': 'x' * rng.randint(200, 1200),
+             'isAdult': rng.random() < 0.1,
+             'episodes': rng.randint(1, 50)} for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--entries', type=int, default=100_000)
+    arguments = parser.parse_args()
+
+    query = argparse.Namespace(genre=['Action'], strict_match=False, adult=False, lower_bound=10, upper_bound=40,
+                               count=10)
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'list.json')
+        snapshot_path = os.path.join(directory, 'list.snapshot')
+        with open(json_path, 'w') as file:
+            json.dump(make_entries(arguments.entries), file)
+
+        start = time.perf_counter()
+        with open(json_path) as file:
+            media_list = [build_media(media, 'ANIME', 'PLANNING') for media in json.load(file)]
+        loaded = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = filter.recommend(media_list, query)
+        ranked = time.perf_counter() - start
+
+        start = time.perf_counter()
+        snapshot.write_snapshot(media_list, snapshot_path)
+        written = time.perf_counter() - start
+        del media_list
+
+        start = time.perf_counter()
+        with snapshot.Snapshot(snapshot_path) as media_snapshot:
+            opened = time.perf_counter() - start
+            start = time.perf_counter()
+            recommendations = media_snapshot.recommend(query)
+            snapshot_ranked = time.perf_counter() - start
+
+        assert [media.to_dict() for media in recommendations] == [media.to_dict() for media in expected]
+
+        print(f'{arguments.entries:,} entries, snapshot of {os.path.getsize(snapshot_path) / 2 ** 20:.1f} MiB '
+              f'(written in {written * 1e3:.0f} ms), NumPy {"on" if snapshot.np is not None else "off"}')
+        print(f'JSON + Anime objects: load {loaded * 1e3:8.1f} ms, filter and rank {ranked * 1e3:7.1f} ms')
+        print(f'snapshot:             open {opened * 1e3:8.2f} ms, filter and rank {snapshot_ranked * 1e3:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Compares the peak memory and wall time of recommending from a user's list, through the list cache like a normal run,
+when:
+
+- the whole list is fetched and decoded before anything is built (`CachedFetcher.fetch`),
+- each chunk of the list is decoded once it has been downloaded, and its entries passed on one by one,
+- each chunk is parsed while it's being downloaded (`stream.EntryStream`).
+
+Lists are fetched in a single request by default, as large as the stand-in API allows. The stand-in API runs in a
+process of its own, so that only the recommender's memory is traced.
+
+Run with `python benchmarks/bench_stream.py [--sizes 5000 50000] [--per-chunk 500]`.
+"""
+
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Iterator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+import client  # noqa: E402
+from cache import CachedFetcher, ListCache  # noqa: E402
+from fetch import CollectionFetcher  # noqa: E402
+from filter import recommend  # noqa: E402
+from media import Anime, Manga  # noqa: E402
+from user import User, build_media  # noqa: E402
+
+
+query = argparse.Namespace(genre=['action'], strict_match=False, adult=False, lower_bound=None, upper_bound=None,
+                           count=10)
+
+
+def run(cache: ListCache, per_chunk: int, mode: str, trace: bool) -> tuple[list[dict], float, int]:
+    """Recommends from the list of 'user', downloading it again.
+
+    Args:
+        cache (ListCache): The list cache, which is cleared first.
+        per_chunk (int): The number of entries requested per chunk.
+        mode (str): `whole`, `chunk` or `stream` (see above).
+        trace (bool): Whether to trace memory allocations.
+
+    Returns:
+        tuple[list[dict], float, int]: The recommendations, the wall time and the traced peak (0 if not traced).
+    """
+    cache.clear()
+    fetcher = CachedFetcher(CollectionFetcher(per_chunk, fields=(), stream=mode == 'stream'), cache)
+
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    media_iterable: Iterator[Anime | Manga]
+    if mode == 'whole':
+        media_iterable = (build_media(entry['media'], 'ANIME', entry['status'])
+                          for entry in fetcher.fetch('user', 'ANIME'))
+    else:
+        media_iterable = User('user', fetcher).iter_anime_list()
+    recommendations = [media.to_dict() for media in recommend(media_iterable, query)]
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return recommendations, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[5_000, 50_000])
+    parser.add_argument('--per-chunk', type=int, help='Defaults to the whole list in a single chunk.')
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ListCache(os.path.join(directory, 'lists.sqlite3'))
+
+        for size in arguments.sizes:
+            server = subprocess.Popen([sys.executable, '-u', os.path.join(os.path.dirname(__file__), 'fake_anilist.py'),
+                                       '--port', '0', '--list-size', str(size), '--requests-per-minute', '1000000'],
+                                      stdout=subprocess.PIPE, text=True)
+            client.query_url = server.stdout.readline().split()[-1]
+            per_chunk = arguments.per_chunk or size
+
+            try:
+                print(f'{size:,} entries on the list, {per_chunk:,} per chunk')
+                # The stand-in API generates the list on its first request, which isn't part of any measurement.
+                run(cache, per_chunk, 'chunk', False)
+                results = {}
+                for mode, name in (('whole', 'whole list decoded'), ('chunk', 'chunks decoded'),
+                                   ('stream', 'streamed')):
+                    results[mode], elapsed, _ = run(cache, per_chunk, mode, False)
+                    _, _, peak = run(cache, per_chunk, mode, True)
+                    print(f'    {name:20} {elapsed * 1e3:9.1f} ms {peak / 2 ** 20:9.1f} MiB at the peak')
+
+                assert results['whole'] == results['chunk'] == results['stream']
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    main()
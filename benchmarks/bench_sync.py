@@ -0,0 +1,79 @@
+"""Counts the requests made for cached lists whose last full download is older than a day, in batch mode.
+
+Such a list is synced (only the entries that changed are downloaded), and its media keep the data of the last full
+download (see `cache.CachedFetcher`). The shared media catalogue mustn't treat that data as stale and refresh every
+piece of media by ID, which takes a request per 50 media, when downloading the whole list again takes one per 500.
+Run with `python benchmarks/bench_sync.py [--users 20] [--entries 1000] [--age 172800]`.
+"""
+
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anilist-recommender'))
+
+import batch  # noqa: E402
+import client  # noqa: E402
+import fake_anilist  # noqa: E402
+from cache import CachedFetcher, ListCache  # noqa: E402
+from fetch import CollectionFetcher  # noqa: E402
+
+
+def get_arguments() -> argparse.Namespace:
+    """Returns the batch arguments of the run.
+
+    Returns:
+        argparse.Namespace: The arguments, as `args.add_args(batch=True)` would return them, except that every stored
+        list counts as stale (`cache_ttl` is 0), so that each one is synced.
+    """
+    return argparse.Namespace(type='anime', count=10, genre=['action'], strict_match=False, lower_bound=None,
+                              upper_bound=None, adult=False, rank='score', collaborative=False, fetch_mode='collection',
+                              cache_ttl=0, full_sync_ttl=3 * 24 * 60 * 60, refresh=False, offline=False, workers=4,
+                              processes=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--entries', type=int, default=1000)
+    parser.add_argument('--age', type=float, default=2 * 24 * 60 * 60,
+                        help='How long ago (in seconds) the lists were last downloaded in full.')
+    arguments = parser.parse_args()
+
+    api = fake_anilist.FakeAniList(arguments.entries)
+    server, client.query_url = fake_anilist.start(api)
+    usernames = [f'user{user}' for user in range(arguments.users)]
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ['XDG_CACHE_HOME'] = directory
+            cache = ListCache()
+            fetcher = CachedFetcher(CollectionFetcher(fields=()), cache)
+
+            api.reset_counters()
+            for username in usernames:
+                # Stored again as if the download happened `age` seconds ago.
+                cache.put(username, 'ANIME', fetcher.fetch(username, 'ANIME'), None, time.time() - arguments.age, ())
+            full_downloads = api.requests
+
+            api.reset_counters()
+            summary = batch.run_batch(get_arguments(), iter(usernames), io.StringIO())
+            assert summary['errors'] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(f'{arguments.users} users of {arguments.entries:,} entries, last downloaded in full '
+          f'{arguments.age / 3600:.0f} hours ago')
+    print(f'    downloading the lists in full: {full_downloads:6} requests')
+    print(f'    syncing and ranking the lists: {api.requests:6} requests')
+    # A sync and a request for the descriptions of the recommendations per user, at most.
+    assert api.requests <= 2 * arguments.users, 'the media of synced lists were refreshed by ID'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""A local stand-in for the AniList GraphQL API, serving synthetic media lists so that the fetch path can be measured
+without touching the real API.
+
+It understands the queries this project sends (`GenreCollection`, `Page.mediaList`, `MediaListCollection` and
+`Page.media(id_in: ...)`), and only returns the fields that a query selects, like the real API. Every user has a
+synthetic list of `list_size` entries. Latency, the per-minute rate limit (with AniList's rate-limit headers) and
+randomly injected 429 responses can all be configured.
+
+Run it on its own with `python benchmarks/fake_anilist.py --port 8081 --list-size 5000`, and point the recommender at
+it with `ANILIST_API_URL=http://127.0.0.1:8081`.
+"""
+
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+genres = ['Action', 'Adventure', 'Comedy', 'Drama', 'Ecchi', 'Fantasy', 'Hentai', 'Horror', 'Mahou Shoujo', 'Mecha',
+          'Music', 'Mystery', 'Psychological', 'Romance', 'Sci-Fi', 'Slice of Life', 'Sports', 'Supernatural',
+          'Thriller']
+tags = ['Male Protagonist', 'Female Protagonist', 'Ensemble Cast', 'School', 'Time Skip', 'Military', 'Magic',
+        'Space', 'Tragedy', 'Iyashikei', 'Isekai', 'Mecha', 'Coming of Age', 'Detective', 'Survival', 'Idol']
+statuses = ['PLANNING', 'PAUSED', 'COMPLETED', 'DROPPED', 'CURRENT']
+
+
+def parse_selection(query: str) -> dict:
+    """Parses the selection sets of a GraphQL query into a tree of field names.
+
+    Only what this project's queries use is supported: arguments (in parentheses) are skipped, and there are no
+    fragments or aliases.
+
+    Args:
+        query (str): The GraphQL query.
+
+    Returns:
+        dict: The selected fields, each mapped to its own selection (or `None` for leaf fields).
+    """
+    # Arguments can contain nested brackets, so they're removed from the inside out.
+    while (stripped := re.sub(r'\([^()]*\)', ' ', query)) != query:
+        query = stripped
+
+    tokens = re.findall(r'[{}]|[A-Za-z_][A-Za-z0-9_]*', query)
+    root: dict = {}
+    stack = [root]
+    last = None
+
+    # Skips the leading `query` keyword (and operation name) up to the first `{`.
+    tokens = tokens[tokens.index('{') + 1:]
+    for token in tokens:
+        if token == '{':
+            stack[-1][last] = {}
+            stack.append(stack[-1][last])
+        elif token == '}':
+            stack.pop()
+            if len(stack) == 0:
+                break
+        else:
+            stack[-1][token] = None
+            last = token
+
+    return root
+
+
+def project(value, selection: dict | None):
+    """Returns `value` with only the fields in `selection` kept, recursively.
+
+    Args:
+        value: A JSON value.
+        selection (dict | None): The selected fields (see `parse_selection`).
+
+    Returns:
+        The projected JSON value.
+    """
+    if selection is None or value is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, selection) for item in value]
+
+    return {name: project(value.get(name), subselection) for name, subselection in selection.items()}
+
+
+class FakeAniList:
+    """The state of the stand-in API: its configuration, its synthetic data and its counters.
+
+    Attributes:
+        list_size (int): The number of entries on every user's list.
+        latency (float): The number of seconds every response is delayed by.
+        requests_per_minute (int): The per-minute request budget, after which 429 responses are returned.
+        throttle_probability (float): The probability of a 429 being returned regardless of the budget.
+        requests (int): The number of requests received.
+        throttled (int): The number of 429 responses sent.
+        bytes_sent (int): The number of response body bytes sent.
+    """
+    def __init__(self, list_size: int = 1000, latency: float = 0.0, requests_per_minute: int = 1_000_000,
+                 throttle_probability: float = 0.0, seed: int = 0) -> None:
+        """Initialises the `FakeAniList` class.
+
+        Args:
+            list_size (int): The number of entries on every user's list.
+            latency (float): The number of seconds every response is delayed by.
+            requests_per_minute (int): The per-minute request budget, after which 429 responses are returned.
+            throttle_probability (float): The probability of a 429 being returned regardless of the budget.
+            seed (int): The seed of the synthetic data.
+        """
+        self.list_size = list_size
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        self.throttle_probability = throttle_probability
+        self.seed = seed
+
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+
+        self._recent: deque[float] = deque()
+        self._lists: dict[tuple[str, str], list[dict]] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def reset_counters(self) -> None:
+        """Sets the request, throttle and byte counters back to 0."""
+        with self._lock:
+            self.requests = self.throttled = self.bytes_sent = 0
+            self._recent.clear()
+
+    def make_media(self, media_id: int, media_type: str) -> dict:
+        """Returns a synthetic piece of media, which is the same every time for the same ID.
+
+        Args:
+            media_id (int): The ID of the media.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            dict: The media, with every field the project might ask for.
+        """
+        rng = random.Random(media_id * 7919 + self.seed)
+        releasing = rng.random() < 0.1
+
+        return {'id': media_id,
+                'title': {'english': f'Title {media_id}' if rng.random() < 0.7 else None,
+                          'romaji': f'Taitoru {media_id}'},
+                'status': 'RELEASING' if releasing else 'FINISHED',
+                'episodes': None if releasing or media_type == 'MANGA' else rng.randint(1, 64),
+                'chapters': None if releasing or media_type == 'ANIME' else rng.randint(1, 400),
+                'volumes': None if releasing or media_type == 'ANIME' else rng.randint(1, 40),
+                'isAdult': rng.random() < 0.03,
+                'genres': rng.sample(genres, rng.randint(1, 4)),
+                'tags': [{'name': tag, 'rank': rng.randint(20, 100)} for tag in rng.sample(tags, rng.randint(0, 5))],
+                'description': ' '.join(['Lorem ipsum dolor sit amet.'] * rng.randint(5, 40)) + '<br><br>(Source: X)',
+                'averageScore': None if rng.random() < 0.05 else rng.randint(20, 95),
+                'popularity': rng.randint(100, 500_000)}
+
+    def get_list(self, username: str, media_type: str) -> list[dict]:
+        """Returns a user's synthetic list (including every status), most recently updated last.
+
+        Args:
+            username (str): The user's username.
+            media_type (str): The type of media, either 'ANIME' or 'MANGA'.
+
+        Returns:
+            list[dict]: The entries of the user's list.
+        """
+        key = (username.lower(), media_type)
+
+        with self._lock:
+            if key not in self._lists:
+                rng = random.Random(f'{self.seed}:{key}')
+                media_ids = rng.sample(range(1, self.list_size * 20), self.list_size)
+                self._lists[key] = [{'status': rng.choice(statuses),
+                                     'score': rng.choice([0, rng.randint(10, 100)]),
+                                     'updatedAt': 1_600_000_000 + position,
+                                     'media': self.make_media(media_id, media_type)}
+                                    for position, media_id in enumerate(media_ids)]
+
+        return self._lists[key]
+
+    def resolve(self, query: str, variables: dict) -> dict:
+        """Answers a query.
+
+        Args:
+            query (str): The GraphQL query.
+            variables (dict): The query's variables.
+
+        Returns:
+            dict: The `data` part of the response, with only the selected fields.
+        """
+        selection = parse_selection(query)
+
+        if 'GenreCollection' in selection:
+            return {'GenreCollection': genres}
+
+        if 'MediaListCollection' in selection:
+            wanted = variables.get('statusIn')
+            entries = [entry for entry in self.get_list(variables['userName'], variables['type'])
+                       if wanted is None or entry['status'] in wanted]
+            chunk, per_chunk = variables.get('chunk') or 1, variables.get('perChunk') or 500
+            collection = {'lists': [{'entries': entries[(chunk - 1) * per_chunk:chunk * per_chunk]}],
+                          'hasNextChunk': chunk * per_chunk < len(entries)}
+            return project({'MediaListCollection': collection}, selection)
+
+        page_selection = selection['Page']
+        page, per_page = variables.get('page') or 1, min(variables.get('perPage') or 50, 50)
+        data: dict = {}
+
+        if 'media' in page_selection:
+            media_type = variables.get('type') or 'ANIME'
+            data['media'] = [self.make_media(media_id, media_type) for media_id in variables['ids']][:per_page]
+        else:
+            entries = self.get_list(variables['userName'], variables['type'])
+            if 'UPDATED_TIME_DESC' in query:
+                entries = entries[::-1]
+            data['mediaList'] = entries[(page - 1) * per_page:page * per_page]
+            data['pageInfo'] = {'lastPage': max(1, -(-len(entries) // per_page)), 'total': len(entries)}
+
+        return project({'Page': data}, selection)
+
+    def admit(self) -> tuple[bool, int]:
+        """Counts a request against the per-minute budget.
+
+        Returns:
+            tuple[bool, int]: Whether the request is allowed, and the number of requests left in the budget.
+        """
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+
+            if len(self._recent) >= self.requests_per_minute or self._random.random() < self.throttle_probability:
+                self.throttled += 1
+                return False, max(0, self.requests_per_minute - len(self._recent))
+
+            self._recent.append(now)
+            return True, self.requests_per_minute - len(self._recent)
+
+
+class FakeAniListHandler(BaseHTTPRequestHandler):
+    """Handles the GraphQL requests made to the stand-in API."""
+    api: FakeAniList
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, Nagle's algorithm would hold the body back for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_POST(self) -> None:
+        """Answers a GraphQL query."""
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+        if self.api.latency:
+            time.sleep(self.api.latency)
+
+        allowed, remaining = self.api.admit()
+        body: dict
+        headers = {'X-RateLimit-Limit': str(self.api.requests_per_minute), 'X-RateLimit-Remaining': str(remaining)}
+
+        if not allowed:
+            status, body = 429, {'data': None, 'errors': [{'message': 'Too Many Requests.', 'status': 429}]}
+            headers['Retry-After'] = '1'
+        else:
+            try:
+                status, body = 200, {'data': self.api.resolve(payload['query'], payload.get('variables') or {})}
+            except (KeyError, TypeError, ValueError) as error:
+                status, body = 400, {'data': None, 'errors': [{'message': f'bad query: {error!r}', 'status': 400}]}
+
+        encoded = json.dumps(body).encode()
+        with self.api._lock:
+            self.api.bytes_sent += len(encoded)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format: str, *args) -> None:
+        """Silences the per-request logging of `BaseHTTPRequestHandler`."""
+
+
+def start(api: FakeAniList, host: str = '127.0.0.1', port: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    """Starts the stand-in API on a background thread.
+
+    Args:
+        api (FakeAniList): The state of the stand-in API.
+        host (str): The address to listen on.
+        port (int): The port to listen on, or 0 for any free port.
+
+    Returns:
+        tuple[ThreadingHTTPServer, str]: The running server (call `shutdown` on it to stop it) and its URL.
+    """
+    handler = type('BoundFakeAniListHandler', (FakeAniListHandler,), {'api': api})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A local stand-in for the AniList GraphQL API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=8081, type=int)
+    parser.add_argument('--list-size', default=1000, type=int)
+    parser.add_argument('--latency', default=0.0, type=float)
+    parser.add_argument('--requests-per-minute', default=90, type=int)
+    parser.add_argument('--throttle-probability', default=0.0, type=float)
+    arguments = parser.parse_args()
+
+    api = FakeAniList(arguments.list_size, arguments.latency, arguments.requests_per_minute,
+                      arguments.throttle_probability)
+    server, url = start(api, arguments.host, arguments.port)
+    print(f'Fake AniList API on {url}')
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()